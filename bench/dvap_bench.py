@@ -0,0 +1,298 @@
+"""Offline benchmarks for the DVAP servers' hot paths.
+
+Loads gdb/DVAP_gdb_server.py and lldb/DVAP_lldb_server.py against the
+stand-in debugger modules in bench/fakes and drives the handlers
+directly, without a debugger or a network client:
+
+    python bench/dvap_bench.py --threads 64 --breakpoints 32 --clients 16
+
+Reports per-call latency of the breakpoint and stop handlers, _state_str
+and the per-view encoders, bytes per message, and SSEDispatcher.broadcast
+fan-out throughput. --json prints the same numbers for scripts that
+compare runs.
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import queue
+import statistics
+import sys
+import time
+import urllib.parse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(HERE, 'fakes'))
+
+import gdb   # noqa: E402  (the fakes above)
+import lldb  # noqa: E402
+
+
+class _GdbHarness:
+    """DVAP_gdb_server.py loaded against the fake gdb module. The server
+    threads are stopped unless serve is set."""
+    name = "gdb"
+    stop_handler = "_on_stop"
+    bp_handler   = "_on_bp_created"
+
+    def __init__(self, args, serve=False):
+        inferior = gdb.fake_session(args.threads, 0, args.files, inferiors=args.inferiors,
+                                    locations=args.locations)
+        port = gdb.Parameter('dvap-port', gdb.COMMAND_NONE, gdb.PARAM_INTEGER)
+        port.value = 0  # any free port; nothing connects to it
+        gdb._dvap_port_param = port
+        path = os.path.join(ROOT, 'gdb', 'DVAP_gdb_server.py')
+        self.ns = {'__file__': path, '__name__': 'DVAP_gdb_server'}
+        with contextlib.redirect_stdout(io.StringIO()):
+            exec(compile(open(path).read(), path, 'exec'), self.ns)
+            self.inst = gdb._dvap_instance
+            while self.inst._state["syncing"]:
+                gdb.run_posted()  # the initial sync's slices
+                time.sleep(0.001)
+            if not serve:
+                self.inst.shutdown()  # stop the server threads; handlers still work
+        self.threads = list(inferior.threads())
+
+    def fast_step(self, scheduler_locking):
+        """Make every stop end a step, with dvap-set fast-step on."""
+        self.inst.fast_step = True
+        gdb.set_parameter('scheduler-locking', scheduler_locking)
+
+    def move(self, thread):
+        gdb.move(thread)
+
+    def stop(self):
+        if self.inst.fast_step:
+            # All-stop GDB leaves inferior_thread None, whatever scheduler-locking held.
+            self.inst._on_cont(gdb.ContinueEvent())
+            self.inst._on_stop(gdb.StopEvent({'reason': 'end-stepping-range'}))
+        else:
+            self.inst._on_stop(gdb.StopEvent())
+        gdb.run_posted()  # the coalesced refresh, and a posted lazy one
+
+    def add_breakpoint(self):
+        return gdb.add_breakpoint()
+
+    def bp_created(self, bp):
+        self.inst._on_bp_created(bp)
+
+
+class _LldbHarness:
+    """DVAP_lldb_server.py loaded against the fake lldb module. The server
+    threads are stopped unless serve is set."""
+    name = "lldb"
+    stop_handler = "_on_process_changed"
+    bp_handler   = "_on_bp_changed"
+
+    def __init__(self, args, serve=False):
+        self.debugger = lldb.fake_session(args.threads, 0, args.files, targets=args.inferiors,
+                                          locations=args.locations)
+        lldb._dvap_port = 0
+        path = os.path.join(ROOT, 'lldb', 'DVAP_lldb_server.py')
+        spec = importlib.util.spec_from_file_location('DVAP_lldb_server', path)
+        mod  = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = mod
+        with contextlib.redirect_stdout(io.StringIO()):
+            spec.loader.exec_module(mod)
+            getattr(mod, '__lldb_init_module')(self.debugger, {})
+            self.inst = lldb._dvap_instance
+            while self.inst._state["syncing"]:  # done by the event loop thread
+                time.sleep(0.001)
+            if not serve:
+                self.inst.shutdown()
+        self.ns      = vars(mod)
+        self.threads = list(self.debugger.target.process)
+
+    def move(self, thread):
+        lldb.move(thread)
+
+    def stop(self):
+        self.inst._on_process_changed([self.debugger.target.process])
+
+    def add_breakpoint(self):
+        return lldb.add_breakpoint(self.debugger)
+
+    def bp_created(self, bp):
+        self.inst._on_bp_changed(bp)
+
+
+def _timed(fn, *args):
+    t0 = time.perf_counter_ns()
+    fn(*args)
+    return time.perf_counter_ns() - t0
+
+
+def _summary(samples):
+    """Latency summary in microseconds."""
+    samples = sorted(samples)
+    return {
+        "median_us": statistics.median(samples) / 1e3,
+        "p95_us":    samples[int(len(samples) * 0.95) - 1 if len(samples) > 1 else 0] / 1e3,
+        "mean_us":   statistics.fmean(samples) / 1e3,
+    }
+
+
+def _drain(q, paths, sent):
+    """Empty one client queue. Returns (messages, bytes, sent)."""
+    unpack, msgs, size = _drain.unpack, 0, 0
+    while True:
+        try:
+            msg = q.get(timeout=0)
+        except queue.Empty:
+            return msgs, size, sent
+        msg, sent = unpack(msg, sent, paths)
+        msgs += 1
+        size += len(msg)
+
+
+_VIEW_QUERY = {"text": {}, "interned": {"paths": ["interned"]}, "binary": {"format": ["binary"]}}
+
+
+def run(harness, args):
+    ns, inst = harness.ns, harness.inst
+    _drain.unpack = ns['_unpack']
+    result = {"handlers": {}, "encode": {}}
+
+    # Breakpoint handler: every call resolves a location it has not seen.
+    samples = []
+    for _ in range(args.breakpoints):
+        bp = harness.add_breakpoint()
+        samples.append(_timed(harness.bp_created, bp))
+    if samples:
+        result["handlers"][harness.bp_handler] = _summary(samples)
+
+    # Stop handler: args.moved threads advance one line per stop.
+    samples = []
+    for _ in range(args.iterations):
+        for thread in harness.threads[:args.moved]:
+            harness.move(thread)
+        samples.append(_timed(harness.stop))
+    result["handlers"][harness.stop_handler] = _summary(samples)
+
+    samples = [_timed(inst._state_str) for _ in range(args.iterations)]
+    result["handlers"]["_state_str"] = _summary(samples)
+
+    # Encoders: a fresh snapshot per call, so nothing comes from its cache.
+    prev = inst._records()
+    for thread in harness.threads[:args.moved]:
+        harness.move(thread)
+    harness.stop()
+    records  = inst._records()
+    Snapshot = ns['_Snapshot']
+    View     = ns['_View']
+    views    = {"text": View(), "interned": View(interned=True),
+                "binary": View(interned=True, binary=True)}
+    for name, view in views.items():
+        samples = []
+        for seq in range(args.iterations):
+            snap = Snapshot(seq + 1, records, prev, inst._encode)
+            samples.append(_timed(snap.payloads, view))
+        full, delta, _, _ = snap.payloads(view)
+        result["encode"][name] = dict(_summary(samples),
+                                      full_bytes=len(full), delta_bytes=len(delta))
+
+    # Fan-out: args.clients subscribers, drained between broadcasts.
+    disp    = ns['SSEDispatcher'](conflate=args.slow_clients == 'latest', paths=inst._paths)
+    query   = dict(urllib.parse.parse_qs(args.filter), **_VIEW_QUERY[args.view])
+    view    = ns['_subscription'](query)[1]
+    clients = [[disp.subscribe(args.mode, view), 0] for _ in range(args.clients)]
+    for c in clients:
+        c[1] = _drain(c[0], inst._paths, 0)[2]
+    snap = Snapshot(1, records, {}, inst._encode)
+    samples, delivered, size = [], 0, 0
+    for _ in range(args.iterations):
+        harness.move(harness.threads[0])
+        harness.stop()
+        snap = Snapshot(snap.seq + 1, inst._records(), snap.records, inst._encode)
+        samples.append(_timed(disp.broadcast, snap))
+        for c in clients:
+            msgs, nbytes, c[1] = _drain(c[0], inst._paths, c[1])
+            delivered += msgs
+            size      += nbytes
+    disp.shutdown()
+    elapsed = sum(samples) / 1e9
+    result["broadcast"] = dict(_summary(samples),
+                               clients=args.clients, mode=args.mode, view=args.view,
+                               filter=args.filter,
+                               broadcasts_per_s=len(samples) / elapsed,
+                               deliveries_per_s=delivered / elapsed,
+                               bytes_per_delivery=size / delivered if delivered else 0)
+
+    lines = inst._lines
+    result["line_cache"] = {"hits": lines.hits, "misses": lines.misses}
+    return result
+
+
+def _print(name, result):
+    print(name)
+    for handler, s in result["handlers"].items():
+        print(f"  {handler:<22} median {s['median_us']:9.1f} us"
+              f"   p95 {s['p95_us']:9.1f} us")
+    for view, s in result["encode"].items():
+        print(f"  {'encode ' + view:<22} median {s['median_us']:9.1f} us"
+              f"   p95 {s['p95_us']:9.1f} us"
+              f"   full {s['full_bytes']:7d} B   delta {s['delta_bytes']:5d} B")
+    b = result["broadcast"]
+    print(f"  {'broadcast':<22} median {b['median_us']:9.1f} us"
+          f"   p95 {b['p95_us']:9.1f} us"
+          f"   {b['clients']} x {b['mode']}/{b['view']}"
+          + (f"?{b['filter']}" if b['filter'] else "") + ":"
+          f" {b['broadcasts_per_s']:.0f} broadcasts/s,"
+          f" {b['deliveries_per_s']:.0f} deliveries/s,"
+          f" {b['bytes_per_delivery']:.0f} B/delivery")
+    c = result["line_cache"]
+    print(f"  {'line cache':<22} {c['hits']} hits, {c['misses']} misses")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--debugger', choices=('gdb', 'lldb', 'both'), default='both')
+    parser.add_argument('--threads', type=int, default=64, help="threads per inferior")
+    parser.add_argument('--inferiors', type=int, default=1,
+                        help="inferiors (LLDB: targets); only the first one stops")
+    parser.add_argument('--breakpoints', type=int, default=32)
+    parser.add_argument('--files', type=int, default=16,
+                        help="distinct source files the threads are spread over")
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--locations', type=int, default=0,
+                        help="park the threads on this many shared lines (0: one line each)")
+    parser.add_argument('--moved', type=int, default=1,
+                        help="threads that advance a line on each stop")
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--fast-step', action='store_true',
+                        help="GDB: stops end steps, with dvap-set fast-step on")
+    parser.add_argument('--scheduler-locking', choices=('off', 'on', 'step', 'replay'),
+                        default='replay', help="GDB's scheduler-locking for --fast-step steps")
+    parser.add_argument('--mode', choices=('full', 'delta'), default='full')
+    parser.add_argument('--view', choices=('text', 'interned', 'binary'), default='text')
+    parser.add_argument('--slow-clients', choices=('latest', 'drop'), default='latest')
+    parser.add_argument('--filter', default='',
+                        help="more /events query for the fan-out clients,"
+                             " e.g. threads=selected or threads=grouped")
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    harnesses = {"gdb": _GdbHarness, "lldb": _LldbHarness}
+    names     = list(harnesses) if args.debugger == 'both' else [args.debugger]
+    results   = {}
+    for name in names:
+        harness = harnesses[name](args)
+        if args.fast_step and name == 'gdb':
+            harness.fast_step(args.scheduler_locking)
+        results[name] = run(harness, args)
+    if args.json:
+        json.dump({"args": vars(args), "results": results}, sys.stdout, indent=2)
+        print()
+        return
+    print(f"DVAP benchmark: {args.inferiors} x {args.threads} threads,"
+          f" {args.breakpoints} breakpoints,"
+          f" {args.files} files, {args.iterations} iterations")
+    for name, result in results.items():
+        _print(name, result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""End-to-end load test for a DVAP server: stop-to-client latency under
+many subscribers.
+
+Serves DVAP_gdb_server.py or DVAP_lldb_server.py against the stand-in
+debugger modules in bench/fakes on a loopback port, attaches --clients
+SSE connections from a separate process, drives synthetic stops and
+breakpoint events, and reports how long each stop took to reach the
+clients:
+
+    python bench/dvap_load.py --clients 200 --stops 500 --rate 100
+
+Every stop moves thread 1 of inferior 1 one line down, so each client
+can tell from that thread's record which stops it has seen. A client
+skipped ahead by conflation counts a stop as delivered when it sees a
+later one. --max-p50, --max-p99, --max-drops and --min-deliveries turn
+the report into a check: the exit status is 1 if any threshold is
+missed. --relay serves the clients from the relay process instead
+(dvap-set relay on).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import selectors
+import socket
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, 'fakes'))
+
+import gdb          # noqa: E402  (the fakes above)
+import lldb         # noqa: E402
+import dvap_bench   # noqa: E402
+
+# thread 1 of inferior 1 in a text record; {file} may be a path or an id
+_THREAD_1 = re.compile(rb"(?:\|\||: )thread;;1;;t;;[^;|]*;;(\d+);;\d+;;1\|\|")
+
+
+def _clients(port, path, count, ready, done, final, settle, results):
+    """Client process: hold count SSE connections to path until, once the
+    driver sets done, every one has seen line final or settle seconds
+    have passed. Puts the seconds it took every client to get the
+    initial state on results, then one (receipts, bytes, messages,
+    closed) per client; receipts are (line, time.monotonic()) for each
+    new line of thread 1."""
+    t0      = time.monotonic()
+    connect = None
+    sel     = selectors.DefaultSelector()
+    request = f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode('latin-1')
+    clients = []
+    for _ in range(count):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(request)
+        sock.setblocking(False)
+        c = {"sock": sock, "buf": b"", "head": True, "line": 0, "receipts": [],
+             "bytes": 0, "msgs": 0, "closed": False}
+        sel.register(sock, selectors.EVENT_READ, c)
+        clients.append(c)
+    open_count = count
+    deadline   = None
+    while open_count:
+        if done.is_set():
+            if deadline is None:
+                deadline = time.monotonic() + settle
+            if (time.monotonic() > deadline
+                    or all(c["line"] >= final.value or c["closed"] for c in clients)):
+                break
+        if connect is None and all(c["line"] or c["closed"] for c in clients):
+            connect = time.monotonic() - t0
+            ready.set()
+        for key, _ in sel.select(0.05):
+            c = key.data
+            try:
+                data = c["sock"].recv(65536)
+            except BlockingIOError:
+                continue
+            except OSError:
+                data = b""
+            now = time.monotonic()
+            if not data:
+                c["closed"] = True  # the server dropped this client
+                open_count -= 1
+                sel.unregister(c["sock"])
+                continue
+            c["bytes"] += len(data)
+            buf = c["buf"] + data
+            if c["head"]:
+                if b"\r\n\r\n" not in buf:
+                    c["buf"] = buf
+                    continue
+                buf, c["head"] = buf.partition(b"\r\n\r\n")[2], False
+            *msgs, c["buf"] = buf.split(b"\n\n")
+            for msg in msgs:
+                if msg.startswith(b":"):
+                    continue  # keepalive
+                c["msgs"] += 1
+                m = _THREAD_1.search(msg)
+                if m and int(m.group(1)) > c["line"]:
+                    c["line"] = int(m.group(1))
+                    c["receipts"].append((c["line"], now))
+    ready.set()
+    results.put(connect if connect is not None else time.monotonic() - t0)
+    for c in clients:
+        c["sock"].close()
+        results.put((c["receipts"], c["bytes"], c["msgs"], c["closed"]))
+
+
+class _GdbDriver:
+    """Synthetic GDB events. They fire on this thread, which then runs
+    what the server posted: it stands in for GDB's main thread."""
+
+    def __init__(self, harness):
+        self.h = harness
+
+    def stop(self):
+        gdb.move(self.h.threads[0])
+        gdb.events.stop.fire(gdb.StopEvent())
+        gdb.run_posted()
+
+    def add_breakpoint(self):
+        gdb.events.breakpoint_created.fire(gdb.add_breakpoint())
+
+
+class _LldbDriver:
+    """Synthetic LLDB events, posted to the server's listener as LLDB
+    would post them."""
+
+    def __init__(self, harness):
+        self.h = harness
+
+    def stop(self):
+        lldb.move(self.h.threads[0])
+        lldb.post('process', self.h.debugger.target.process)
+
+    def add_breakpoint(self):
+        bp = lldb.add_breakpoint(self.h.debugger)
+        lldb.post('bp', (bp, lldb.eBreakpointEventTypeAdded))
+
+
+def _configure(args):
+    """The dvap-set options the fake debuggers would otherwise default."""
+    if args.debugger == 'gdb':
+        for name, value in (('transport', args.transport),
+                            ('slow_clients', args.slow_clients),
+                            ('relay', args.relay)):
+            param = gdb.Parameter(f'dvap-{name}', gdb.COMMAND_NONE, gdb.PARAM_ENUM)
+            param.value = value
+            setattr(gdb, f'_dvap_{name}_param', param)
+    else:
+        lldb._dvap_transport    = args.transport
+        lldb._dvap_slow_clients = args.slow_clients
+        lldb._dvap_relay        = args.relay
+
+
+def _percentile(samples, q):
+    if not samples:
+        return float('nan')
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def run(args):
+    _configure(args)
+    harness = {"gdb": dvap_bench._GdbHarness,
+               "lldb": dvap_bench._LldbHarness}[args.debugger](args, serve=True)
+    driver  = {"gdb": _GdbDriver, "lldb": _LldbDriver}[args.debugger](harness)
+    inst    = harness.inst
+    if inst._http is None:
+        raise SystemExit("server did not start")
+    port    = inst.port
+    first   = next(iter(inst._state["threads"][1].values()))["line"]
+
+    ctx     = multiprocessing.get_context('spawn')
+    ready, done = ctx.Event(), ctx.Event()
+    final   = ctx.Value('l', first + args.stops)
+    results = ctx.Queue()
+    proc    = ctx.Process(target=_clients, daemon=True,
+                          args=(port, f"/events?{args.query}" if args.query else "/events",
+                                args.clients, ready, done, final, args.settle, results))
+    proc.start()
+    if not ready.wait(30):
+        raise SystemExit("clients did not connect")
+
+    # Stop i (1-based) puts thread 1 on line first + i.
+    sent     = []
+    interval = 1 / args.rate if args.rate else 0
+    cpu      = time.process_time()  # every thread of the debugger, not the relay
+    t_start  = time.monotonic()
+    for i in range(1, args.stops + 1):
+        if interval:
+            delay = t_start + i * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        if args.bp_every and i % args.bp_every == 0:
+            driver.add_breakpoint()
+        sent.append(time.monotonic())
+        driver.stop()
+    drive_s = time.monotonic() - t_start
+    done.set()
+
+    connect_s  = results.get(timeout=args.settle + 30)
+    per_client = [results.get(timeout=args.settle + 30) for _ in range(args.clients)]
+    cpu        = time.process_time() - cpu
+    proc.join(5)
+    server_dropped = inst._disp.dropped
+    inst.shutdown()
+
+    latencies, missed, closed, msgs, nbytes = [], 0, 0, 0, 0
+    t_end = t_start + drive_s
+    for receipts, size, count, was_closed in per_client:
+        if receipts:
+            t_end = max(t_end, receipts[-1][1])
+        closed += was_closed
+        msgs   += count
+        nbytes += size
+        seen = 0  # stops delivered so far
+        for line, t in receipts:
+            upto = min(line - first, args.stops)
+            latencies += [t - sent[i] for i in range(seen, upto)]
+            seen = max(seen, upto)
+        missed += args.stops - seen
+    latencies.sort()
+    elapsed = t_end - t_start  # first stop to last delivery
+    return {
+        "stops":            args.stops,
+        "clients":          args.clients,
+        "connect_s":        connect_s,  # until every client had the initial state
+        "drive_s":          drive_s,
+        "stops_per_s":      args.stops / drive_s,
+        "debugger_cpu_s":   cpu,  # driving the stops and serving the clients
+        "p50_ms":           _percentile(latencies, 0.50) * 1e3,
+        "p99_ms":           _percentile(latencies, 0.99) * 1e3,
+        "max_ms":           latencies[-1] * 1e3 if latencies else float('nan'),
+        "deliveries_per_s": msgs / elapsed,
+        "bytes_per_s":      nbytes / elapsed,
+        "missed":           missed,  # client-stops never seen
+        "dropped":          max(server_dropped, closed),
+    }
+
+
+def _checks(args, result):
+    """(name, ok, detail) per threshold given on the command line."""
+    checks = []
+    if args.max_p50 is not None:
+        checks.append(("p50", result["p50_ms"] <= args.max_p50,
+                       f"{result['p50_ms']:.2f} ms <= {args.max_p50} ms"))
+    if args.max_p99 is not None:
+        checks.append(("p99", result["p99_ms"] <= args.max_p99,
+                       f"{result['p99_ms']:.2f} ms <= {args.max_p99} ms"))
+    if args.max_drops is not None:
+        checks.append(("drops", result["dropped"] <= args.max_drops,
+                       f"{result['dropped']} <= {args.max_drops}"))
+    if args.min_deliveries is not None:
+        checks.append(("deliveries", result["deliveries_per_s"] >= args.min_deliveries,
+                       f"{result['deliveries_per_s']:.0f}/s >= {args.min_deliveries}/s"))
+    return checks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--debugger', choices=('gdb', 'lldb'), default='gdb')
+    parser.add_argument('--transport', choices=('threaded', 'selector'), default='threaded')
+    parser.add_argument('--slow-clients', choices=('latest', 'drop'), default='latest')
+    parser.add_argument('--relay', action='store_true',
+                        help="serve the clients from a relay process (dvap-set relay on)")
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--query', default='',
+                        help="/events query for every client, e.g. mode=delta&paths=interned;"
+                             " it must keep thread 1's text record")
+    parser.add_argument('--stops', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=100,
+                        help="stops per second (0: as fast as the server takes them)")
+    parser.add_argument('--bp-every', type=int, default=10,
+                        help="add a breakpoint before every Nth stop (0: never)")
+    parser.add_argument('--threads', type=int, default=64, help="threads per inferior")
+    parser.add_argument('--inferiors', type=int, default=1)
+    parser.add_argument('--files', type=int, default=16)
+    parser.add_argument('--locations', type=int, default=0)
+    parser.add_argument('--settle', type=float, default=5,
+                        help="seconds to wait for clients to catch up after the last stop")
+    parser.add_argument('--max-p50', type=float, metavar='MS')
+    parser.add_argument('--max-p99', type=float, metavar='MS')
+    parser.add_argument('--max-drops', type=int, metavar='N')
+    parser.add_argument('--min-deliveries', type=float, metavar='PER_S')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+    if 'format=binary' in args.query:
+        parser.error("--query: clients read text records; format=binary is not supported")
+
+    result = run(args)
+    checks = _checks(args, result)
+    if args.json:
+        json.dump({"args": vars(args), "result": result,
+                   "checks": [{"name": n, "ok": ok, "detail": d} for n, ok, d in checks]},
+                  sys.stdout, indent=2)
+        print()
+    else:
+        print(f"DVAP load: {args.debugger}/{args.transport}"
+              + (" via relay" if args.relay else "") + f", {args.clients} clients"
+              + (f" ?{args.query}" if args.query else "")
+              + f", {args.stops} stops at {result['stops_per_s']:.0f}/s")
+        print(f"  stop-to-client   p50 {result['p50_ms']:8.2f} ms   p99 {result['p99_ms']:8.2f} ms"
+              f"   max {result['max_ms']:8.2f} ms")
+        print(f"  connect          {result['connect_s'] * 1e3:.0f} ms for all clients")
+        print(f"  debugger CPU     {result['debugger_cpu_s']:.2f} s")
+        print(f"  throughput       {result['deliveries_per_s']:.0f} deliveries/s,"
+              f" {result['bytes_per_s'] / 1e6:.1f} MB/s")
+        print(f"  dropped          {result['dropped']} clients,"
+              f" {result['missed']} client-stops never seen")
+        for name, ok, detail in checks:
+            print(f"  {'PASS' if ok else 'FAIL'} {name:<12} {detail}")
+    return 0 if all(ok for _, ok, _ in checks) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""Stand-in for GDB's `gdb` module, enough to run DVAP_gdb_server.py
+without a debugger.
+
+Only the API surface the server touches is modelled. fake_session()
+builds one stopped inferior whose threads sit at made-up source lines;
+a pc maps to (file, line) arithmetically, so moving a thread is just
+advancing its pc.
+"""
+import threading
+
+COMMAND_NONE = 0
+PARAM_INTEGER, PARAM_ZUINTEGER, PARAM_BOOLEAN, PARAM_ENUM = range(4)
+(BP_BREAKPOINT, BP_WATCHPOINT, BP_HARDWARE_WATCHPOINT,
+ BP_READ_WATCHPOINT, BP_ACCESS_WATCHPOINT) = range(1, 6)
+NORMAL_FRAME, INLINE_FRAME = 0, 1
+
+Thread = threading.Thread
+
+
+class error(RuntimeError):
+    pass
+
+
+class Parameter:
+    def __init__(self, name, command_class, parameter_class, enum_sequence=None):
+        self.name  = name
+        self.value = None
+
+
+class Command:
+    def __init__(self, name, command_class):
+        self.name = name
+
+
+class _EventRegistry:
+    def __init__(self):
+        self._fns = []
+
+    def connect(self, fn):
+        self._fns.append(fn)
+
+    def disconnect(self, fn):
+        self._fns.remove(fn)
+
+    def fire(self, event=None):
+        for fn in list(self._fns):
+            fn(event)
+
+
+class events:
+    pass
+
+for _name in ('stop', 'cont', 'exited', 'breakpoint_created', 'breakpoint_modified',
+              'breakpoint_deleted', 'gdb_exiting', 'new_objfile', 'clear_objfiles',
+              'free_objfile', 'inferior_deleted'):
+    setattr(events, _name, _EventRegistry())
+
+
+class StopEvent:
+    def __init__(self, details=None):
+        self.details = details or {}
+
+
+class BreakpointEvent(StopEvent):
+    pass
+
+
+class ContinueEvent:
+    def __init__(self, inferior_thread=None):
+        self.inferior_thread = inferior_thread
+
+
+# Program model: pc = _TEXT | file index << 20 | line << 2
+
+_TEXT = 0x400000000
+
+
+def _pc(file_index, line):
+    return _TEXT | file_index << 20 | line << 2
+
+
+class Symtab:
+    def __init__(self, filename):
+        self.filename = filename
+
+    def fullname(self):
+        return self.filename
+
+
+class Symtab_and_line:
+    def __init__(self, symtab, line, pc=0):
+        self.symtab = symtab
+        self.line   = line
+        self.pc     = pc
+
+
+def find_pc_line(pc):
+    index = (pc ^ _TEXT) >> 20
+    if not 0 <= index < len(_session.files):
+        return Symtab_and_line(None, 0, pc)
+    return Symtab_and_line(Symtab(_session.files[index]), (pc >> 2) & 0x3FFFF, pc)
+
+
+def decode_line(spec):
+    path, _, line = spec.rpartition(':')
+    return None, [Symtab_and_line(Symtab(path), int(line))]
+
+
+class Frame:
+    """Level 0 is at the thread's pc; its callers sit at made-up lines
+    500 + level, down to the thread's depth."""
+    def __init__(self, thread, level=0):
+        self._thread = thread
+        self._level  = level
+
+    def is_valid(self):
+        return True
+
+    def pc(self):
+        if self._level == 0:
+            return self._thread.pc
+        return _pc(self._level % len(_session.files), 500 + self._level)
+
+    def type(self):
+        return NORMAL_FRAME
+
+    def name(self):
+        return f"fn{self._level}"
+
+    def older(self):
+        if self._level + 1 >= self._thread.depth:
+            return None
+        return Frame(self._thread, self._level + 1)
+
+    def select(self):
+        pass
+
+    def find_sal(self):
+        return find_pc_line(self.pc())
+
+
+class Progspace:
+    pass
+
+
+class Inferior:
+    def __init__(self, num, pid):
+        self.num       = num
+        self.pid       = pid
+        self.progspace = Progspace()
+        self._threads  = []
+
+    def threads(self):
+        return tuple(self._threads)
+
+    def is_valid(self):
+        return True
+
+
+class InferiorThread:
+    def __init__(self, inferior, num, pc):
+        self.inferior = inferior
+        self.num      = num
+        self.ptid     = (inferior.pid, inferior.pid + num, 0)
+        self.pc       = pc
+        self.running  = False
+        self.depth    = 8  # frames on the stack
+
+    def is_valid(self):
+        return True
+
+    def is_running(self):
+        return self.running
+
+    def switch(self):
+        _session.selected = self
+        _session.inferior = self.inferior
+
+
+class BreakpointLocation:
+    def __init__(self, address):
+        self.address = address
+        self.enabled = True
+
+
+class Breakpoint:
+    def __init__(self, number, file_index, line):
+        self.number    = number
+        self.location  = f"{_session.files[file_index]}:{line}"
+        self.locations = [BreakpointLocation(_pc(file_index, line))]
+        self.condition = None
+        self.thread    = None
+        self.enabled   = True
+        self.pending   = False
+        self.type      = BP_BREAKPOINT
+
+    def is_valid(self):
+        return self in _session.breakpoints
+
+
+class _Session:
+    def __init__(self):
+        self.files       = []
+        self.inferiors   = []
+        self.inferior    = None  # selected; a thread switch selects its inferior
+        self.selected    = None
+        self.breakpoints = []
+        self.posted      = []
+        self.parameters  = {'schedule-multiple': False, 'scheduler-locking': 'replay'}
+
+
+_session = _Session()
+
+
+def _location(n, files, locations):
+    """(file index, line) of thread n: its own line, or one of locations
+    shared spots when locations is set."""
+    if locations:
+        n = n % locations
+    return n % files, 10 + n
+
+
+def fake_session(threads=4, breakpoints=0, files=8, pid=4242, inferiors=1,
+                 locations=0):
+    """Reset to stopped inferiors with the given threads each, plus
+    breakpoints. The first inferior is selected; returns it."""
+    global _session
+    _session = _Session()
+    _session.files = [f"/src/project/module{i}/file{i}.c" for i in range(files)]
+    for i in range(inferiors):
+        inf = Inferior(i + 1, pid + i)
+        inf._threads = [InferiorThread(inf, n, _pc(*_location(n, files, locations)))
+                        for n in range(1, threads + 1)]
+        _session.inferiors.append(inf)
+    first = _session.inferiors[0]
+    _session.inferior = first
+    _session.selected = first._threads[0] if threads else None
+    for _ in range(breakpoints):
+        add_breakpoint()
+    return first
+
+
+def add_breakpoint():
+    """Create the next breakpoint at a fresh location and return it."""
+    num = len(_session.breakpoints) + 1
+    bp  = Breakpoint(num, num % len(_session.files), 100 + num)
+    _session.breakpoints.append(bp)
+    return bp
+
+
+def move(thread, lines=1):
+    """Advance thread by lines source lines."""
+    thread.pc += lines << 2
+
+
+def run_posted():
+    """Run callbacks queued with post_event, as gdb's event loop would."""
+    while _session.posted:
+        _session.posted.pop(0)()
+
+
+def selected_inferior():
+    return _session.inferior
+
+
+def execute(command, to_string=False):
+    """Only `inferior N`, which selects inferior N and its first thread."""
+    name, _, arg = command.partition(' ')
+    inf = next((i for i in _session.inferiors if name == 'inferior' and str(i.num) == arg), None)
+    if inf is None:
+        raise RuntimeError(f"Undefined command: \"{command}\".")
+    _session.inferior = inf
+    _session.selected = inf._threads[0] if inf._threads else None
+    return f"[Switching to inferior {inf.num}]\n" if to_string else None
+
+
+def inferiors():
+    return tuple(_session.inferiors)
+
+
+def set_parameter(name, value):
+    _session.parameters[name] = value
+
+
+def current_recording():
+    return None
+
+
+def parameter(name):
+    try:
+        return _session.parameters[name]
+    except KeyError:
+        raise RuntimeError(f"Could not find parameter `{name}'.")
+
+
+def selected_thread():
+    return _session.selected
+
+
+def selected_frame():
+    if _session.selected is None:
+        raise error("No frame is currently selected.")
+    if _session.selected.running:
+        raise error("Selected thread is running.")
+    return Frame(_session.selected)
+
+
+def newest_frame():
+    return Frame(_session.selected)
+
+
+def current_progspace():
+    return selected_inferior().progspace
+
+
+def breakpoints():
+    return tuple(_session.breakpoints)
+
+
+def post_event(fn):
+    _session.posted.append(fn)
@@ -0,0 +1,396 @@
+"""Stand-in for LLDB's `lldb` module, enough to run DVAP_lldb_server.py
+without a debugger.
+
+Only the API surface the server touches is modelled. fake_session()
+returns a debugger whose one process is stopped with threads at made-up
+source lines; a pc maps to (file, line) arithmetically, as in the gdb
+fake.
+"""
+import os
+import queue
+
+eStateInvalid, eStateStopped, eStateRunning, eStateExited = 0, 5, 6, 10
+eBreakpointEventTypeAdded, eBreakpointEventTypeRemoved = 1, 2
+LLDB_INVALID_ADDRESS = 0xFFFFFFFFFFFFFFFF
+
+# Program model: pc = _TEXT | file index << 20 | line << 2
+
+_TEXT = 0x400000000
+
+
+def _pc(file_index, line):
+    return _TEXT | file_index << 20 | line << 2
+
+
+class SBFileSpec:
+    def __init__(self, path):
+        self._path = path
+
+    def IsValid(self):
+        return bool(self._path)
+
+    def GetFilename(self):
+        return os.path.basename(self._path)
+
+    def GetDirectory(self):
+        return os.path.dirname(self._path)
+
+
+class SBLineEntry:
+    def __init__(self, pc):
+        index = (pc ^ _TEXT) >> 20
+        valid = 0 <= index < len(_session.files)
+        self._path = _session.files[index] if valid else ""
+        self._line = (pc >> 2) & 0x3FFFF if valid else 0
+
+    def IsValid(self):
+        return bool(self._path)
+
+    def GetFileSpec(self):
+        return SBFileSpec(self._path)
+
+    def GetLine(self):
+        return self._line
+
+
+class SBAddress:
+    def __init__(self, pc):
+        self._pc = pc
+
+    def GetLineEntry(self):
+        return SBLineEntry(self._pc)
+
+
+class SBFrame:
+    """Frame 0 is at the thread's pc; its callers sit at made-up lines
+    500 + index, down to the thread's depth."""
+    def __init__(self, thread, index=0):
+        self._thread = thread
+        self._index  = index
+
+    def IsValid(self):
+        return self._index < self._thread.depth
+
+    def GetPC(self):
+        if self._index == 0:
+            return self._thread.pc
+        return _pc(self._index % len(_session.files), 500 + self._index)
+
+    def IsInlined(self):
+        return False
+
+    def GetFunctionName(self):
+        return f"fn{self._index}"
+
+    def GetLineEntry(self):
+        return SBLineEntry(self.GetPC())
+
+
+class SBThread:
+    eBroadcastBitStackChanged         = 1 << 0
+    eBroadcastBitSelectedFrameChanged = 1 << 3
+    eBroadcastBitThreadSelected       = 1 << 4
+
+    def __init__(self, process, index_id, pc):
+        self._process = process
+        self._id      = index_id
+        self.pc       = pc
+        self.depth    = 8  # frames on the stack
+
+    def IsValid(self):
+        return self._id != 0  # index ids start at 1
+
+    def GetIndexID(self):
+        return self._id
+
+    def GetThreadID(self):
+        return self._process.pid + self._id
+
+    def GetSelectedFrame(self):
+        return SBFrame(self)
+
+    def GetFrameAtIndex(self, index):
+        return SBFrame(self, index)
+
+    def GetProcess(self):
+        return self._process
+
+    @staticmethod
+    def GetBroadcasterClassName():
+        return "lldb.thread"
+
+    @staticmethod
+    def EventIsThreadEvent(event):
+        return event.kind == "thread"
+
+    @staticmethod
+    def GetThreadFromEvent(event):
+        return event.payload
+
+
+class SBProcess:
+    eBroadcastBitStateChanged = 1 << 0
+
+    def __init__(self, target, pid):
+        self.target   = target
+        self.pid      = pid
+        self.state    = eStateStopped
+        self.threads  = []
+        self.selected = None
+
+    def IsValid(self):
+        return True
+
+    def GetState(self):
+        return self.state
+
+    def GetProcessID(self):
+        return self.pid
+
+    def GetSelectedThread(self):
+        return self.selected
+
+    def GetThreadByIndexID(self, index_id):
+        return next((t for t in self.threads if t.GetIndexID() == index_id),
+                    SBThread(self, 0, 0))
+
+    def GetTarget(self):
+        return self.target
+
+    def __iter__(self):
+        return iter(self.threads)
+
+    @staticmethod
+    def GetBroadcasterClassName():
+        return "lldb.process"
+
+    @staticmethod
+    def EventIsProcessEvent(event):
+        return event.kind == "process"
+
+    @staticmethod
+    def GetRestartedFromEvent(event):
+        return False
+
+    @staticmethod
+    def GetProcessFromEvent(event):
+        return event.payload
+
+
+class SBBreakpointLocation:
+    def __init__(self, pc):
+        self._pc = pc
+
+    def IsValid(self):
+        return True
+
+    def GetLoadAddress(self):
+        return self._pc
+
+    def GetAddress(self):
+        return SBAddress(self._pc)
+
+
+class SBBreakpoint:
+    def __init__(self, target, bp_id, pc):
+        self._target    = target
+        self._id        = bp_id
+        self._location  = SBBreakpointLocation(pc)
+        self.condition  = None
+        self.enabled    = True
+
+    def GetID(self):
+        return self._id
+
+    def GetTarget(self):
+        return self._target
+
+    def GetLocationAtIndex(self, index):
+        return self._location
+
+    def GetCondition(self):
+        return self.condition
+
+    def IsEnabled(self):
+        return self.enabled
+
+    @staticmethod
+    def EventIsBreakpointEvent(event):
+        return event.kind == "bp"
+
+    @staticmethod
+    def GetBreakpointFromEvent(event):
+        return event.payload[0]
+
+    @staticmethod
+    def GetBreakpointEventTypeFromEvent(event):
+        return event.payload[1]
+
+
+class SBTarget:
+    eBroadcastBitBreakpointChanged = 1 << 0
+    eBroadcastBitModulesLoaded     = 1 << 1
+    eBroadcastBitModulesUnloaded   = 1 << 2
+    eBroadcastBitSymbolsLoaded     = 1 << 4
+
+    def __init__(self, pid):
+        self.process     = SBProcess(self, pid)
+        self.breakpoints = []
+
+    def IsValid(self):
+        return True
+
+    def GetProcess(self):
+        return self.process
+
+    def GetNumBreakpoints(self):
+        return len(self.breakpoints)
+
+    def GetBreakpointAtIndex(self, index):
+        return self.breakpoints[index]
+
+    @staticmethod
+    def GetBroadcasterClassName():
+        return "lldb.target"
+
+    @staticmethod
+    def EventIsTargetEvent(event):
+        return event.kind == "target"
+
+
+class SBDebugger:
+    def __init__(self):
+        self.targets  = []
+        self.target   = None  # selected
+        self.commands = []
+
+    def GetSelectedTarget(self):
+        return self.target
+
+    def GetNumTargets(self):
+        return len(self.targets)
+
+    def GetTargetAtIndex(self, index):
+        return self.targets[index]
+
+    def DeleteTarget(self, target):
+        if target not in self.targets:
+            return False
+        self.targets.remove(target)
+        if self.target is target:
+            self.target = self.targets[0] if self.targets else None
+        return True
+
+    def HandleCommand(self, command):
+        self.commands.append(command)
+
+
+class SBEvent:
+    def __init__(self):
+        self.kind        = None
+        self.payload     = None
+        self.broadcaster = None
+
+    def BroadcasterMatchesRef(self, broadcaster):
+        return self.broadcaster is broadcaster
+
+
+class SBListener:
+    def __init__(self, name=""):
+        self._queue = queue.Queue()
+        _session.listeners.append(self)
+
+    def StartListeningForEventClass(self, debugger, broadcaster_class, mask):
+        return mask
+
+    def StartListeningForEvents(self, broadcaster, mask):
+        broadcaster._listeners.append(self)
+        return mask
+
+    def WaitForEvent(self, timeout, event):
+        try:
+            event.kind, event.payload, event.broadcaster = self._queue.get(
+                timeout=None if timeout == 0xFFFFFFFF else timeout)
+        except queue.Empty:
+            return False
+        return True
+
+    def GetNextEvent(self, event):
+        try:
+            event.kind, event.payload, event.broadcaster = self._queue.get_nowait()
+        except queue.Empty:
+            return False
+        return True
+
+    def Clear(self):
+        pass
+
+
+class SBBroadcaster:
+    def __init__(self, name=""):
+        self._listeners = []
+
+    def BroadcastEventByType(self, event_type):
+        for listener in self._listeners:
+            listener._queue.put((None, event_type, self))
+
+
+class _Session:
+    def __init__(self):
+        self.files     = []
+        self.listeners = []
+
+
+_session = _Session()
+
+
+def _location(n, files, locations):
+    """(file index, line) of thread n: its own line, or one of locations
+    shared spots when locations is set."""
+    if locations:
+        n = n % locations
+    return n % files, 10 + n
+
+
+def fake_session(threads=4, breakpoints=0, files=8, pid=4242, targets=1,
+                 locations=0):
+    """Reset to one debugger with targets stopped processes, each holding
+    the given threads. The first target is selected and gets the
+    breakpoints. Returns the SBDebugger."""
+    global _session
+    _session = _Session()
+    _session.files = [f"/src/project/module{i}/file{i}.c" for i in range(files)]
+    debugger = SBDebugger()
+    for i in range(targets):
+        target  = SBTarget(pid + i)
+        process = target.process
+        process.threads  = [SBThread(process, n, _pc(*_location(n, files, locations)))
+                            for n in range(1, threads + 1)]
+        process.selected = process.threads[0] if threads else None
+        debugger.targets.append(target)
+    debugger.target = debugger.targets[0]
+    for _ in range(breakpoints):
+        add_breakpoint(debugger)
+    return debugger
+
+
+def add_breakpoint(debugger):
+    """Create the next breakpoint at a fresh location and return it."""
+    target = debugger.target
+    num    = len(target.breakpoints) + 1
+    bp     = SBBreakpoint(target, num, _pc(num % len(_session.files), 100 + num))
+    target.breakpoints.append(bp)
+    return bp
+
+
+def move(thread, lines=1):
+    """Advance thread by lines source lines."""
+    thread.pc += lines << 2
+
+
+def post(kind, payload=None):
+    """Deliver an event to every listener: kind is 'process' (payload the
+    SBProcess), 'thread' (the SBThread), 'target' or 'bp' (payload
+    (SBBreakpoint, event type))."""
+    for listener in _session.listeners:
+        listener._queue.put((kind, payload, None))
@@ -0,0 +1,103 @@
+"""Regression tests for the DVAP servers, run against the fake debuggers.
+
+    python3 -m unittest discover -s bench
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dvap_bench  # noqa: E402  (puts the fakes first on sys.path)
+import gdb         # noqa: E402
+
+
+def _args(**kw):
+    args = dict(threads=4, files=4, inferiors=1, locations=0)
+    args.update(kw)
+    return argparse.Namespace(**args)
+
+
+class GdbStackTest(unittest.TestCase):
+    def setUp(self):
+        self.harness = dvap_bench._GdbHarness(_args())
+        self.inst    = self.harness.inst
+
+    def stack(self, num):
+        """stack(num) answered as from an HTTP thread: _on_gdb_thread waits
+        for this thread to run what it posts."""
+        out  = io.StringIO()
+        body = []
+        with contextlib.redirect_stdout(out):
+            runner = gdb.Thread(target=lambda: body.append(self.inst.stack(num, 1, 4)))
+            runner.start()
+            while runner.is_alive():
+                gdb.run_posted()
+                runner.join(0.001)
+        return body[0], out.getvalue()
+
+    def test_running_selected_thread(self):
+        # Non-stop mode: the user's thread runs while the requested one is stopped.
+        selected, target = self.harness.threads[0], self.harness.threads[1]
+        selected.running = True
+        body, printed = self.stack(target.num)
+        self.assertIsNotNone(body)
+        self.assertTrue(body.startswith(f"stack;;{target.num};;1;;".encode()))
+        self.assertIn(b"frame;;0;;", body)
+        self.assertEqual(printed, "")
+        self.assertIs(gdb.selected_thread(), selected)
+
+
+class GdbFastStepTest(unittest.TestCase):
+    def lazy_refreshes(self, scheduler_locking):
+        """Full walks a step posts after reading the selected thread."""
+        harness = dvap_bench._GdbHarness(_args())
+        harness.fast_step(scheduler_locking)
+        inst, lazy = harness.inst, []
+        refresh = inst._lazy_refresh
+        inst._lazy_refresh = lambda *a: lazy.append(a) or refresh(*a)
+        harness.stop()
+        return len(lazy)
+
+    def test_all_stop_steps(self):
+        # All-stop GDB resumes without inferior_thread; scheduler-locking decides.
+        self.assertEqual(self.lazy_refreshes('on'), 0)
+        self.assertEqual(self.lazy_refreshes('step'), 0)
+        self.assertEqual(self.lazy_refreshes('off'), 1)
+        self.assertEqual(self.lazy_refreshes('replay'), 1)  # not replaying a recording
+
+
+class GdbSyncTest(unittest.TestCase):
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.harness = dvap_bench._GdbHarness(_args(threads=100, inferiors=2), serve=True)
+        self.inst = self.harness.inst
+
+    def tearDown(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.inst.shutdown()
+
+    def test_threads_walked_in_slices(self):
+        inst, walks = self.inst, []
+        walk = inst._walk_threads
+        inst._walk_threads = lambda threads: walks.append(len(threads)) or walk(threads)
+        with inst._lock:
+            inst._state["threads"] = {}
+            inst._state["syncing"] = True
+        inst._sync_gdb_state()
+        while inst._state["syncing"]:
+            gdb.run_posted()  # one turn of GDB's event loop per posted slice
+            time.sleep(0.001)
+        self.assertEqual(sum(walks), 200)
+        self.assertLessEqual(max(walks), inst._SYNC_SLICE)
+        self.assertEqual(len(walks), 2 * -(-100 // inst._SYNC_SLICE))
+        self.assertEqual({num: len(threads) for num, threads in inst._state["threads"].items()},
+                         {1: 100, 2: 100})
+
+
+if __name__ == '__main__':
+    unittest.main()
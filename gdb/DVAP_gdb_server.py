@@ -1,60 +1,715 @@
 import http.server
+import http.client
+import urllib.parse
 import socketserver
+import selectors
+import socket
+import stat
+import struct
+import array
+import bisect
+import time
+import collections
 import threading
 import queue
+import tempfile
 import os
-import gdb
+import sys
+import pickle
+import shutil
+import subprocess
+
+if __name__ == '__dvap_relay__':  # the relay process (see _RelayProcess) has no debugger
+    gdb = None
+else:
+    import gdb
 
 # Created once on the gdb module so the value survives re-sourcing.
-# Usage: (gdb) set dvap-port 12345   then re-source this script.
+# Usage: (gdb) set dvap-port 12345   then dvap-start.
 
-if not hasattr(gdb, '_dvap_port_param'):
+if gdb and not hasattr(gdb, '_dvap_port_param'):
     class _DVAPPortParam(gdb.Parameter):
-        """DVAP SSE server port (default 56789). Re-source the script to apply changes."""
+        """DVAP SSE server port (default 56789). dvap-start to apply changes."""
         def __init__(self):
             super().__init__('dvap-port', gdb.COMMAND_NONE, gdb.PARAM_INTEGER)
             self.value = 56789
         def get_set_string(self):
-            return f"DVAP port set to {self.value} (re-source script to apply)"
+            return f"DVAP port set to {self.value} (dvap-start to apply)"
         def get_show_string(self, sval):
             return f"DVAP port is {self.value}"
     gdb._dvap_port_param = _DVAPPortParam()
 
-_SHUTDOWN = object()  # sentinel pushed to queues on shutdown
+if gdb and not hasattr(gdb, '_dvap_heartbeat_param'):
+    class _DVAPHeartbeatParam(gdb.Parameter):
+        """Seconds between SSE keepalive comments while the state is idle (default 15)."""
+        def __init__(self):
+            super().__init__('dvap-heartbeat', gdb.COMMAND_NONE, gdb.PARAM_ZUINTEGER)
+            self.value = 15
+        def get_set_string(self):
+            return f"DVAP heartbeat set to {self.value}s (dvap-start to apply)"
+        def get_show_string(self, sval):
+            return f"DVAP heartbeat is {self.value}s"
+    gdb._dvap_heartbeat_param = _DVAPHeartbeatParam()
+
+if gdb and not hasattr(gdb, '_dvap_transport_param'):
+    class _DVAPTransportParam(gdb.Parameter):
+        """How SSE clients are served: a thread per client, or one selector thread for all."""
+        def __init__(self):
+            super().__init__('dvap-transport', gdb.COMMAND_NONE, gdb.PARAM_ENUM,
+                             ['threaded', 'selector'])
+            self.value = 'threaded'
+        def get_set_string(self):
+            return f"DVAP transport set to {self.value} (dvap-start to apply)"
+        def get_show_string(self, sval):
+            return f"DVAP transport is {self.value}"
+    gdb._dvap_transport_param = _DVAPTransportParam()
+
+if gdb and not hasattr(gdb, '_dvap_slow_clients_param'):
+    class _DVAPSlowClientsParam(gdb.Parameter):
+        """What to do with a client that falls behind: skip it to the latest state, or drop it."""
+        def __init__(self):
+            super().__init__('dvap-slow-clients', gdb.COMMAND_NONE, gdb.PARAM_ENUM,
+                             ['latest', 'drop'])
+            self.value = 'latest'
+        def get_set_string(self):
+            return f"DVAP slow-client policy set to {self.value} (dvap-start to apply)"
+        def get_show_string(self, sval):
+            return f"DVAP slow-client policy is {self.value}"
+    gdb._dvap_slow_clients_param = _DVAPSlowClientsParam()
+
+if gdb and not hasattr(gdb, '_dvap_fast_step_param'):
+    class _DVAPFastStepParam(gdb.Parameter):
+        """On step/next/finish stops, re-read only the selected thread; refresh the rest lazily."""
+        def __init__(self):
+            super().__init__('dvap-fast-step', gdb.COMMAND_NONE, gdb.PARAM_BOOLEAN)
+            self.value = False
+        def get_set_string(self):
+            inst = getattr(gdb, '_dvap_instance', None)
+            if inst is not None:
+                inst.fast_step = self.value
+            return f"DVAP fast-step is {'on' if self.value else 'off'}"
+        def get_show_string(self, sval):
+            return f"DVAP fast-step is {sval}"
+    gdb._dvap_fast_step_param = _DVAPFastStepParam()
+
+if gdb and not hasattr(gdb, '_dvap_unix_socket_param'):
+    class _DVAPUnixSocketParam(gdb.Parameter):
+        """Also listen on a Unix socket named after the inferior pid (default off)."""
+        def __init__(self):
+            super().__init__('dvap-unix-socket', gdb.COMMAND_NONE, gdb.PARAM_BOOLEAN)
+            self.value = False
+        def get_set_string(self):
+            return f"DVAP Unix socket is {'on' if self.value else 'off'} (dvap-start to apply)"
+        def get_show_string(self, sval):
+            return f"DVAP Unix socket is {sval}"
+    gdb._dvap_unix_socket_param = _DVAPUnixSocketParam()
+
+if gdb and not hasattr(gdb, '_dvap_history_param'):
+    class _DVAPHistoryParam(gdb.Parameter):
+        """Stops kept for /history (default 4096, 0 = off). dvap-start to apply."""
+        def __init__(self):
+            super().__init__('dvap-history', gdb.COMMAND_NONE, gdb.PARAM_ZUINTEGER)
+            self.value = 4096
+        def get_set_string(self):
+            return f"DVAP history set to {self.value} stops (dvap-start to apply)"
+        def get_show_string(self, sval):
+            return f"DVAP history keeps {self.value} stops"
+    gdb._dvap_history_param = _DVAPHistoryParam()
+
+if gdb and not hasattr(gdb, '_dvap_relay_param'):
+    class _DVAPRelayParam(gdb.Parameter):
+        """Serve TCP clients from a helper process fed each state once (default off)."""
+        def __init__(self):
+            super().__init__('dvap-relay', gdb.COMMAND_NONE, gdb.PARAM_BOOLEAN)
+            self.value = False
+        def get_set_string(self):
+            return f"DVAP relay is {'on' if self.value else 'off'} (dvap-start to apply)"
+        def get_show_string(self, sval):
+            return f"DVAP relay is {sval}"
+    gdb._dvap_relay_param = _DVAPRelayParam()
+
+_SHUTDOWN  = object()           # sentinel pushed to queues on shutdown
+_HEARTBEAT = b": keepalive\n\n"  # SSE comment, ignored by clients
+
+
+def _sse(data, event_id=None):
+    if event_id is None:
+        return f"data: {data}\n\n".encode('utf-8')
+    return f"id: {event_id}\ndata: {data}\n\n".encode('utf-8')
+
+
+# Binary wire format (format=binary). Big-endian; every frame is
+#   u32 length of the rest | u8 frame kind | u32 seq | records
+# and every record starts with a u8 record type.
+_BIN_CONTENT_TYPE = "application/x-dvap"
+_BIN_FULL, _BIN_SNAPSHOT, _BIN_DELTA, _BIN_FILES, _BIN_HEARTBEAT = 1, 2, 3, 4, 5
+_BIN_TYPES   = {"selected": 1, "thread": 2, "bp": 3, "file": 4, "del": 5, "threads": 6,
+               "syncing": 7}
+_BIN_KINDS   = {"t": 0, "g": 1}  # thread or goroutine
+_B_FRAME     = struct.Struct(">IBI")      # length, frame kind, seq
+_B_SELECTED  = struct.Struct(">BBII")     # type, kind, thread id, inferior
+_B_THREAD    = struct.Struct(">BIBIIQI")  # type, id, kind, file id, line, os thread id, inferior
+_B_BP        = struct.Struct(">BIIIBI")   # type, id, file id, line, flags, inferior
+_B_FILE      = struct.Struct(">BIH")      # type, id, path length; utf-8 path follows
+_B_DEL       = struct.Struct(">BBII")     # type, deleted record type, id, inferior
+_B_THREADS   = struct.Struct(">BIIIIH")   # type, file id, line, count, inferior, runs
+_B_RUN       = struct.Struct(">II")       # first, last thread id of one run
+_B_DEL_GROUP = struct.Struct(">BBIII")    # type, deleted record type (6), file id, line, inferior
+_BP_NONCONDITIONAL, _BP_ENABLED = 1, 2    # _B_BP flags
+
+
+def _bin_frame(kind, seq, body):
+    return _B_FRAME.pack(len(body) + 5, kind, seq) + body
+
+_HEARTBEAT_BIN = _bin_frame(_BIN_HEARTBEAT, 0, b"")
+
+
+def _is_heartbeat(msg):
+    return msg is _HEARTBEAT or msg is _HEARTBEAT_BIN
+
+
+def _bin_record(fields, intern):
+    """One record tuple in the binary layout; paths go through intern.
+
+    An unknown line ("" in text) is 0, as is an unknown path's file id.
+    """
+    kind = fields[0]
+    if kind == "syncing":
+        return bytes((_BIN_TYPES[kind],))
+    if kind == "threads":
+        _, path, line, count, runs, inf = fields
+        return (_B_THREADS.pack(_BIN_TYPES[kind], intern(path), line or 0, count, inf, len(runs))
+                + b"".join(_B_RUN.pack(*run) for run in runs))
+    if kind == "thread":
+        _, num, tkind, path, line, tid, inf = fields
+        return _B_THREAD.pack(_BIN_TYPES[kind], num, _BIN_KINDS[tkind],
+                              intern(path), line, tid, inf)
+    if kind == "bp":
+        _, num, path, line, nonconditional, enabled, inf = fields
+        flags = (_BP_NONCONDITIONAL if nonconditional else 0) | (_BP_ENABLED if enabled else 0)
+        return _B_BP.pack(_BIN_TYPES[kind], num, intern(path), line or 0, flags, inf)
+    _, num, tkind, inf = fields  # selected
+    return _B_SELECTED.pack(_BIN_TYPES[kind], _BIN_KINDS[tkind], num, inf)
+
+
+def _bin_del(key, intern):
+    """Key fields missing from a del record (selected and syncing have no
+    id; GDB breakpoints have no inferior) are sent as 0. A threads group is keyed
+    by its location instead of an id."""
+    if key[0] == "threads":
+        _, path, line, inf = key
+        return _B_DEL_GROUP.pack(_BIN_TYPES["del"], _BIN_TYPES["threads"],
+                                 intern(path), line or 0, inf)
+    _, num, inf = (*key, 0, 0)[:3]
+    return _B_DEL.pack(_BIN_TYPES["del"], _BIN_TYPES[key[0]], num, inf)
+
+
+# How one client wants the state encoded. Hashable: payloads are cached
+# per view on each _Snapshot.
+#   interned  paths are sent once per connection as file;;{id};;{path}
+#             records; thread/bp records carry the id instead
+#   binary    _bin_* frames instead of SSE text; always interned
+#   filter    _Filter of the records to send, or None for all
+#   grouped   threads at the same location collapse into one threads record
+_View = collections.namedtuple('_View', 'interned binary filter grouped',
+                               defaults=(False, False, None, False))
+_DEFAULT_VIEW = _View()
+
+_FILTER_TYPES = frozenset(("selected", "thread", "bp"))
+
+
+class _IdRuns(tuple):
+    """((first, last), ...) runs of consecutive thread ids; str() gives the
+    text form, e.g. 1-4,7."""
+    __slots__ = ()
+
+    def __str__(self):
+        return ",".join(f"{a}-{b}" if a != b else str(a) for a, b in self)
+
+
+def _group_threads(records):
+    """records with thread records collapsed into one per location:
+    threads;;{file};;{line};;{count};;{id runs};;{inferior}, keyed
+    (threads, file, line, inferior) where the first member was."""
+    out, groups = {}, {}
+    for key, fields in records.items():
+        if key[0] != "thread":
+            out[key] = fields
+            continue
+        _, num, _, path, line, _, inf = fields
+        gkey = ("threads", path, line, inf)
+        if gkey not in groups:
+            groups[gkey] = []
+            out[gkey]    = None  # placeholder keeps the group's position
+        groups[gkey].append(num)
+    for gkey, nums in groups.items():
+        nums.sort()
+        runs = []
+        for num in nums:
+            if runs and runs[-1][1] == num - 1:
+                runs[-1][1] = num
+            else:
+                runs.append([num, num])
+        _, path, line, inf = gkey
+        out[gkey] = ("threads", path, line, len(nums), _IdRuns(map(tuple, runs)), inf)
+    return out
+
+
+class _Filter(collections.namedtuple('_Filter', 'types selected files')):
+    """The subset of records one /events client asked for.
+
+    types     record types to send (frozenset), or None for all; the
+              syncing marker is always sent
+    selected  send only the selected thread's thread record
+    files     path prefixes (tuple) a thread or bp record must match, or None
+    """
+    __slots__ = ()
+
+    def apply(self, records, path_field):
+        """The records that pass, in order. path_field maps a record type
+        to the index of its path."""
+        types, files = self.types, self.files
+        sel = records.get(("selected",)) if self.selected else None
+        out = {}
+        for key, fields in records.items():
+            kind = key[0]
+            if types is not None and kind not in types and kind != "syncing":
+                continue
+            # A thread key is (thread, id, inferior...), selected fields are
+            # (selected, id, kind, inferior...).
+            if kind == "thread" and self.selected and (
+                    sel is None or key[1:] != (sel[1], *sel[3:])):
+                continue
+            i = path_field.get(kind)
+            if files is not None and i is not None and not fields[i].startswith(files):
+                continue
+            out[key] = fields
+        return out
+
+
+class _PathTable:
+    """Append-only path <-> id table for interned views. Id 0 is "no file"."""
+    def __init__(self, fs, rs):
+        self._fs    = fs
+        self._rs    = rs
+        self._ids   = {"": 0}
+        self._paths = [""]
+        self._lock  = threading.Lock()
+
+    def __len__(self):
+        return len(self._paths) - 1  # highest id in use
+
+    def intern(self, path):
+        pid = self._ids.get(path)
+        if pid is None:
+            with self._lock:
+                pid = self._ids.get(path)
+                if pid is None:
+                    pid = self._ids[path] = len(self._paths)
+                    self._paths.append(path)
+        return pid
+
+    def path(self, pid):
+        return self._paths[pid]
+
+    def message(self, after, upto, binary=False):
+        """Message defining ids after+1 .. upto."""
+        ids = range(after + 1, upto + 1)
+        if binary:
+            body = b""
+            for i in ids:
+                path = self._paths[i].encode('utf-8')
+                body += _B_FILE.pack(_BIN_TYPES["file"], i, len(path)) + path
+            return _bin_frame(_BIN_FILES, 0, body)
+        fs, rs = self._fs, self._rs
+        return _sse("".join(f"file{fs}{i}{fs}{self._paths[i]}{rs}" for i in ids))
+
+
+def _unpack(item, sent, paths):
+    """Resolve a queued item to bytes. Returns (bytes, sent).
+
+    Interned-view items are (payload, upto, binary). File records for table ids
+    this connection has not seen yet (sent+1 .. upto) are written first.
+    Doing this at write time keeps it correct when a slot skips messages.
+    """
+    if type(item) is not tuple:
+        return item, sent
+    payload, upto, binary = item
+    if upto <= sent:
+        return payload, sent
+    return paths.message(sent, upto, binary) + payload, upto
+
+
+class _Snapshot:
+    """One published state. Never mutated, so it is shared without locking.
+
+    records       ordered {key: fields} mapping (read-only by convention)
+    prev_records  records of the snapshot before, for deltas
+
+    Payloads are encoded on first use per _View and cached, so each
+    encoding is built once however many clients share it.
+    """
+    __slots__ = ('seq', 'records', 'prev_records', '_encode', '_cache')
+
+    def __init__(self, seq, records, prev_records, encode):
+        self.seq          = seq
+        self.records      = records
+        self.prev_records = prev_records
+        self._encode      = encode
+        self._cache       = {}
+
+    def payloads(self, view=_DEFAULT_VIEW):
+        """(payload, delta_payload, snapshot_payload, upto) for view.
+
+        payload is the message for "full" clients, delta_payload the changes
+        since the previous snapshot, snapshot_payload the full state that
+        starts a "delta" stream at seq. upto is the highest path id the
+        payloads may reference (None unless view.interned). delta_payload
+        is None when view.filter hides every change: nothing is sent.
+        """
+        p = self._cache.get(view)
+        if p is None:
+            p = self._cache[view] = self._encode(self, view)
+        return p
+
+    def rebased(self, prev_records):
+        """This state as a change from prev_records instead."""
+        return _Snapshot(self.seq, self.records, prev_records, self._encode)
+
+_EMPTY_SNAPSHOT = _Snapshot(0, {}, {}, None)
+
+
+class _LatestSlot:
+    """Per-client mailbox holding only the newest message.
+
+    A client that falls behind skips intermediate messages instead of being
+    dropped. A skipped delta cannot simply be overwritten, so the caller
+    passes resync (a full snapshot message) to send in its place.
+    """
+    conflate = True
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._msg  = None
+
+    def put_nowait(self, msg, resync=None):
+        with self._cond:
+            pending = self._msg
+            if pending is _SHUTDOWN:
+                return
+            if pending is not None and msg is not _SHUTDOWN:
+                if _is_heartbeat(msg):
+                    return  # the pending message keeps the connection alive
+                if resync is not None and not _is_heartbeat(pending):
+                    msg = resync
+            self._msg = msg
+            self._cond.notify()
+
+    def qsize(self):
+        return int(self._msg is not None)
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._msg is not None, timeout):
+                raise queue.Empty
+            msg, self._msg = self._msg, None
+            return msg
+
+
+class _LineCache:
+    """Bounded LRU of source-position lookups, with hit/miss counters.
+
+    Values are (path, line) or None for "no source". Shared by thread and
+    breakpoint resolution and cleared whenever symbols change.
+    """
+    def __init__(self, size=4096):
+        self.size   = size
+        self.hits   = 0
+        self.misses = 0
+        self._data  = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, fill, *args):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            value = self._data[key] = fill(*args)
+            if len(self._data) > self.size:
+                self._data.popitem(last=False)
+            return value
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+
+class _History:
+    """Ring of the last capacity stops: (seq, thread, file id, line, inferior).
+
+    Each field is its own preallocated array, so an entry costs 24 bytes
+    and no Python objects. Appended from the debugger thread, read by
+    /history requests.
+    """
+    _TYPECODES = 'QIIII'
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._cols    = tuple(array.array(code, bytes(capacity * array.array(code).itemsize))
+                              for code in self._TYPECODES)
+        self._count   = 0  # entries ever appended
+        self._lock    = threading.Lock()
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, *entry):
+        if not self.capacity:
+            return
+        with self._lock:
+            i = self._count % self.capacity
+            for col, value in zip(self._cols, entry):
+                col[i] = value
+            self._count += 1
+
+    def since(self, seq):
+        """Entries with a stop seq above seq, oldest first."""
+        with self._lock:
+            cap, cols = self.capacity, self._cols
+            lo, hi    = self._count - len(self), self._count
+            seqs      = cols[0]
+            while lo < hi:  # seqs only grow, so bisect over ring positions
+                mid = (lo + hi) // 2
+                if seqs[mid % cap] <= seq:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return [tuple(col[i % cap] for col in cols) for i in range(lo, self._count)]
+
+
+class _Histogram:
+    """Fixed-bucket duration histogram, in seconds. observe() is one bisect
+    and a few adds under an uncontended lock, so it stays on."""
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+               0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+    def __init__(self):
+        self._lock  = threading.Lock()
+        self.counts = [0] * (len(self.BUCKETS) + 1)  # last bucket is +Inf
+        self.sum    = 0.0
+        self.max    = 0.0
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(self.BUCKETS, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum       += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def prom(self, name, help):
+        """This histogram as a Prometheus metric family."""
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        out, cumulative = [], 0
+        for le, n in zip((*self.BUCKETS, "+Inf"), counts):
+            cumulative += n
+            out.append(({"le": le}, cumulative))
+        return (_prom(name + "_bucket", "histogram", help, out, family=name) +
+                f"{name}_sum {total}\n{name}_count {cumulative}\n")
+
+    def summary(self):
+        """'N calls, mean X us, max Y us' for dvap-stats."""
+        n = self.count
+        if not n:
+            return "0 calls"
+        return f"{n} calls, mean {self.sum / n * 1e6:.0f} us, max {self.max * 1e6:.0f} us"
+
+
+def _prom(name, kind, help, samples, family=None):
+    """One Prometheus text-format metric family. samples: [(labels, value)]."""
+    family = family or name
+    out = [f"# HELP {family} {help}", f"# TYPE {family} {kind}"]
+    for labels, value in samples:
+        tags = ",".join(f'{k}="{v}"' for k, v in labels.items())
+        out.append(f"{name}{{{tags}}} {value}" if tags else f"{name} {value}")
+    return "\n".join(out) + "\n"
+
 
 class SSEDispatcher:
     """Thread-safe fan-out broadcaster to all connected SSE clients."""
     _SHUTDOWN = object()  # sentinel pushed to queues on shutdown
 
-    def __init__(self):
-        self._clients = []
+    def __init__(self, conflate=True, paths=None, metrics=None, history=None, stack=None,
+                 replay=256):
+        self._clients = {}    # queue -> (mode, view, conflates, id); mode is "full" or "delta"
         self._lock    = threading.Lock()
+        self._snap    = None  # last broadcast _Snapshot, replayed to new subscribers
+        self._new_snap = threading.Condition(self._lock)  # notified per broadcast, for /state
+        # (seq, {key: fields before seq, None if added}) for the last replay
+        # broadcasts, to catch up a delta client that reconnects with Last-Event-ID.
+        self._log     = collections.deque(maxlen=replay)
+        self.instance = os.urandom(4).hex()  # event ids are {instance}-{seq}
+        self.conflate = conflate  # slow clients skip to the latest state instead of being dropped
+        self.paths    = paths     # _PathTable behind interned views
+        self.metrics  = metrics   # () -> /metrics body
+        self.history  = history   # (since) -> /history body
+        self.stack    = stack     # (thread, inferior, depth) -> /stack body, None if unknown
         self.stopped  = threading.Event()
+        # Counters for /metrics. broadcasts and dropped change under _lock;
+        # bytes_sent is bumped by every writer, so it has its own lock.
+        self.broadcasts = 0
+        self.dropped    = 0
+        self.bytes_sent = 0
+        self._next_id   = 0
+        self._sent_lock = threading.Lock()
 
-    def subscribe(self):
-        q = queue.Queue(maxsize=100)
+    def subscribe(self, mode="full", view=_DEFAULT_VIEW, q=None, last_id=None):
+        """Register a client. q is anything with put_nowait; by default a
+        _LatestSlot, or a bounded Queue when conflation is off. A delta
+        client passing the Last-Event-ID it saw is sent only what changed
+        since, if that is still in the replay log."""
+        if q is None:
+            q = _LatestSlot() if self.conflate else queue.Queue(maxsize=100)
         with self._lock:
-            self._clients.append(q)
+            if self._snap is not None:
+                payload, _, snapshot, upto = self._snap.payloads(view)
+                first = snapshot if mode == "delta" else payload
+                if mode == "delta" and last_id:
+                    first, upto = self._resume(last_id, view, first, upto)
+                if first is not None:
+                    q.put_nowait(first if upto is None else (first, upto, view.binary))
+            self._next_id   += 1
+            self._clients[q] = (mode, view, getattr(q, 'conflate', False), self._next_id)
         return q
 
+    def _resume(self, last_id, view, snapshot, upto):
+        """(message, upto) catching a client up from event last_id: a delta,
+        None if it missed nothing, or snapshot if last_id is unknown or too
+        old. Caller holds _lock."""
+        instance, _, seq = last_id.strip().rpartition('-')
+        if instance != self.instance or not seq.isdigit():
+            return snapshot, upto
+        seq, snap = int(seq), self._snap
+        if seq == snap.seq:
+            return None, upto
+        if not self._log or seq > snap.seq or seq < self._log[0][0] - 1:
+            return snapshot, upto
+        records = dict(snap.records)
+        for logged, undo in reversed(self._log):
+            if logged <= seq:
+                break
+            for key, fields in undo.items():
+                if fields is None:
+                    records.pop(key, None)
+                else:
+                    records[key] = fields
+        _, delta, _, upto = snap.rebased(records).payloads(view)
+        return delta, upto
+
     def unsubscribe(self, q):
         with self._lock:
-            if q in self._clients:
-                self._clients.remove(q)
+            self._clients.pop(q, None)
+
+    def subscribed(self, q):
+        """False once q has been dropped for falling behind, or unsubscribed."""
+        return q in self._clients
+
+    def broadcast(self, snap):
+        """Fan out a _Snapshot. Every client gets the same pre-encoded bytes."""
+        new, old = snap.records, snap.prev_records
+        undo = {k: old.get(k) for k, r in new.items() if old.get(k) != r}
+        undo.update((k, r) for k, r in old.items() if k not in new)
+        with self._lock:
+            self._log.append((snap.seq, undo))
+            self._snap       = snap
+            self.broadcasts += 1
+            self._fan_out(lambda mode, view: self._messages(snap, mode, view))
+            self._new_snap.notify_all()
+
+    def state(self, view, since=None, timeout=0):
+        """(version, payload) of the latest snapshot for /state, its full
+        payload for view with any file records it needs in front. Waits up
+        to timeout seconds for the version to differ from since; returns
+        (since, None) if it does not. A snapshot that changes nothing view
+        sends (it filters or groups) does not count as a change.
 
-    def broadcast(self, data):
-        msg = f"data: {data}\n\n".encode('utf-8')
+        A version is an event id, {instance}-{seq}.
+        """
+        deadline = time.monotonic() + timeout
         with self._lock:
-            for q in self._clients[:]:
-                try:
+            while True:
+                snap    = self._snap
+                version = f"{self.instance}-{snap.seq}" if snap is not None else None
+                if snap is not None and since != version:
+                    if (since != f"{self.instance}-{snap.seq - 1}"
+                            or snap.payloads(view)[1] is not None):
+                        break
+                    since = version  # unchanged for this view
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.stopped.is_set():
+                    return since, None
+                self._new_snap.wait(remaining)
+        payload, _, _, upto = snap.payloads(view)
+        if upto is not None:
+            payload, _ = _unpack((payload, upto, view.binary), 0, self.paths)
+        return version, payload
+
+    @staticmethod
+    def _messages(snap, mode, view):
+        payload, delta, snapshot, upto = snap.payloads(view)
+        if delta is None:
+            return None, None  # filtered out
+        msg, resync = (delta, snapshot) if mode == "delta" else (payload, None)
+        if upto is not None:
+            msg    = (msg, upto, view.binary)
+            resync = resync and (resync, upto, view.binary)
+        return msg, resync
+
+    def heartbeat(self):
+        """Keep idle connections alive without re-sending the state."""
+        with self._lock:
+            self._fan_out(lambda mode, view:
+                          (_HEARTBEAT_BIN if view.binary else _HEARTBEAT, None))
+
+    def _fan_out(self, msg_for):
+        """msg_for(mode, view) -> (message, resync); resync replaces a skipped delta."""
+        for q, (mode, view, conflates, _) in list(self._clients.items()):
+            msg, resync = msg_for(mode, view)
+            if msg is None:
+                continue
+            try:
+                if conflates:
+                    q.put_nowait(msg, resync)
+                else:
                     q.put_nowait(msg)
-                except queue.Full:
-                    self._clients.remove(q)
+            except queue.Full:
+                del self._clients[q]
+                self.dropped += 1
+
+    def count_sent(self, n):
+        """Record n bytes written to a client."""
+        with self._sent_lock:
+            self.bytes_sent += n
+
+    def queue_depths(self):
+        """[(client id, messages waiting)] for every subscriber."""
+        with self._lock:
+            return [(cid, q.qsize()) for q, (_, _, _, cid) in self._clients.items()]
 
     def shutdown(self):
         """Signal all do_GET threads to exit and close their connections."""
         self.stopped.set()
         with self._lock:
+            self._new_snap.notify_all()
             for q in self._clients:
                 try:
                     q.put_nowait(_SHUTDOWN)
@@ -78,43 +733,235 @@ class _HTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
         t.start()
 
 
+class _UnixHTTPServer(_HTTPServer):
+    """_HTTPServer bound to a Unix socket path instead of a TCP port."""
+    address_family = socket.AF_UNIX if hasattr(socket, 'AF_UNIX') else None
+
+    def server_bind(self):
+        socketserver.TCPServer.server_bind(self)  # HTTPServer's expects (host, port)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def _socket_dir():
+    """Per-user directory holding one {pid}.sock per DVAP Unix socket."""
+    base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(base, f"dvap-{os.getuid()}")
+
+
+def _make_socket_dir(path):
+    """Create the socket directory path, or check the one already there.
+
+    Anyone who could swap or write into it could answer clients in our
+    place, so it must be a real directory, ours, and closed to others.
+    Raises OSError otherwise.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise OSError(f"{path} is not a directory (or is a symlink)")
+    if st.st_uid != os.getuid():
+        raise OSError(f"{path} is owned by uid {st.st_uid}")
+    if stat.S_IMODE(st.st_mode) != 0o700:
+        raise OSError(f"{path} has mode {stat.S_IMODE(st.st_mode):o}, not 700")
+
+
+def _socket_path(pid):
+    return os.path.join(_socket_dir(), f"{pid}.sock")
+
+
+_SSE_HEADERS = (
+    ("Content-Type",                "text/event-stream"),
+    ("Cache-Control",               "no-cache, no-transform"),
+    ("Connection",                  "keep-alive"),
+    ("X-Accel-Buffering",           "no"),
+    ("Access-Control-Allow-Origin", "*"),
+)
+
+
+_METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_TEXT_CONTENT_TYPE    = "text/plain; charset=utf-8"
+
+_STACK_DEPTH       = 16   # /threads/{id}/stack frames without depth=
+_STACK_MAX_DEPTH   = 256
+_STATE_TIMEOUT     = 30   # seconds /state waits for a change without timeout=
+_STATE_MAX_TIMEOUT = 300
+
+
+def _route(headers, path):
+    """Validate a request. Returns (status, message, endpoint, query).
+
+    headers is anything with a case-insensitive or lower-case-keyed get().
+    """
+    host = headers.get('host', '')
+    if not (host.startswith('127.0.0.1') or host.startswith('localhost')):
+        return 403, "Access Denied: Invalid Host header", None, None
+    url   = urllib.parse.urlsplit(path)
+    query = urllib.parse.parse_qs(url.query)
+    if url.path == '/metrics':
+        return 200, "OK", url.path, query
+    if url.path == '/history':
+        if not query.get('since', ['0'])[-1].isdigit():
+            return 400, "Bad Request: since must be a stop sequence number", None, None
+        return 200, "OK", url.path, query
+    parts = url.path.split('/')
+    if len(parts) == 4 and parts[1] == 'threads' and parts[3] == 'stack':
+        if not parts[2].isdigit():
+            return 400, "Bad Request: thread id must be a number", None, None
+        if not query.get('depth', ['1'])[-1].isdigit():
+            return 400, "Bad Request: depth must be a number of frames", None, None
+        if not query.get('inferior', ['0'])[-1].isdigit():
+            return 400, "Bad Request: inferior must be a number", None, None
+        query['thread'] = [parts[2]]
+        return 200, "OK", '/stack', query
+    if url.path == '/state':
+        if not query.get('timeout', ['0'])[-1].isdigit():
+            return 400, "Bad Request: timeout must be a number of seconds", None, None
+    elif url.path != '/events':
+        return 404, "Not Found", None, None
+    if query.get('mode', ['full'])[-1] not in ('full', 'delta'):
+        return 400, "Bad Request: mode must be 'full' or 'delta'", None, None
+    if query.get('paths', ['full'])[-1] not in ('full', 'interned'):
+        return 400, "Bad Request: paths must be 'full' or 'interned'", None, None
+    if 'format' not in query and _BIN_CONTENT_TYPE in headers.get('accept', ''):
+        query['format'] = ['binary']
+    if query.get('format', ['text'])[-1] not in ('text', 'binary'):
+        return 400, "Bad Request: format must be 'text' or 'binary'", None, None
+    if query.get('threads', ['all'])[-1] not in ('all', 'selected', 'grouped'):
+        return 400, "Bad Request: threads must be 'all', 'selected' or 'grouped'", None, None
+    if not set(_split_list(query.get('types', []))) <= _FILTER_TYPES:
+        return 400, "Bad Request: types must be a list of selected, thread, bp", None, None
+    return 200, "OK", url.path, query
+
+
+def _split_list(values):
+    """Items of repeated and comma-separated query values."""
+    return [item for value in values for item in value.split(',') if item]
+
+
+def _history_since(query):
+    return int(query.get('since', ['0'])[-1])
+
+
+def _state_reply(dispatcher, query, headers):
+    """(status, message, content type, body, headers) for a validated
+    /state request. Blocks while the state is at the version the client
+    already has (since= or If-None-Match), up to timeout= seconds."""
+    since = query.get('since', [None])[-1]
+    if since is None:
+        etag  = headers.get('if-none-match', '').split(',')[0].strip()
+        since = (etag[2:] if etag.startswith('W/') else etag).strip('"') or None
+    timeout = min(int(query.get('timeout', [_STATE_TIMEOUT])[-1]), _STATE_MAX_TIMEOUT)
+    view    = _subscription(query)[1]
+    version, body = dispatcher.state(view, since, timeout if since else 0)
+    extra = (("ETag", f'"{version}"'), ("Cache-Control", "no-cache"),
+             ("Access-Control-Allow-Origin", "*"), ("Access-Control-Expose-Headers", "ETag"))
+    if body is None:
+        return 304, "Not Modified", None, b"", extra
+    if view.binary:
+        return 200, "OK", _BIN_CONTENT_TYPE, body, extra
+    # The SSE framing of the shared payload, dropped: one line per message.
+    body = b"".join(line[6:] + b"\n" for line in body.split(b"\n") if line.startswith(b"data: "))
+    return 200, "OK", _TEXT_CONTENT_TYPE, body, extra
+
+
+def _stack_args(query):
+    """(thread, inferior or None, depth) for a validated /stack query."""
+    inf   = query.get('inferior')
+    depth = int(query.get('depth', [_STACK_DEPTH])[-1])
+    return (int(query['thread'][-1]), int(inf[-1]) if inf else None,
+            max(1, min(depth, _STACK_MAX_DEPTH)))
+
+
+def _filter(query):
+    """_Filter for a validated /events query, or None if it has no filters."""
+    types    = _split_list(query.get('types', []))
+    files    = _split_list(query.get('files', []))
+    selected = query.get('threads', ['all'])[-1] == 'selected'
+    if not (types or files or selected):
+        return None
+    return _Filter(frozenset(types) if types else None, selected,
+                   tuple(files) if files else None)
+
+
+def _subscription(query):
+    """(mode, view) for a validated /events query. Called once per
+    connection; the view, filter included, keys the shared payload cache."""
+    binary = query.get('format', ['text'])[-1] == 'binary'
+    view   = _View(interned=binary or query.get('paths', ['full'])[-1] == 'interned',
+                   binary=binary, filter=_filter(query),
+                   grouped=query.get('threads', ['all'])[-1] == 'grouped')
+    return query.get('mode', ['full'])[-1], view
+
+
+def _stream_headers(query):
+    """Response headers for an /events stream in the negotiated format."""
+    if query.get('format', ['text'])[-1] != 'binary':
+        return _SSE_HEADERS
+    return (("Content-Type", _BIN_CONTENT_TYPE),) + _SSE_HEADERS[1:]
+
+
 class _SSEHandler(http.server.BaseHTTPRequestHandler):
     def _check_request(self):
-        host = self.headers.get('Host', '')
-        if not (host.startswith('127.0.0.1') or host.startswith('localhost')):
-            self.send_error(403, "Access Denied: Invalid Host header")
-            return False
-        if self.path != '/events':
-            self.send_error(404, "Not Found")
+        code, message, self.endpoint, self.query = _route(self.headers, self.path)
+        if code != 200:
+            self.send_error(code, message)
             return False
         return True
 
     def _send_sse_headers(self):
         self.send_response(200)
-        self.send_header("Content-Type",               "text/event-stream")
-        self.send_header("Cache-Control",              "no-cache, no-transform")
-        self.send_header("Connection",                 "keep-alive")
-        self.send_header("X-Accel-Buffering",          "no")
-        self.send_header("Access-Control-Allow-Origin","*")
+        for name, value in _stream_headers(self.query):
+            self.send_header(name, value)
+        self.end_headers()
+
+    def _send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
 
     def do_GET(self):
         if not self._check_request():
             return
+        if self.endpoint == '/metrics':
+            self._send_body(self.server.dispatcher.metrics().encode('utf-8'),
+                            _METRICS_CONTENT_TYPE)
+            return
+        if self.endpoint == '/history':
+            self._send_body(self.server.dispatcher.history(_history_since(self.query)),
+                            _TEXT_CONTENT_TYPE)
+            return
+        if self.endpoint == '/state':
+            self._send_state()
+            return
+        if self.endpoint == '/stack':
+            self._send_stack()
+            return
         self._send_sse_headers()
         self.wfile.flush()
         disp = self.server.dispatcher
-        q    = disp.subscribe()
+        q    = disp.subscribe(*_subscription(self.query),
+                              last_id=self.headers.get('Last-Event-ID'))
+        # A slot always receives _SHUTDOWN, so it can block; a full Queue
+        # may lose it, or be dropped, and has to poll.
+        poll = None if isinstance(q, _LatestSlot) else 0.05
+        sent = 0  # highest path id this connection has been sent
         try:
-            while not disp.stopped.is_set():
+            # A dropped client is closed at once; its backlog is stale.
+            while not disp.stopped.is_set() and disp.subscribed(q):
                 try:
-                    msg = q.get(timeout=0.05)
+                    msg = q.get(timeout=poll)
                 except queue.Empty:
                     continue
                 if msg is _SHUTDOWN:
                     break
+                msg, sent = _unpack(msg, sent, disp.paths)
                 self.wfile.write(msg)
                 self.wfile.flush()
+                disp.count_sent(len(msg))
         except (ConnectionResetError, BrokenPipeError, OSError):
             pass
         finally:
@@ -128,43 +975,705 @@ class _SSEHandler(http.server.BaseHTTPRequestHandler):
     def do_HEAD(self):
         if not self._check_request():
             return
+        if self.endpoint == '/metrics':
+            self._send_body(self.server.dispatcher.metrics().encode('utf-8'),
+                            _METRICS_CONTENT_TYPE)
+            return
+        if self.endpoint == '/history':
+            self._send_body(self.server.dispatcher.history(_history_since(self.query)),
+                            _TEXT_CONTENT_TYPE)
+            return
+        if self.endpoint == '/state':
+            self._send_state()
+            return
+        if self.endpoint == '/stack':
+            self._send_stack()
+            return
         self._send_sse_headers()
 
+    def _send_state(self):
+        code, message, content_type, body, headers = _state_reply(
+            self.server.dispatcher, self.query, self.headers)
+        self.send_response(code, message)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_stack(self):
+        body = self.server.dispatcher.stack(*_stack_args(self.query))
+        if body is None:
+            self.send_error(404, "Not Found: no such stopped thread")
+        else:
+            self._send_body(body, _TEXT_CONTENT_TYPE)
+
     def log_message(self, format, *args):
         pass  # suppress HTTP request logs in the gdb console
 
 
-class DVAPServer:
-    """All state for one DVAP server instance. Stored on gdb._dvap_instance."""
+class _SelectorClient:
+    """One connection served by _SelectorServer.
+
+    Passed to SSEDispatcher.subscribe in place of a queue.Queue: put_nowait
+    only appends to the outgoing buffer and wakes the selector thread,
+    which does all socket I/O.
+    """
+    MAX_PENDING = 100  # queued messages before a non-conflating client is dropped
+
+    def __init__(self, sock, server, conflate):
+        self.sock      = sock
+        self.server    = server
+        self.conflate  = conflate
+        self.lock      = threading.Lock()  # guards out against the selector thread
+        self.inbuf     = b""
+        self.out       = collections.deque()
+        self.streaming = False  # request handled, now an SSE subscriber
+        self.replying  = False  # request handled, response built off the selector thread
+        self.closing   = False  # close once out is flushed
+        self.paths_sent = 0     # highest path id this connection has been sent
+
+    def qsize(self):
+        return len(self.out)
+
+    def put_nowait(self, msg, resync=None):
+        with self.lock:
+            if msg is _SHUTDOWN:
+                self.closing = True
+            elif self.conflate and len(self.out) > 1:
+                # Keep the message in flight, replace whatever waits behind it.
+                if _is_heartbeat(msg):
+                    return
+                while len(self.out) > 1:
+                    self.out.pop()
+                self.out.append(resync or msg)
+            elif len(self.out) >= self.MAX_PENDING:
+                self.closing = True
+                self.server.wake(self)
+                raise queue.Full
+            else:
+                self.out.append(msg)
+        self.server.wake(self)
+
+
+class _SelectorServer:
+    """Single-threaded alternative to _HTTPServer.
+
+    One selector loop accepts connections, parses requests and writes to
+    every SSE client with non-blocking sends; no thread per client and no
+    polling while idle.
+    """
+    MAX_REQUEST = 8192  # bytes of request line + headers
+    # Endpoints answered on the selector thread; the others may block, so
+    # each gets a thread.
+    INLINE = frozenset(('/metrics', '/history'))
+
+    def __init__(self, addr, dispatcher):
+        """addr is (host, port), a Unix socket path or a listening socket."""
+        self.dispatcher = dispatcher
+        if isinstance(addr, socket.socket):  # bound by someone else (relay mode)
+            self.socket = addr
+        elif isinstance(addr, str):  # Unix socket path
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                self.socket.bind(addr)
+                self.socket.listen()
+            except OSError:
+                self.socket.close()
+                raise
+        else:
+            self.socket = socket.create_server(addr)
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._woken    = set()  # clients with new output, guarded by _lock
+        self._lock     = threading.Lock()
+        self._sel      = selectors.DefaultSelector()
+        self._sel.register(self.socket,  selectors.EVENT_READ)
+        self._sel.register(self._wake_r, selectors.EVENT_READ)
+        self._running  = False
+        self._done     = threading.Event()
+
+    def wake(self, client):
+        """Hand a client with new output to the selector thread (any thread)."""
+        with self._lock:
+            first = not self._woken
+            self._woken.add(client)
+        if first:
+            try:
+                self._wake_w.send(b"\0")
+            except (BlockingIOError, OSError):
+                pass  # a wakeup is already pending, or we are closing
+
+    def serve_forever(self):
+        self._running = True
+        try:
+            while self._running:
+                for key, mask in self._sel.select():
+                    if key.fileobj is self.socket:
+                        self._accept()
+                    elif key.fileobj is self._wake_r:
+                        self._on_wake()
+                    else:
+                        if mask & selectors.EVENT_READ:
+                            self._read(key.data)
+                        if mask & selectors.EVENT_WRITE:
+                            self._flush(key.data)
+        finally:
+            for key in list(self._sel.get_map().values()):
+                if key.data is not None:
+                    self._close(key.data)
+            self._done.set()
+
+    def shutdown(self):
+        self._running = False
+        self.wake(None)
+        self._done.wait()
+
+    def server_close(self):
+        self._sel.close()
+        for s in (self.socket, self._wake_r, self._wake_w):
+            s.close()
+
+    def _accept(self):
+        try:
+            sock, _ = self.socket.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        self._sel.register(sock, selectors.EVENT_READ,
+                           _SelectorClient(sock, self, self.dispatcher.conflate))
+
+    def _on_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            woken, self._woken = self._woken, set()
+        for client in woken:
+            if client is not None:
+                self._flush(client)
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(client)  # peer hung up
+            return
+        if client.streaming or client.replying:
+            return  # nothing more is expected from this client
+        client.inbuf += data
+        if b"\r\n\r\n" in client.inbuf:
+            self._handle_request(client)
+        elif len(client.inbuf) > self.MAX_REQUEST:
+            self._reply_error(client, 431, "Request Header Fields Too Large")
+
+    def _handle_request(self, client):
+        head, _, _ = client.inbuf.partition(b"\r\n\r\n")
+        lines   = head.decode('latin-1').split("\r\n")
+        request = lines[0].split()
+        if len(request) != 3:
+            self._reply_error(client, 400, "Bad Request")
+            return
+        method, path, _ = request
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if method not in ('GET', 'HEAD'):
+            self._reply_error(client, 501, "Unsupported method")
+            return
+        code, message, endpoint, query = _route(headers, path)
+        if code != 200:
+            self._reply_error(client, code, message)
+            return
+        if endpoint in self.INLINE:
+            code, message, content_type, body, extra = self._endpoint_reply(endpoint, query,
+                                                                            headers)
+            self._reply(client, code, message, content_type, body, method == 'HEAD', extra)
+            return
+        if endpoint != '/events':
+            # May wait on the debugger or for a change, which must not
+            # stall the other clients.
+            client.replying = True
+            threading.Thread(target=self._reply_threaded,
+                             args=(client, endpoint, query, headers, method == 'HEAD'),
+                             daemon=True).start()
+            return
+        client.out.append(b"HTTP/1.0 200 OK\r\n" +
+                          "".join(f"{n}: {v}\r\n"
+                                  for n, v in _stream_headers(query)).encode('latin-1') +
+                          b"\r\n")
+        if method == 'HEAD':
+            client.closing = True
+        else:
+            client.streaming = True
+            self.dispatcher.subscribe(*_subscription(query), client,
+                                      last_id=headers.get('last-event-id'))
+        self._flush(client)
+
+    def _reply_error(self, client, code, message):
+        self._reply(client, code, message, "text/plain",
+                    f"{code} {message}\n".encode('utf-8'))
+
+    def _reply(self, client, code, message, content_type, body, head_only=False, headers=()):
+        """Send one complete response and close the connection."""
+        client.out.append(self._response(code, message, content_type, body, head_only,
+                                         headers))
+        client.closing = True
+        self._flush(client)
+
+    def _reply_threaded(self, client, endpoint, query, headers, head_only):
+        """_reply, from a thread of its own (any thread)."""
+        try:
+            code, message, content_type, body, extra = self._endpoint_reply(endpoint, query,
+                                                                            headers)
+        except OSError as e:  # a relay's request to the debugger failed
+            code, message, content_type, extra = 502, "Bad Gateway", "text/plain", ()
+            body = f"{code} {message}: {e}\n".encode('utf-8')
+        response = self._response(code, message, content_type, body, head_only, extra)
+        with client.lock:
+            client.out.append(response)
+            client.closing = True
+        self.wake(client)
+
+    def _endpoint_reply(self, endpoint, query, headers):
+        """(status, message, content type, body, headers) for a validated
+        request to any endpoint but /events."""
+        disp = self.dispatcher
+        if endpoint == '/metrics':
+            return 200, "OK", _METRICS_CONTENT_TYPE, disp.metrics().encode('utf-8'), ()
+        if endpoint == '/history':
+            return 200, "OK", _TEXT_CONTENT_TYPE, disp.history(_history_since(query)), ()
+        if endpoint == '/state':
+            return _state_reply(disp, query, headers)
+        body = disp.stack(*_stack_args(query))
+        if body is None:
+            code, message = 404, "Not Found: no such stopped thread"
+            return code, message, "text/plain", f"{code} {message}\n".encode('utf-8'), ()
+        return 200, "OK", _TEXT_CONTENT_TYPE, body, ()
+
+    @staticmethod
+    def _response(code, message, content_type, body, head_only=False, headers=()):
+        head = f"HTTP/1.0 {code} {message}\r\n"
+        if content_type:
+            head += f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers)
+        return ((head + "Connection: close\r\n\r\n").encode('latin-1') +
+                (b"" if head_only else body))
+
+    def _flush(self, client):
+        if client.sock.fileno() < 0:
+            return  # already closed
+        out = client.out
+        try:
+            with client.lock:
+                while out:
+                    chunk = out[0]
+                    if type(chunk) is tuple:
+                        chunk, client.paths_sent = _unpack(chunk, client.paths_sent,
+                                                           self.dispatcher.paths)
+                    sent  = client.sock.send(chunk)
+                    if client.streaming:
+                        self.dispatcher.count_sent(sent)
+                    if sent < len(chunk):
+                        out[0] = chunk[sent:]
+                        break
+                    out.popleft()
+                pending = bool(out)
+        except BlockingIOError:
+            pending = True
+        except OSError:
+            self._close(client)
+            return
+        if not pending and client.closing:
+            self._close(client)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if pending else 0)
+        self._sel.modify(client.sock, events, client)
+
+    def _close(self, client):
+        if client.sock.fileno() < 0:
+            return
+        self.dispatcher.unsubscribe(client)
+        try:
+            self._sel.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+
+
+class _Encoder:
+    """Record formatting and per-view payload encoding, shared by DVAPServer
+    and the relay process. Needs _paths, _disp and _encode_hist."""
     FS = ";;"   # field separator (within a record)
     RS = "||"   # record separator (between records)
 
-    def __init__(self, port):
-        self._state = {"threads": {}, "breakpoints": {}, "selected_thread": None}
-        self._lock  = threading.Lock()
-        self._disp  = SSEDispatcher()
-        self._http  = None
-        self._evts  = {}
+    _PATH_FIELD = {"thread": 3, "bp": 2, "threads": 1}  # path index per record type
+
+    def _format(self, fields, view=_DEFAULT_VIEW):
+        """One record as protocol text. A del record carries its key, whose
+        path (threads groups only) is interned like the record's."""
+        if view.interned:
+            i = self._PATH_FIELD.get(fields[0])
+            if fields[0] == "del" and fields[1] == "threads":
+                i = 2
+            if i is not None:
+                fields = (*fields[:i], self._paths.intern(fields[i]), *fields[i + 1:])
+        return self.FS.join(map(str, fields))
+
+    def _join(self, records):
+        RS = self.RS
+        return "".join(r + RS for r in records)
+
+    def _encode(self, snap, view):
+        """Build snap.payloads(view), timed into _encode_hist."""
+        t0 = time.perf_counter()
+        new, old = snap.records, snap.prev_records
+        if view.filter is not None:
+            new = view.filter.apply(new, self._PATH_FIELD)
+            old = view.filter.apply(old, self._PATH_FIELD)
+        if view.grouped:
+            new, old = _group_threads(new), _group_threads(old)
+        if view.binary:
+            payloads = self._encode_binary(snap.seq, new, old)
+        else:
+            payloads = self._encode_text(snap.seq, new, old, view)
+        if (view.filter is not None or view.grouped) and new == old:
+            payloads = (payloads[0], None, *payloads[2:])
+        self._encode_hist.observe(time.perf_counter() - t0)
+        return payloads
+
+    def _encode_text(self, seq, new, old, view):
+        """A delta carries added/changed records and a del record per key
+        gone since the previous snapshot."""
+        FS    = self.FS
+        text  = {k: self._format(r, view) for k, r in new.items()}
+        body  = list(text.values())
+        delta = [f"delta{FS}{seq}"]
+        delta += [text[k] for k, r in new.items() if old.get(k) != r]
+        delta += [self._format(("del", *k), view) for k in old if k not in new]
+        event_id = f"{self._disp.instance}-{seq}"
+        return (_sse(self._join(body), event_id),
+                _sse(self._join(delta), event_id),
+                _sse(self._join([f"snapshot{FS}{seq}", *body]), event_id),
+                len(self._paths) if view.interned else None)
+
+    def _encode_binary(self, seq, new, old):
+        """snap.payloads() for a binary view, from the same records."""
+        intern = self._paths.intern
+        recs   = {k: _bin_record(r, intern) for k, r in new.items()}
+        body   = b"".join(recs.values())
+        delta  = (b"".join(recs[k] for k, r in new.items() if old.get(k) != r) +
+                  b"".join(_bin_del(k, intern) for k in old if k not in new))
+        return (_bin_frame(_BIN_FULL, seq, body),
+                _bin_frame(_BIN_DELTA, seq, delta),
+                _bin_frame(_BIN_SNAPSHOT, seq, body),
+                len(self._paths))
+
+
+_FEED_HEAD           = struct.Struct(">I")  # length of the pickled item that follows
+_RELAY_SEND_TIMEOUT  = 5   # seconds a push may block before the relay counts as gone
+_RELAY_FETCH_TIMEOUT = 30  # seconds the relay waits on the debugger's own server
+_SCRIPT              = os.path.abspath(__file__)
+
+# Runs this script as the relay process: python -c _RELAY_BOOT <script> <args>.
+_RELAY_BOOT = ("import sys; path = sys.argv[1]; "
+               "exec(compile(open(path).read(), path, 'exec'),"
+               " {'__name__': '__dvap_relay__', '__file__': path})")
+
+
+def _relay_python():
+    """Interpreter for the relay process. An embedded Python's
+    sys.executable may be the debugger itself; then python3.X from PATH."""
+    exe = sys.executable
+    if exe and os.path.basename(exe).startswith('python'):
+        return exe
+    version = f"python{sys.version_info[0]}.{sys.version_info[1]}"
+    return shutil.which(version) or shutil.which('python3') or 'python3'
+
+
+class _RelayProcess:
+    """Debugger side of relay mode.
+
+    A helper process owns the TCP listener and every client on it. Each
+    published snapshot is pushed to it once over a socketpair, as its
+    records plus the path table entries added since the last push; the
+    relay encodes, buffers and writes for all clients, so their I/O does
+    not compete for the debugger's GIL. /metrics, /history and
+    /threads/{id}/stack need the debugger: the relay forwards those to
+    the debugger's own server on backend_port.
+    """
 
+    def __init__(self, listener, backend_port, paths, slow_clients, instance):
+        self._paths      = paths
+        self._paths_sent = 0  # highest path id the relay has
+        self._sock, theirs = socket.socketpair()
         try:
-            self._http = _HTTPServer(('127.0.0.1', port), _SSEHandler, self._disp)
+            fds = (listener.fileno(), theirs.fileno())
+            self.proc = subprocess.Popen(
+                [_relay_python(), '-c', _RELAY_BOOT, _SCRIPT, *map(str, fds),
+                 str(backend_port), slow_clients, instance],
+                pass_fds=fds, stdin=subprocess.DEVNULL,
+                start_new_session=True)  # no SIGINT from the debugger's terminal
+        except OSError:
+            self._sock.close()
+            raise
+        finally:
+            theirs.close()
+        self._sock.settimeout(_RELAY_SEND_TIMEOUT)
+        self.pushed       = 0  # snapshots
+        self.pushed_bytes = 0
+        self.stopped      = False  # closed, or the relay went away
+
+    def push(self, snap):
+        """Send snap to the relay, or a heartbeat for None."""
+        if self.stopped:
+            return
+        upto = self._paths_sent
+        if snap is not None:
+            # Every path, so that the relay's ids match those of /history.
+            intern = self._paths.intern
+            for fields in snap.records.values():
+                i = _Encoder._PATH_FIELD.get(fields[0])
+                if i is not None:
+                    intern(fields[i])
+            upto = len(self._paths)
+            snap = (snap.seq, snap.records,
+                    [self._paths.path(i) for i in range(self._paths_sent + 1, upto + 1)])
+        data = pickle.dumps(snap, 4)
+        try:
+            self._sock.sendall(_FEED_HEAD.pack(len(data)) + data)
+        except OSError as e:
+            if not self.stopped:
+                self.stopped = True
+                print(f"[DVAP] Relay process gone ({e}); TCP clients no longer get"
+                      " updates. dvap-start restarts it.")
+            return
+        self._paths_sent   = upto
+        self.pushed       += snap is not None
+        self.pushed_bytes += _FEED_HEAD.size + len(data)
+
+    def close(self):
+        """Stop the relay. At the end of its feed it closes every client and
+        exits."""
+        self.stopped = True
+        self._sock.close()
+        try:
+            self.proc.wait(_RELAY_SEND_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class _Relay(_Encoder):
+    """The relay process (see _RelayProcess). Rebuilds each snapshot the
+    debugger pushes and serves the TCP clients from it on a
+    _SelectorServer, encoding per view as the debugger would."""
+
+    def __init__(self, listener, feed, backend_port, slow_clients, instance):
+        self._feed        = feed
+        self._backend     = backend_port
+        self._paths       = _PathTable(self.FS, self.RS)
+        self._encode_hist = _Histogram()
+        self._disp        = SSEDispatcher(conflate=(slow_clients == 'latest'),
+                                          paths=self._paths, metrics=self.metrics,
+                                          history=self.history, stack=self.stack)
+        self._disp.instance = instance  # event ids and versions stay the debugger's
+        self._http        = _SelectorServer(listener, self._disp)
+        self._http.INLINE = frozenset()  # every other reply waits on the debugger
+        self.snapshot     = _EMPTY_SNAPSHOT
+
+    def serve(self):
+        threading.Thread(target=self._feed_loop, daemon=True).start()
+        self._http.serve_forever()
+        self._http.server_close()
+
+    def _feed_loop(self):
+        """Fan out what the debugger pushes until it closes the feed."""
+        feed = self._feed.makefile('rb')
+        try:
+            while True:
+                head = feed.read(_FEED_HEAD.size)
+                if len(head) < _FEED_HEAD.size:
+                    break  # dvap-stop, dvap-start, or the debugger exited
+                item = pickle.loads(feed.read(_FEED_HEAD.unpack(head)[0]))
+                if item is None:
+                    self._disp.heartbeat()
+                    continue
+                seq, records, paths = item
+                for path in paths:
+                    self._paths.intern(path)
+                prev = self.snapshot
+                self.snapshot = _Snapshot(seq, records, prev.records, self._encode)
+                self._disp.broadcast(self.snapshot)
+        except OSError:
+            pass
+        finally:
+            self._disp.shutdown()
+            self._http.shutdown()
+
+    def metrics(self):
+        """The debugger's /metrics, plus the counters of this process's clients."""
+        disp = self._disp
+        return self._fetch("/metrics").decode('utf-8') + "".join([
+            _prom("dvap_relay_broadcasts_total", "counter",
+                  "State snapshots the relay fanned out to clients.", [({}, disp.broadcasts)]),
+            _prom("dvap_relay_sent_bytes_total", "counter",
+                  "Bytes the relay wrote to client connections.", [({}, disp.bytes_sent)]),
+            _prom("dvap_relay_clients_dropped_total", "counter",
+                  "Relay clients disconnected for falling behind.", [({}, disp.dropped)]),
+            _prom("dvap_relay_client_queue_depth", "gauge",
+                  "Messages waiting to be written, per relay client.",
+                  [({"client": cid}, depth) for cid, depth in disp.queue_depths()]),
+            self._encode_hist.prom("dvap_relay_encode_seconds",
+                                   "Time for the relay to encode one snapshot for one view."),
+        ])
+
+    def history(self, since):
+        return self._fetch(f"/history?since={since}")
+
+    def stack(self, num, inf, depth):
+        query = f"depth={depth}" + (f"&inferior={inf}" if inf is not None else "")
+        return self._fetch(f"/threads/{num}/stack?{query}")
+
+    def _fetch(self, path):
+        """GET path from the debugger's own server: the body, or None for a
+        404. Raises OSError if the debugger does not answer."""
+        conn = http.client.HTTPConnection('127.0.0.1', self._backend,
+                                          timeout=_RELAY_FETCH_TIMEOUT)
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            body     = response.read()
+        except http.client.HTTPException as e:
+            raise OSError(e)
+        finally:
+            conn.close()
+        if response.status == 404:
+            return None
+        if response.status != 200:
+            raise OSError(f"{response.status} {response.reason}")
+        return body
+
+
+def _relay_main(argv):
+    """Entry point of the relay process; argv as _RelayProcess passes it."""
+    listen_fd, feed_fd, backend_port, slow_clients, instance = argv
+    _Relay(socket.socket(fileno=int(listen_fd)), socket.socket(fileno=int(feed_fd)),
+           int(backend_port), slow_clients, instance).serve()
+    return 0
+
+
+class DVAPServer(_Encoder):
+    """All state for one DVAP server instance. Stored on gdb._dvap_instance."""
+
+    def __init__(self, port, heartbeat=15, transport='threaded', slow_clients='latest',
+                 fast_step=False, unix_socket=False, history=4096, relay=False):
+        # threads: {inferior num: {thread num: pos}}; selected_thread: (inferior, thread);
+        # syncing: the initial _sync_gdb_state has not finished
+        self._state     = {"threads": {}, "breakpoints": {}, "selected_thread": None,
+                           "syncing": True}
+        self._lock      = threading.Lock()
+        # Bumped under _lock by every state mutation; the broadcast loop
+        # sleeps on _changed until it moves.
+        self._changed   = threading.Condition(self._lock)
+        self._version   = 0
+        self.snapshot   = _EMPTY_SNAPSHOT  # last published state, read without _lock
+        self.fast_step  = fast_step
+        self._resumed   = None  # (inferior, thread) nums resumed since the last refresh; None = all
+        self._step_resumed = None  # the same, if those resumes were steps; see _on_cont
+        self._stale     = set() # inferior nums resumed since their threads were last walked
+        self._stop_gen  = 0     # bumped per stop, invalidates posted lazy refreshes
+        self._stop_event     = None  # latest stop awaiting _deferred_refresh
+        self._refresh_posted = False
+        self._stops     = 0     # stop events, and the refreshes
+        self._refreshes = 0     # they were coalesced into
+        self._lines     = _LineCache()  # (progspace, pc, frame type) | ('spec', location)
+        self._encode_hist = _Histogram()
+        self._stop_hist   = _Histogram()  # _refresh
+        self._history   = _History(history)  # selected thread at each refresh
+        # (stop gen, {(inferior, thread): (stop, frames, complete)}): call
+        # stacks walked since that stop, on request only. See stack().
+        self._stacks         = (0, {})
+        self._stack_requests = 0
+        self._stack_walks    = 0
+        self.heartbeat  = heartbeat
+        self._paths     = _PathTable(self.FS, self.RS)
+        self._disp      = SSEDispatcher(conflate=(slow_clients == 'latest'), paths=self._paths,
+                                        metrics=self.metrics, history=self.history,
+                                        stack=self.stack)
+        self._http      = None
+        self._unix      = None  # optional second listener on unix_path
+        self.unix_path  = None
+        self._relay     = None  # _RelayProcess serving the TCP clients, in relay mode
+        self.port       = port  # where TCP clients connect
+        self._evts      = {}
+
+        listener = None
+        try:
+            if relay:
+                # The relay serves port. The debugger's own server, on any
+                # free port, only answers what the relay forwards.
+                listener = socket.create_server(('127.0.0.1', port))
+            addr = ('127.0.0.1', 0 if relay else port)
+            if transport == 'selector':
+                self._http = _SelectorServer(addr, self._disp)
+            else:
+                self._http = _HTTPServer(addr, _SSEHandler, self._disp)
+            self.port = self._http.server_address[1]
+            if relay:
+                self._relay = _RelayProcess(listener, self.port, self._paths, slow_clients,
+                                            self._disp.instance)
+                self.port   = listener.getsockname()[1]
         except OSError as e:
             print(f"[DVAP] Failed to start server on port {port}: {e}")
+            if self._http:
+                self._http.server_close()
+                self._http = None
             return
+        finally:
+            if listener is not None:
+                listener.close()  # the relay has its own
 
-        self._sync_gdb_state()
+        self._publish(self._records())  # so early subscribers start from a snapshot
         gdb.Thread(target=self._broadcast_loop, daemon=True).start()
         gdb.Thread(target=self._http.serve_forever, daemon=True).start()
-        print(f"[DVAP] Listening on 127.0.0.1:{port}")
+        where = f" (relay process {self._relay.proc.pid})" if self._relay else ""
+        print(f"[DVAP] Listening on 127.0.0.1:{self.port}{where}")
+        if unix_socket:
+            self._listen_unix(transport)
         self._connect_events()
+        self._sync_gdb_state()
 
     def shutdown(self):
         # Dispatcher first: unblocks do_GET threads before server.shutdown()
         # waits on them.
         self._disp.shutdown()
-        if self._http:
-            self._http.shutdown()
-            self._http.server_close()
+        with self._changed:
+            self._changed.notify_all()  # wake _broadcast_loop so it can exit
+        for server in (self._http, self._unix):
+            if server:
+                server.shutdown()
+                server.server_close()
+        if self._relay:
+            self._relay.close()
+        if self._unix:
+            try:
+                os.unlink(self.unix_path)
+            except OSError:
+                pass
         for event, fn in self._evts.items():
             try:
                 event.disconnect(fn)
@@ -174,85 +1683,615 @@ class DVAPServer:
     def _connect_events(self):
         self._evts = {
             gdb.events.stop:                self._on_stop,
+            gdb.events.cont:                self._on_cont,
             gdb.events.breakpoint_created:  self._on_bp_created,
             gdb.events.breakpoint_modified: self._on_bp_modified,
             gdb.events.breakpoint_deleted:  self._on_bp_deleted,
             gdb.events.exited:              self._on_inferior_exited,
             gdb.events.gdb_exiting:         self._on_gdb_exiting,
+            gdb.events.new_objfile:         self._on_objfiles_changed,
+            gdb.events.clear_objfiles:      self._on_objfiles_changed,
         }
+        if hasattr(gdb.events, 'free_objfile'):  # GDB 13+
+            self._evts[gdb.events.free_objfile] = self._on_objfiles_changed
+        if hasattr(gdb.events, 'inferior_deleted'):
+            self._evts[gdb.events.inferior_deleted] = self._on_inferior_exited
         for event, fn in self._evts.items():
             event.connect(fn)
 
+    def _listen_unix(self, transport):
+        """Also serve on _socket_path(pid). A failure here leaves TCP running."""
+        if not hasattr(socket, 'AF_UNIX'):
+            print("[DVAP] Unix sockets are not supported on this platform")
+            return
+        path = _socket_path(self._inferior_pid())
+        try:
+            _make_socket_dir(os.path.dirname(path))
+            try:
+                os.unlink(path)  # left behind by a session that did not shut down
+            except FileNotFoundError:
+                pass
+            if transport == 'selector':
+                self._unix = _SelectorServer(path, self._disp)
+            else:
+                self._unix = _UnixHTTPServer(path, _SSEHandler, self._disp)
+        except OSError as e:
+            print(f"[DVAP] Failed to listen on {path}: {e}")
+            return
+        self.unix_path = path
+        gdb.Thread(target=self._unix.serve_forever, daemon=True).start()
+        print(f"[DVAP] Listening on {path}")
+
+    def _inferior_pid(self):
+        """The inferior's pid, or the debugger's while nothing is running."""
+        return gdb.selected_inferior().pid or os.getpid()
+
+    def _follow_pid(self):
+        """Rename the Unix socket after the inferior it now serves.
+
+        A bound Unix socket stays reachable through the renamed path.
+        """
+        path = _socket_path(self._inferior_pid())
+        if path != self.unix_path:
+            try:
+                os.replace(self.unix_path, path)
+                self.unix_path = path
+            except OSError:
+                pass
+
+    def metrics(self):
+        """Counters, histograms and gauges in Prometheus text format (/metrics)."""
+        disp, lines = self._disp, self._lines
+        relay = self._relay
+        return "".join([
+            _prom("dvap_broadcasts_total", "counter",
+                  "State snapshots fanned out to clients.", [({}, disp.broadcasts)]),
+            _prom("dvap_sent_bytes_total", "counter",
+                  "Bytes written to client connections.", [({}, disp.bytes_sent)]),
+            _prom("dvap_clients_dropped_total", "counter",
+                  "Clients disconnected for falling behind.", [({}, disp.dropped)]),
+            _prom("dvap_client_queue_depth", "gauge",
+                  "Messages waiting to be written, per connected client.",
+                  [({"client": cid}, depth) for cid, depth in disp.queue_depths()]),
+            self._encode_hist.prom("dvap_encode_seconds",
+                                   "Time to encode one snapshot for one client view."),
+            self._stop_hist.prom("dvap_stop_seconds",
+                                 "Time to refresh thread positions after a stop."),
+            _prom("dvap_stops_total", "counter",
+                  "Stop events received.", [({}, self._stops)]),
+            _prom("dvap_stop_refreshes_total", "counter",
+                  "Thread refreshes run; stops that arrive together share one.",
+                  [({}, self._refreshes)]),
+            _prom("dvap_stack_requests_total", "counter",
+                  "Call stacks requested from /threads/{id}/stack.",
+                  [({}, self._stack_requests)]),
+            _prom("dvap_stack_walks_total", "counter",
+                  "Call stacks read from the debugger; other requests hit the cache.",
+                  [({}, self._stack_walks)]),
+            _prom("dvap_line_cache_hits_total", "counter",
+                  "Source-position lookups answered from the line cache.", [({}, lines.hits)]),
+            _prom("dvap_line_cache_misses_total", "counter",
+                  "Source-position lookups that asked the debugger.", [({}, lines.misses)]),
+            _prom("dvap_line_cache_entries", "gauge",
+                  "Entries in the line cache.", [({}, len(lines))]),
+            _prom("dvap_relay_pushed_bytes_total", "counter",
+                  "Bytes of state pushed to the relay process.",
+                  [({}, relay.pushed_bytes)]) if relay else "",
+        ])
+
+    def stats(self):
+        """Human-readable summary of metrics() for dvap-stats."""
+        disp, lines = self._disp, self._lines
+        depths  = disp.queue_depths()
+        lookups = lines.hits + lines.misses
+        out = [
+            f"Broadcasts: {disp.broadcasts}, {disp.bytes_sent} bytes sent",
+            f"Clients: {len(depths)} connected, {disp.dropped} dropped",
+        ]
+        out += [f"  client {cid}: {depth} queued" for cid, depth in depths]
+        out += [
+            f"Encode: {self._encode_hist.summary()}",
+            f"Stops: {self._stops}, {self._refreshes} refreshed",
+            f"Stop refresh: {self._stop_hist.summary()}",
+            f"Line cache: {lines.hits}/{lookups} hits"
+            + (f" ({100 * lines.hits / lookups:.0f}%)" if lookups else ""),
+            f"History: {len(self._history)}/{self._history.capacity} stops",
+            f"Stacks: {self._stack_requests} requested, {self._stack_walks} walked",
+        ]
+        if self._relay:
+            relay = self._relay
+            out.append(f"Relay: process {relay.proc.pid}"
+                       + (" (gone)" if relay.stopped else "")
+                       + f", {relay.pushed} snapshots / {relay.pushed_bytes} bytes pushed")
+        return out
+
+    def history(self, since):
+        """/history body: the recorded stops after seq since, preceded by a
+        header with the latest stop seq and the paths the stops use."""
+        fs, rs  = self.FS, self.RS
+        entries = self._history.since(since)
+        ids     = sorted({e[2] for e in entries} - {0})
+        out  = [f"history{fs}{self._stops}"]
+        out += [f"file{fs}{i}{fs}{self._paths.path(i)}" for i in ids]
+        out += [fs.join(("stop", *map(str, e))) for e in entries]
+        return (rs.join(out) + rs + "\n").encode('utf-8')
+
+    def stack(self, num, inf, depth):
+        """/threads/{num}/stack body: the top depth frames of thread num in
+        inferior inf (None: the selected thread's), or None if the state
+        has no such thread.
+
+        Stacks are walked only when asked for and cached until the next
+        stop, so threads nobody looks at cost nothing and clients asking
+        about the same thread between two stops share one walk.
+        """
+        with self._lock:
+            self._stack_requests += 1
+            selected = self._state["selected_thread"]
+            threads  = self._state["threads"]
+        if inf is None:
+            inf = selected[0] if selected is not None else 1
+        if num not in threads.get(inf, {}):
+            return None
+        entry = self._cached_stack(inf, num, depth)
+        if entry is None:
+            entry = self._on_gdb_thread(self._walk_stack, inf, num, depth)
+            if entry is None:
+                return None
+        fs, rs = self.FS, self.RS
+        stop, frames, _ = entry
+        out  = [f"stack{fs}{num}{fs}{inf}{fs}{stop}"]
+        out += [fs.join(("frame", str(level), path, str(line or ""), name))
+                for level, (path, line, name) in enumerate(frames[:depth])]
+        return (rs.join(out) + rs + "\n").encode('utf-8')
+
+    def _cached_stack(self, inf, num, depth):
+        """The cached entry for thread num if it is from the latest stop and
+        deep enough, else None. Any thread."""
+        gen, stacks = self._stacks
+        entry = stacks.get((inf, num)) if gen == self._stop_gen else None
+        if entry is not None and (len(entry[1]) >= depth or entry[2]):
+            return entry
+        return None
+
+    def _walk_stack(self, inf, num, depth):
+        """Walk thread num's frames into the cache and return its entry,
+        None if it is gone or running. GDB's thread; switches threads and
+        restores the user's inferior, thread and frame."""
+        entry = self._cached_stack(inf, num, depth)  # walked while this waited
+        if entry is not None:
+            return entry
+        thread = next((t for i in gdb.inferiors() if i.num == inf
+                       for t in i.threads() if t.num == num), None)
+        if thread is None or not thread.is_valid() or thread.is_running():
+            return None
+        depth     = max(depth, _STACK_DEPTH)  # so the usual requests hit the cache
+        sel_inf   = gdb.selected_inferior()
+        selected  = gdb.selected_thread()
+        try:
+            sel_frame = gdb.selected_frame() if selected is not None else None
+        except gdb.error:  # non-stop mode: the selected thread is running
+            sel_frame = None
+        frames, progspace = [], thread.inferior.progspace
+        try:
+            if thread != selected:
+                thread.switch()
+            frame = gdb.newest_frame()
+            while frame is not None and len(frames) < depth:
+                # A caller's pc is its return address: a different line
+                # than a newest frame at the same pc.
+                key   = (progspace, frame.pc(), frame.type(), *(("caller",) if frames else ()))
+                found = self._lines.get(key, self._frame_line, frame)
+                frames.append((*(found or ("", 0)), frame.name() or ""))
+                frame = frame.older()
+        except Exception as e:
+            print(f"[DVAP] Error reading the stack of thread {num}: {e}")
+            frame = None
+        finally:
+            if selected is not None and selected != gdb.selected_thread():
+                selected.switch()
+            elif selected is None:
+                self._select_inferior(sel_inf)
+            if sel_frame is not None and sel_frame.is_valid():
+                sel_frame.select()
+        self._stack_walks += 1
+        if self._stacks[0] != self._stop_gen:
+            self._stacks = (self._stop_gen, {})
+        entry = (self._stops, tuple(frames), frame is None)
+        self._stacks[1][(inf, num)] = entry
+        return entry
+
+    def _trace_stop(self):
+        """Append the selected thread's position to the history."""
+        with self._lock:
+            selected = self._state["selected_thread"]
+            threads  = self._state["threads"]
+        if selected is None:
+            return
+        inf, num = selected
+        pos = threads.get(inf, {}).get(num)
+        if pos is not None:
+            self._history.append(self._stops, num, self._paths.intern(pos['file']),
+                                 pos['line'], inf)
+
     def _on_gdb_exiting(self, event):
         self.shutdown()
 
+    def _touch(self):
+        """Record a state change. Caller must hold self._lock."""
+        self._version += 1
+        self._changed.notify_all()
+
     def _broadcast_loop(self):
+        """Broadcast on state changes only; send heartbeats while idle."""
+        seen = -1
         while not self._disp.stopped.is_set():
-            self._disp.broadcast(self._state_str())
-            self._disp.stopped.wait(0.030)
+            with self._changed:
+                if self._version == seen:
+                    self._changed.wait(self.heartbeat or None)
+                changed = self._version != seen
+                seen    = self._version
+            if self._disp.stopped.is_set():
+                break
+            if not changed:
+                self._disp.heartbeat()
+                if self._relay:
+                    self._relay.push(None)
+                continue
+            records = self._records()
+            if records != self.snapshot.records:  # handlers may rewrite identical state
+                self._publish(records)
 
-    def _state_str(self):
-        FS, RS = self.FS, self.RS
+    def _publish(self, records):
+        """Wrap records in a new _Snapshot and fan it out. Payloads are
+        encoded once per client view, on first use."""
+        prev = self.snapshot
+        self.snapshot = _Snapshot(prev.seq + 1, records, prev.records, self._encode)
+        self._disp.broadcast(self.snapshot)
+        if self._relay:
+            self._relay.push(self.snapshot)
+
+    def _records(self):
+        """Current state as an ordered {key: fields} mapping.
+
+        The state dicts are replaced, never mutated, so only taking the
+        references needs the lock.
+        """
         with self._lock:
-            result = ""
-            if self._state["selected_thread"] is not None:
-                result += f"selected{FS}{self._state['selected_thread']}{FS}{'t'}{RS}"
-            for t_num, t in self._state["threads"].items():
-                result += f"thread{FS}{t_num}{FS}{'t'}{FS}{t['file']}{FS}{t['line']}{FS}{t['tid']}{RS}"
-            for b_num, b in self._state["breakpoints"].items():
-                result += (f"bp{FS}{b_num}{FS}{b['file']}{FS}{b['line']}"
-                           f"{FS}{b['nonconditional']}{FS}{b['enabled']}{RS}")
-        return result
+            selected    = self._state["selected_thread"]
+            threads     = self._state["threads"]
+            breakpoints = self._state["breakpoints"]
+            syncing     = self._state["syncing"]
+        records = {}
+        if syncing:
+            records[("syncing",)] = ("syncing",)
+        if selected is not None:
+            inf, t_num = selected
+            records[("selected",)] = ("selected", t_num, 't', inf)
+        for inf, inf_threads in threads.items():
+            for t_num, t in inf_threads.items():
+                records[("thread", t_num, inf)] = ("thread", t_num, 't', t['file'], t['line'],
+                                                   t['tid'], inf)
+        for b_num, b in breakpoints.items():
+            records[("bp", b_num)] = ("bp", b_num, b['file'], b['line'],
+                                      b['nonconditional'], b['enabled'], b['inferior'])
+        return records
+
+    def _state_str(self):
+        return self._join(map(self._format, self._records().values()))
+
+    _SYNC_SLICE = 32  # threads walked, or breakpoints resolved, per turn of GDB's event loop
 
     def _sync_gdb_state(self):
-        """Populate state from the current GDB session on (re-)source."""
-        self._on_stop(None)
-        for bp in gdb.breakpoints() or []:
-            self._on_bp_created(bp)
+        """Populate state from the current GDB session on (re-)source,
+        without holding up the prompt.
+
+        Walking every thread and resolving every breakpoint of a large
+        session takes a while, and the gdb API may only be used from GDB's
+        own thread. A helper
+        thread posts the work to it a slice at a time, so commands typed
+        meanwhile run in between. Records carry a syncing marker until
+        the last slice is done.
+        """
+        gdb.Thread(target=self._sync_loop, daemon=True).start()
+
+    def _sync_loop(self):
+        try:
+            for num in self._on_gdb_thread(self._sync_inferiors) or ():
+                start = 0
+                while start is not None:
+                    if self._disp.stopped.is_set():
+                        return
+                    start = self._on_gdb_thread(self._sync_threads, num, start)
+            bps = self._on_gdb_thread(gdb.breakpoints) or ()
+            for i in range(0, len(bps), self._SYNC_SLICE):
+                if self._disp.stopped.is_set():
+                    return
+                self._on_gdb_thread(self._sync_bps, bps[i:i + self._SYNC_SLICE])
+        finally:
+            with self._lock:
+                self._state["syncing"] = False
+                self._touch()
+
+    def _on_gdb_thread(self, fn, *args):
+        """Run fn(*args) from GDB's event loop and wait for it. Returns its
+        result; None if it raised or the server shut down first."""
+        done, result = threading.Event(), []
+        def call():
+            try:
+                result.append(fn(*args))
+            except Exception as e:
+                print(f"[DVAP] Error: {e}")
+            finally:
+                done.set()
+        gdb.post_event(call)
+        while not done.wait(0.5):
+            if self._disp.stopped.is_set():
+                return None
+        return result[0] if result else None
+
+    def _sync_inferiors(self):
+        """Inferior nums to walk, the selected one first."""
+        if self._unix:
+            self._follow_pid()
+        # The sync walks every thread from here on, so resumes before it are
+        # covered; _on_cont records those during it as usual.
+        self._resumed, self._step_resumed, self._stale = set(), set(), set()
+        current = gdb.selected_inferior()
+        return sorted((inf.num for inf in gdb.inferiors()), key=lambda n: n != current.num)
+
+    def _sync_threads(self, num, start):
+        """Walk the next _SYNC_SLICE threads of inferior num, from index
+        start, into the state. Returns the next start, None when done."""
+        inf = next((i for i in gdb.inferiors() if i.num == num), None)
+        if inf is None or not inf.is_valid():
+            return None
+        threads = inf.threads()
+        end     = start + self._SYNC_SLICE
+        current, selected_thread = gdb.selected_inferior(), gdb.selected_thread()
+        try:
+            walked = self._walk_threads(threads[start:end])
+        finally:
+            self._restore_selection(current, selected_thread)
+        with self._lock:
+            # Merged: a stop's refresh may already have walked some of them.
+            all_threads      = dict(self._state["threads"])
+            all_threads[num] = {**all_threads.get(num, {}), **walked}
+            if not all_threads[num]:
+                del all_threads[num]
+            self._state["selected_thread"] = (
+                (selected_thread.inferior.num, selected_thread.num) if selected_thread else None)
+            self._state["threads"]         = all_threads
+            self._touch()
+        return end if end < len(threads) else None
+
+    def _sync_bps(self, bps):
+        for bp in bps:
+            if bp.is_valid():  # not deleted while waiting for its slice
+                self._on_bp_created(bp)
 
     def _on_stop(self, event):
-        inf = gdb.selected_inferior()
-        if inf is None:
+        """Note the stop and post one _deferred_refresh for it.
+
+        Breakpoint commands that end in continue, or a conditional
+        breakpoint hit in a loop, stop far faster than threads can be
+        walked. Stops that arrive before the posted refresh runs share it.
+        """
+        self._stop_gen  += 1  # cancels a lazy refresh posted for an earlier stop
+        self._stops     += 1
+        self._stop_event = event
+        if not self._refresh_posted:
+            self._refresh_posted = True
+            gdb.post_event(self._deferred_refresh)
+
+    def _deferred_refresh(self):
+        self._refresh_posted = False
+        thread = gdb.selected_thread()
+        if thread is not None and thread.is_valid() and thread.is_running():
+            return  # resumed again; _resumed and _stale carry over to the next stop
+        event, self._stop_event = self._stop_event, None
+        self._refresh(event)
+
+    def _refresh(self, event):
+        """Re-read thread positions after the stop event (None on sync)."""
+        t0 = time.perf_counter()
+        self._refreshes += 1
+        resumed, self._resumed = self._resumed, set()
+        stepped, self._step_resumed = self._step_resumed, set()
+        stale,   self._stale   = self._stale, set()
+        if self._unix:
+            self._follow_pid()
+        if self.fast_step and event is not None and self._is_step_stop(event):
+            details = getattr(event, 'details', None) or {}
+            if details.get('reason', 'end-stepping-range') != 'end-stepping-range':
+                stepped = resumed  # finish and until are not steps to scheduler-locking
+            self._on_step_stop(stepped, stale)
+        else:
+            self._refresh_threads(stale)
+        if event is not None:
+            self._trace_stop()
+        self._stop_hist.observe(time.perf_counter() - t0)
+
+    def _on_cont(self, event):
+        # GDB sets inferior_thread only in non-stop mode. In all-stop mode
+        # scheduler-locking decides whether the other threads ran too.
+        thread = getattr(event, 'inferior_thread', None)
+        locked = step_locked = thread is not None
+        if thread is None:
+            locked, step_locked = self._scheduler_locking()
+            if step_locked:
+                thread = gdb.selected_thread()
+        if thread is None:
+            self._resumed = self._step_resumed = None
+            self._stale.update(self._resumed_inferiors())
             return
-        selected_thread = gdb.selected_thread()
+        key = (thread.inferior.num, thread.num)
+        self._stale.add(thread.inferior.num)
+        if self._step_resumed is not None:
+            self._step_resumed.add(key)
+        if not locked:  # scheduler-locking step: only a step left the others stopped
+            self._resumed = None
+            self._stale.update(self._resumed_inferiors())
+        elif self._resumed is not None:
+            self._resumed.add(key)
+
+    @staticmethod
+    def _scheduler_locking():
+        """(any resume, step resume): whether scheduler-locking holds every
+        thread but the selected one on that kind of resume."""
+        try:
+            mode = gdb.parameter('scheduler-locking')
+            if mode == 'replay':  # the default: on while replaying a recording
+                record = gdb.current_recording()
+                mode   = 'on' if record is not None and record.replay_position else 'off'
+        except (RuntimeError, AttributeError, NotImplementedError):  # old GDB, record full
+            return False, False
+        return mode == 'on', mode in ('on', 'step')
 
-        new_threads = {}
+    @staticmethod
+    def _resumed_inferiors():
+        """Inferior nums an all-threads resume runs: every inferior under
+        schedule-multiple, otherwise the selected one."""
         try:
-            for thread in inf.threads():
-                if not thread.is_valid() or thread.is_running():
-                    continue  # running threads have no meaningful source position
+            if gdb.parameter('schedule-multiple'):
+                return [inf.num for inf in gdb.inferiors()]
+        except RuntimeError:
+            pass
+        return [gdb.selected_inferior().num]
 
-                if thread != gdb.selected_thread():
-                    thread.switch()
+    @staticmethod
+    def _is_step_stop(event):
+        """True for stops that end a step/next/finish/until."""
+        details = getattr(event, 'details', None)  # GDB 14+
+        if details and 'reason' in details:
+            return details['reason'] in ('end-stepping-range', 'function-finished',
+                                         'location-reached')
+        # Older GDB: breakpoint and signal stops have their own event types.
+        return type(event) is gdb.StopEvent
 
-                try:
-                    frame = gdb.selected_frame()
-                    sal   = frame.find_sal()
-                    if sal and sal.symtab:
-                        new_threads[thread.num] = {
-                            "file": sal.symtab.fullname(),
-                            "line": sal.line,
-                            "tid":  thread.ptid[1],
-                        }
-                    else:
-                        # Stopped but no source (e.g. inside a library without debug symbols).
-                        # Send with empty location so the client can fall back to the last
-                        # known position for this thread.
-                        new_threads[thread.num] = {
-                            "file": "",
-                            "line": 0,
-                            "tid":  thread.ptid[1],
-                        }
-                except Exception as e:
-                    print(f"[DVAP] Error reading frame for thread {thread.num}: {e}")
+    def _on_step_stop(self, resumed, stale):
+        """Fast-step: re-read only the selected thread, reuse the others.
+
+        resumed holds the (inferior, thread) nums that ran since the last
+        stop, or None if they all did; stale is as for _refresh_threads. If
+        any other thread ran, a full refresh is posted: clients get the
+        selected thread first, but gdb still walks the rest before its
+        next prompt.
+        """
+        thread = gdb.selected_thread()
+        if thread is None:
+            self._refresh_threads(stale)
+            return
+        inf, key = thread.inferior.num, (thread.inferior.num, thread.num)
+        pos = self._thread_pos(thread)
+        with self._lock:
+            threads     = dict(self._state["threads"])
+            inf_threads = dict(threads.get(inf, {}))
+            if pos is not None:
+                inf_threads[thread.num] = pos
+            threads[inf] = inf_threads
+            self._state["selected_thread"] = key
+            self._state["threads"]         = threads
+            self._touch()
+        if resumed is None or resumed - {key} or stale - {inf}:
+            gen = self._stop_gen
+            gdb.post_event(lambda: self._lazy_refresh(gen, stale))
+
+    def _lazy_refresh(self, gen, stale):
+        if gen != self._stop_gen:
+            return  # a newer stop already refreshed
+        thread = gdb.selected_thread()
+        if thread is None or not thread.is_valid() or thread.is_running():
+            return  # resumed again; the next stop will refresh
+        self._refresh_threads(stale)
+
+    def _thread_pos(self, thread):
+        """Position of thread, which must be the selected one. None on error."""
+        try:
+            frame = gdb.selected_frame()
+            # Inline frames share a pc with their caller but not a line, hence type().
+            found = self._lines.get((thread.inferior.progspace, frame.pc(), frame.type()),
+                                    self._frame_line, frame)
+            if found:
+                return {
+                    "file": found[0],
+                    "line": found[1],
+                    "tid":  thread.ptid[1],
+                }
+            # Stopped but no source (e.g. inside a library without debug symbols).
+            # Send with empty location so the client can fall back to the last
+            # known position for this thread.
+            return {
+                "file": "",
+                "line": 0,
+                "tid":  thread.ptid[1],
+            }
+        except Exception as e:
+            print(f"[DVAP] Error reading frame for thread {thread.num}: {e}")
+            return None
+
+    def _refresh_threads(self, stale=()):
+        """Walk the stopped threads of the selected inferior and of every
+        inferior num in stale. Other inferiors have not run since their last
+        walk and keep their threads."""
+        current = gdb.selected_inferior()
+        if current is None:
+            return
+        selected_thread = gdb.selected_thread()
+
+        walked = {}
+        try:
+            for inf in gdb.inferiors():
+                if inf.num == current.num or inf.num in stale:
+                    walked[inf.num] = self._walk_threads(inf.threads())
         finally:
             # Always restore the originally selected thread, even after exceptions.
-            if selected_thread and selected_thread != gdb.selected_thread():
-                selected_thread.switch()
+            self._restore_selection(current, selected_thread)
 
         with self._lock:
-            self._state["selected_thread"] = selected_thread.num if selected_thread else None
-            self._state["threads"]         = new_threads
+            threads = dict(self._state["threads"])
+            for num, inf_threads in walked.items():
+                if inf_threads:
+                    threads[num] = inf_threads
+                else:
+                    threads.pop(num, None)
+            self._state["selected_thread"] = (
+                (selected_thread.inferior.num, selected_thread.num) if selected_thread else None)
+            self._state["threads"]         = threads
+            self._touch()
+
+    def _restore_selection(self, inferior, thread):
+        """Select thread again, or inferior if no thread was selected."""
+        if thread and thread != gdb.selected_thread():
+            thread.switch()
+        elif thread is None:
+            self._select_inferior(inferior)  # walking other inferiors switched it
+
+    @staticmethod
+    def _select_inferior(inf):
+        """Select inf again after thread switches. It has no selected thread
+        to switch back to, and Python has no call to select an inferior."""
+        try:
+            if inf.is_valid() and gdb.selected_inferior().num != inf.num:
+                gdb.execute(f"inferior {inf.num}", to_string=True)
+        except RuntimeError as e:  # gdb.error
+            print(f"[DVAP] Could not select inferior {inf.num} again: {e}")
+
+    def _walk_threads(self, inf_threads):
+        """{thread num: position} for the stopped ones of inf_threads.
+        Switches threads; the caller restores the selection."""
+        threads = {}
+        for thread in inf_threads:
+            if not thread.is_valid() or thread.is_running():
+                continue  # running threads have no meaningful source position
+
+            if thread != gdb.selected_thread():
+                thread.switch()
+
+            pos = self._thread_pos(thread)
+            if pos is not None:
+                threads[thread.num] = pos
+        return threads
 
     def _get_bp_source(self, b):
         if b.type in (gdb.BP_WATCHPOINT, gdb.BP_HARDWARE_WATCHPOINT,
@@ -263,62 +2302,125 @@ class DVAPServer:
         if hasattr(b, 'locations') and b.locations:
             for loc in b.locations:
                 if not loc.enabled: continue
-                
-                # Use find_pc_line to get a symtab from the location address
-                # This is the most reliable way to access .fullname()
-                sal = gdb.find_pc_line(loc.address)
-                if sal and sal.symtab:
-                    return sal.symtab.fullname(), sal.line
+
+                found = self._lines.get((gdb.current_progspace(), loc.address, None),
+                                        self._resolve_pc, loc.address)
+                if found:
+                    return found
 
         # 2. Fallback for pending breakpoints (not yet resolved)
         if b.location:
-            try:
-                # decode_line helps resolve strings like "main.zig:10"
-                sals = gdb.decode_line(b.location)[1]
-                if sals and sals[0].symtab:
-                    return sals[0].symtab.fullname(), sals[0].line
-            except Exception:
-                pass
+            # Misses are cached too: a pending spec stays unresolvable until
+            # a new objfile arrives, and that clears the cache.
+            found = self._lines.get(('spec', b.location), self._resolve_spec, b.location)
+            if found:
+                return found
 
         return "", ""
 
+    @staticmethod
+    def _frame_line(frame):
+        sal = frame.find_sal()
+        if sal and sal.symtab:
+            return sal.symtab.fullname(), sal.line
+        return None
+
+    @staticmethod
+    def _resolve_pc(address):
+        # Use find_pc_line to get a symtab from the location address
+        # This is the most reliable way to access .fullname()
+        sal = gdb.find_pc_line(address)
+        if sal and sal.symtab:
+            return sal.symtab.fullname(), sal.line
+        return None
+
+    @staticmethod
+    def _resolve_spec(location):
+        try:
+            # decode_line helps resolve strings like "main.zig:10"
+            sals = gdb.decode_line(location)[1]
+            if sals and sals[0].symtab:
+                return sals[0].symtab.fullname(), sals[0].line
+        except Exception:
+            pass
+        return None
+
+    def _on_objfiles_changed(self, event):
+        self._lines.clear()  # symbols changed: addresses and specs may resolve differently
+
     def _on_bp_created(self, b):
         file_path, line_num = self._get_bp_source(b)
         is_nonconditional   = (b.condition is None and
                                b.thread   is None and
                                getattr(b, 'task', None) is None)
+        entry = {
+            "file":           file_path,
+            "line":           line_num,
+            "nonconditional": is_nonconditional,
+            "enabled":        b.enabled,
+            "inferior":       getattr(b, 'inferior', None) or 0,  # GDB 15+; 0 = all
+        }
         with self._lock:
-            self._state["breakpoints"][b.number] = {
-                "file":           file_path,
-                "line":           line_num,
-                "nonconditional": is_nonconditional,
-                "enabled":        b.enabled,
-            }
+            # Copy-on-write: _records() may be reading the old dict.
+            breakpoints = dict(self._state["breakpoints"])
+            breakpoints[b.number] = entry
+            self._state["breakpoints"] = breakpoints
+            self._touch()
 
     def _on_bp_modified(self, b):
         self._on_bp_created(b)
 
     def _on_bp_deleted(self, b):
         with self._lock:
-            self._state["breakpoints"].pop(b.number, None)
+            if b.number in self._state["breakpoints"]:
+                breakpoints = dict(self._state["breakpoints"])
+                del breakpoints[b.number]
+                self._state["breakpoints"] = breakpoints
+                self._touch()
 
     def _on_inferior_exited(self, event):
+        """exited and inferior_deleted: forget that inferior's threads."""
+        inf = getattr(event, 'inferior', None)
         with self._lock:
-            self._state["threads"]         = {}
-            self._state["selected_thread"] = None
+            if inf is None:
+                self._state["threads"] = {}
+                self._state["selected_thread"] = None
+            else:
+                threads = dict(self._state["threads"])
+                threads.pop(inf.num, None)
+                self._state["threads"] = threads
+                selected = self._state["selected_thread"]
+                if selected is not None and selected[0] == inf.num:
+                    self._state["selected_thread"] = None
+            self._touch()
+
 
+if __name__ == '__dvap_relay__':
+    sys.exit(_relay_main(sys.argv[2:]))
 
-gdb._dvap_script_path = os.path.abspath(__file__)
 
-if getattr(gdb, '_dvap_instance', None) is not None:
-    print("[DVAP] Re-sourcing: shutting down previous instance...")
-    gdb._dvap_instance.shutdown()
+def _start():
+    """(Re)start the server with the current dvap-* settings. Stored as
+    gdb._dvap_start, so dvap-start need not re-read the script."""
+    if getattr(gdb, '_dvap_instance', None) is not None:
+        print("[DVAP] Restarting: shutting down previous instance...")
+        gdb._dvap_instance.shutdown()
+    gdb._dvap_instance = DVAPServer(gdb._dvap_port_param.value,
+                                    gdb._dvap_heartbeat_param.value,
+                                    gdb._dvap_transport_param.value,
+                                    gdb._dvap_slow_clients_param.value,
+                                    gdb._dvap_fast_step_param.value,
+                                    gdb._dvap_unix_socket_param.value,
+                                    gdb._dvap_history_param.value,
+                                    gdb._dvap_relay_param.value)
 
-gdb._dvap_instance = DVAPServer(gdb._dvap_port_param.value)
+gdb._dvap_start = _start
+_start()
 
 
 # gdb.Command cannot be unregistered, so guard against re-source creating
-# a duplicate. The invoke method reads gdb._dvap_instance at call time.
+# a duplicate. The invoke methods read gdb._dvap_instance and
+# gdb._dvap_start at call time.
 
 if not hasattr(gdb, '_dvap_start_cmd'):
     class _DVAPStartCommand(gdb.Command):
@@ -326,17 +2428,12 @@ if not hasattr(gdb, '_dvap_start_cmd'):
         def __init__(self):
             super().__init__('dvap-start', gdb.COMMAND_NONE)
         def invoke(self, arg, from_tty):
-            path = getattr(gdb, '_dvap_script_path', None)
-            if path is None:
-                print("[DVAP] Script path unknown.")
-                return
-            with open(path) as f:
-                exec(compile(f.read(), path, 'exec'), {'__file__': path})
+            gdb._dvap_start()
     gdb._dvap_start_cmd = _DVAPStartCommand()
 
 if not hasattr(gdb, '_dvap_stop_cmd'):
     class _DVAPStopCommand(gdb.Command):
-        """Stop the DVAP SSE server. Re-source the script to restart it."""
+        """Stop the DVAP SSE server. dvap-start restarts it."""
         def __init__(self):
             super().__init__('dvap-stop', gdb.COMMAND_NONE)
         def invoke(self, arg, from_tty):
@@ -346,7 +2443,7 @@ if not hasattr(gdb, '_dvap_stop_cmd'):
                 return
             inst.shutdown()
             gdb._dvap_instance = None
-            print("[DVAP] Server stopped. Re-source the script to restart.")
+            print("[DVAP] Server stopped. dvap-start restarts it.")
     gdb._dvap_stop_cmd = _DVAPStopCommand()
 
 if not hasattr(gdb, '_dvap_show_cmd'):
@@ -357,13 +2454,45 @@ if not hasattr(gdb, '_dvap_show_cmd'):
         def invoke(self, arg, from_tty):
             inst   = getattr(gdb, '_dvap_instance', None)
             status = "running" if inst is not None else "stopped"
+            if inst is not None and inst._state["syncing"]:
+                status += " (syncing)"
             print(f"[DVAP] Status: {status}")
             print(f"[DVAP] Port:   {gdb._dvap_port_param.value}")
+            print(f"[DVAP] Heartbeat: {gdb._dvap_heartbeat_param.value}s")
+            print(f"[DVAP] Transport: {gdb._dvap_transport_param.value}")
+            print(f"[DVAP] Slow clients: {gdb._dvap_slow_clients_param.value}")
+            print(f"[DVAP] Fast step: {'on' if gdb._dvap_fast_step_param.value else 'off'}")
+            print(f"[DVAP] Unix socket: {'on' if gdb._dvap_unix_socket_param.value else 'off'}")
+            if inst is not None and inst.unix_path:
+                print(f"[DVAP] Socket path: {inst.unix_path}")
+            print(f"[DVAP] History: {gdb._dvap_history_param.value} stops")
+            relay = 'on' if gdb._dvap_relay_param.value else 'off'
+            if inst is not None and inst._relay:
+                relay += f" (process {inst._relay.proc.pid})"
+            print(f"[DVAP] Relay: {relay}")
+            if inst is not None:
+                lines = inst._lines
+                print(f"[DVAP] Line cache: {len(lines)}/{lines.size} entries,"
+                      f" {lines.hits} hits, {lines.misses} misses")
     gdb._dvap_show_cmd = _DVAPShowCommand()
 
+if not hasattr(gdb, '_dvap_stats_cmd'):
+    class _DVAPStatsCommand(gdb.Command):
+        """Show DVAP server counters and timings (also served at /metrics)."""
+        def __init__(self):
+            super().__init__('dvap-stats', gdb.COMMAND_NONE)
+        def invoke(self, arg, from_tty):
+            inst = getattr(gdb, '_dvap_instance', None)
+            if inst is None:
+                print("[DVAP] No server running.")
+                return
+            for line in inst.stats():
+                print(f"[DVAP] {line}")
+    gdb._dvap_stats_cmd = _DVAPStatsCommand()
+
 if not hasattr(gdb, '_dvap_set_cmd'):
     class _DVAPSetCommand(gdb.Command):
-        """Set DVAP configuration. Usage: dvap-set port <N>"""
+        """Set DVAP configuration. Usage: dvap-set port|heartbeat|history <N> | transport <T>"""
         def __init__(self):
             super().__init__('dvap-set', gdb.COMMAND_NONE)
         def invoke(self, arg, from_tty):
@@ -372,11 +2501,57 @@ if not hasattr(gdb, '_dvap_set_cmd'):
                 try:
                     gdb._dvap_port_param.value = int(parts[1])
                     print(f"[DVAP] Port set to {gdb._dvap_port_param.value}."
-                          " Re-source the script to apply.")
+                          " dvap-start to apply.")
+                    return
+                except ValueError:
+                    pass
+            if len(parts) == 2 and parts[0] == 'heartbeat':
+                try:
+                    gdb._dvap_heartbeat_param.value = max(0, int(parts[1]))
+                    inst = getattr(gdb, '_dvap_instance', None)
+                    if inst is not None:
+                        inst.heartbeat = gdb._dvap_heartbeat_param.value
+                    print(f"[DVAP] Heartbeat set to {gdb._dvap_heartbeat_param.value}s.")
+                    return
+                except ValueError:
+                    pass
+            if len(parts) == 2 and parts[0] == 'history':
+                try:
+                    gdb._dvap_history_param.value = max(0, int(parts[1]))
+                    print(f"[DVAP] History set to {gdb._dvap_history_param.value} stops."
+                          " dvap-start to apply.")
                     return
                 except ValueError:
                     pass
-            print("Usage: dvap-set port <N>")
+            if len(parts) == 2 and parts[0] == 'transport' and parts[1] in ('threaded', 'selector'):
+                gdb._dvap_transport_param.value = parts[1]
+                print(f"[DVAP] Transport set to {parts[1]}. dvap-start to apply.")
+                return
+            if len(parts) == 2 and parts[0] == 'slow-clients' and parts[1] in ('latest', 'drop'):
+                gdb._dvap_slow_clients_param.value = parts[1]
+                print(f"[DVAP] Slow-client policy set to {parts[1]}. dvap-start to apply.")
+                return
+            if len(parts) == 2 and parts[0] == 'fast-step' and parts[1] in ('on', 'off'):
+                gdb._dvap_fast_step_param.value = parts[1] == 'on'
+                inst = getattr(gdb, '_dvap_instance', None)
+                if inst is not None:
+                    inst.fast_step = gdb._dvap_fast_step_param.value
+                print(f"[DVAP] Fast step {parts[1]}.")
+                return
+            if len(parts) == 2 and parts[0] == 'unix-socket' and parts[1] in ('on', 'off'):
+                gdb._dvap_unix_socket_param.value = parts[1] == 'on'
+                print(f"[DVAP] Unix socket {parts[1]}. dvap-start to apply.")
+                return
+            if len(parts) == 2 and parts[0] == 'relay' and parts[1] in ('on', 'off'):
+                gdb._dvap_relay_param.value = parts[1] == 'on'
+                print(f"[DVAP] Relay {parts[1]}. dvap-start to apply.")
+                return
+            print("Usage: dvap-set port|heartbeat|history <N>\n"
+                  "       dvap-set transport threaded|selector\n"
+                  "       dvap-set slow-clients latest|drop\n"
+                  "       dvap-set fast-step on|off\n"
+                  "       dvap-set unix-socket on|off\n"
+                  "       dvap-set relay on|off")
     gdb._dvap_set_cmd = _DVAPSetCommand()
 
 if not hasattr(gdb, '_dvap_help_cmd'):
@@ -391,14 +2566,38 @@ if not hasattr(gdb, '_dvap_help_cmd'):
                 "Commands:\n"
                 "  dvap-help            Show this message\n"
                 "  dvap-show            Show server status and port\n"
+                "  dvap-stats           Show broadcast, client and timing counters\n"
                 "  dvap-start           Start or restart the server\n"
                 "  dvap-stop            Stop the server\n"
                 "  dvap-set port <N>    Change the port (dvap-start to apply)\n"
+                "  dvap-set heartbeat <N>\n"
+                "                       Seconds between idle keepalives (0 = off)\n"
+                "  dvap-set transport threaded|selector\n"
+                "                       Thread per client, or one thread for all\n"
+                "                       (dvap-start to apply)\n"
+                "  dvap-set slow-clients latest|drop\n"
+                "                       Skip a lagging client to the latest state,\n"
+                "                       or disconnect it (dvap-start to apply)\n"
+                "  dvap-set fast-step on|off\n"
+                "                       On step stops re-read only the selected thread\n"
+                "  dvap-set unix-socket on|off\n"
+                "                       Also listen on <dir>/<inferior pid>.sock\n"
+                "                       (dvap-start to apply; dvap-show prints it)\n"
+                "  dvap-set history <N> Stops kept for /history (0 = off; dvap-start\n"
+                "                       to apply)\n"
+                "  dvap-set relay on|off\n"
+                "                       Serve TCP clients from a helper process\n"
+                "                       (dvap-start to apply)\n"
                 "\n"
                 "First source:\n"
                 "  source <path/to/DVAP_gdb_server.py>\n"
                 "\n"
-                "SSE endpoint:  curl http://localhost:<port>/events"
+                "SSE endpoint:  curl http://localhost:<port>/events\n"
+                "               curl --unix-socket <path> http://localhost/events\n"
+                "Polling:       curl http://localhost:<port>/state?since=<version>\n"
+                "Metrics:       curl http://localhost:<port>/metrics\n"
+                "Stop history:  curl http://localhost:<port>/history?since=<seq>\n"
+                "Call stack:    curl http://localhost:<port>/threads/<id>/stack?depth=<N>"
             )
     gdb._dvap_help_cmd = _DVAPHelpCommand()
 
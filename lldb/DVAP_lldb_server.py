@@ -1,50 +1,644 @@
-import lldb
 import os
+import sys
 import threading
 import http.server
+import http.client
+import urllib.parse
 import socketserver
+import selectors
+import socket
+import stat
+import struct
+import array
+import bisect
+import time
+import collections
 import queue
+import tempfile
+import pickle
+import shutil
+import subprocess
+
+if __name__ == '__dvap_relay__':  # the relay process (see _RelayProcess) has no debugger
+    lldb = None
+else:
+    import lldb
 
 # Stored on the lldb module so the value survives re-source.
-# To change: (lldb) script lldb._dvap_port = 12345   then re-source this script.
+# To change: (lldb) script lldb._dvap_port = 12345   then dvap-start.
 
-if not hasattr(lldb, '_dvap_port'):
+if lldb and not hasattr(lldb, '_dvap_port'):
     lldb._dvap_port = 56789
 
+# Seconds between SSE keepalive comments while the state is idle (0 = off).
+if lldb and not hasattr(lldb, '_dvap_heartbeat'):
+    lldb._dvap_heartbeat = 15
+
+# 'threaded' serves each SSE client from its own thread, 'selector' serves
+# all of them from one event-loop thread.
+if lldb and not hasattr(lldb, '_dvap_transport'):
+    lldb._dvap_transport = 'threaded'
+
+# 'latest' lets a client that falls behind skip to the newest state,
+# 'drop' disconnects it once 100 messages are queued.
+if lldb and not hasattr(lldb, '_dvap_slow_clients'):
+    lldb._dvap_slow_clients = 'latest'
+
+# Also listen on a Unix socket named after the inferior pid, in the
+# directory returned by _socket_dir().
+if lldb and not hasattr(lldb, '_dvap_unix_socket'):
+    lldb._dvap_unix_socket = False
+
+# Stops kept for /history (0 = off).
+if lldb and not hasattr(lldb, '_dvap_history'):
+    lldb._dvap_history = 4096
+
+# Serve TCP clients from a helper process that the debugger pushes each
+# state to once; see _RelayProcess.
+if lldb and not hasattr(lldb, '_dvap_relay'):
+    lldb._dvap_relay = False
+
+
+_SHUTDOWN  = object()           # sentinel pushed to queues on shutdown
+_HEARTBEAT = b": keepalive\n\n"  # SSE comment, ignored by clients
+
+
+def _sse(data, event_id=None):
+    if event_id is None:
+        return f"data: {data}\n\n".encode('utf-8')
+    return f"id: {event_id}\ndata: {data}\n\n".encode('utf-8')
+
+
+# Binary wire format (format=binary). Big-endian; every frame is
+#   u32 length of the rest | u8 frame kind | u32 seq | records
+# and every record starts with a u8 record type.
+_BIN_CONTENT_TYPE = "application/x-dvap"
+_BIN_FULL, _BIN_SNAPSHOT, _BIN_DELTA, _BIN_FILES, _BIN_HEARTBEAT = 1, 2, 3, 4, 5
+_BIN_TYPES   = {"selected": 1, "thread": 2, "bp": 3, "file": 4, "del": 5, "threads": 6,
+               "syncing": 7}
+_BIN_KINDS   = {"t": 0, "g": 1}  # thread or goroutine
+_B_FRAME     = struct.Struct(">IBI")      # length, frame kind, seq
+_B_SELECTED  = struct.Struct(">BBII")     # type, kind, thread id, inferior
+_B_THREAD    = struct.Struct(">BIBIIQI")  # type, id, kind, file id, line, os thread id, inferior
+_B_BP        = struct.Struct(">BIIIBI")   # type, id, file id, line, flags, inferior
+_B_FILE      = struct.Struct(">BIH")      # type, id, path length; utf-8 path follows
+_B_DEL       = struct.Struct(">BBII")     # type, deleted record type, id, inferior
+_B_THREADS   = struct.Struct(">BIIIIH")   # type, file id, line, count, inferior, runs
+_B_RUN       = struct.Struct(">II")       # first, last thread id of one run
+_B_DEL_GROUP = struct.Struct(">BBIII")    # type, deleted record type (6), file id, line, inferior
+_BP_NONCONDITIONAL, _BP_ENABLED = 1, 2    # _B_BP flags
+
+
+def _bin_frame(kind, seq, body):
+    return _B_FRAME.pack(len(body) + 5, kind, seq) + body
+
+_HEARTBEAT_BIN = _bin_frame(_BIN_HEARTBEAT, 0, b"")
+
+
+def _is_heartbeat(msg):
+    return msg is _HEARTBEAT or msg is _HEARTBEAT_BIN
+
+
+def _bin_record(fields, intern):
+    """One record tuple in the binary layout; paths go through intern.
+
+    An unknown line ("" in text) is 0, as is an unknown path's file id.
+    """
+    kind = fields[0]
+    if kind == "syncing":
+        return bytes((_BIN_TYPES[kind],))
+    if kind == "threads":
+        _, path, line, count, runs, inf = fields
+        return (_B_THREADS.pack(_BIN_TYPES[kind], intern(path), line or 0, count, inf, len(runs))
+                + b"".join(_B_RUN.pack(*run) for run in runs))
+    if kind == "thread":
+        _, num, tkind, path, line, tid, inf = fields
+        return _B_THREAD.pack(_BIN_TYPES[kind], num, _BIN_KINDS[tkind],
+                              intern(path), line, tid, inf)
+    if kind == "bp":
+        _, num, path, line, nonconditional, enabled, inf = fields
+        flags = (_BP_NONCONDITIONAL if nonconditional else 0) | (_BP_ENABLED if enabled else 0)
+        return _B_BP.pack(_BIN_TYPES[kind], num, intern(path), line or 0, flags, inf)
+    _, num, tkind, inf = fields  # selected
+    return _B_SELECTED.pack(_BIN_TYPES[kind], _BIN_KINDS[tkind], num, inf)
+
+
+def _bin_del(key, intern):
+    """Key fields missing from a del record (selected and syncing have no
+    id; GDB breakpoints have no inferior) are sent as 0. A threads group is keyed
+    by its location instead of an id."""
+    if key[0] == "threads":
+        _, path, line, inf = key
+        return _B_DEL_GROUP.pack(_BIN_TYPES["del"], _BIN_TYPES["threads"],
+                                 intern(path), line or 0, inf)
+    _, num, inf = (*key, 0, 0)[:3]
+    return _B_DEL.pack(_BIN_TYPES["del"], _BIN_TYPES[key[0]], num, inf)
+
+
+# How one client wants the state encoded. Hashable: payloads are cached
+# per view on each _Snapshot.
+#   interned  paths are sent once per connection as file;;{id};;{path}
+#             records; thread/bp records carry the id instead
+#   binary    _bin_* frames instead of SSE text; always interned
+#   filter    _Filter of the records to send, or None for all
+#   grouped   threads at the same location collapse into one threads record
+_View = collections.namedtuple('_View', 'interned binary filter grouped',
+                               defaults=(False, False, None, False))
+_DEFAULT_VIEW = _View()
+
+_FILTER_TYPES = frozenset(("selected", "thread", "bp"))
+
+
+class _IdRuns(tuple):
+    """((first, last), ...) runs of consecutive thread ids; str() gives the
+    text form, e.g. 1-4,7."""
+    __slots__ = ()
+
+    def __str__(self):
+        return ",".join(f"{a}-{b}" if a != b else str(a) for a, b in self)
+
+
+def _group_threads(records):
+    """records with thread records collapsed into one per location:
+    threads;;{file};;{line};;{count};;{id runs};;{inferior}, keyed
+    (threads, file, line, inferior) where the first member was."""
+    out, groups = {}, {}
+    for key, fields in records.items():
+        if key[0] != "thread":
+            out[key] = fields
+            continue
+        _, num, _, path, line, _, inf = fields
+        gkey = ("threads", path, line, inf)
+        if gkey not in groups:
+            groups[gkey] = []
+            out[gkey]    = None  # placeholder keeps the group's position
+        groups[gkey].append(num)
+    for gkey, nums in groups.items():
+        nums.sort()
+        runs = []
+        for num in nums:
+            if runs and runs[-1][1] == num - 1:
+                runs[-1][1] = num
+            else:
+                runs.append([num, num])
+        _, path, line, inf = gkey
+        out[gkey] = ("threads", path, line, len(nums), _IdRuns(map(tuple, runs)), inf)
+    return out
+
+
+class _Filter(collections.namedtuple('_Filter', 'types selected files')):
+    """The subset of records one /events client asked for.
+
+    types     record types to send (frozenset), or None for all; the
+              syncing marker is always sent
+    selected  send only the selected thread's thread record
+    files     path prefixes (tuple) a thread or bp record must match, or None
+    """
+    __slots__ = ()
+
+    def apply(self, records, path_field):
+        """The records that pass, in order. path_field maps a record type
+        to the index of its path."""
+        types, files = self.types, self.files
+        sel = records.get(("selected",)) if self.selected else None
+        out = {}
+        for key, fields in records.items():
+            kind = key[0]
+            if types is not None and kind not in types and kind != "syncing":
+                continue
+            # A thread key is (thread, id, inferior...), selected fields are
+            # (selected, id, kind, inferior...).
+            if kind == "thread" and self.selected and (
+                    sel is None or key[1:] != (sel[1], *sel[3:])):
+                continue
+            i = path_field.get(kind)
+            if files is not None and i is not None and not fields[i].startswith(files):
+                continue
+            out[key] = fields
+        return out
+
+
+class _PathTable:
+    """Append-only path <-> id table for interned views. Id 0 is "no file"."""
+    def __init__(self, fs, rs):
+        self._fs    = fs
+        self._rs    = rs
+        self._ids   = {"": 0}
+        self._paths = [""]
+        self._lock  = threading.Lock()
+
+    def __len__(self):
+        return len(self._paths) - 1  # highest id in use
+
+    def intern(self, path):
+        pid = self._ids.get(path)
+        if pid is None:
+            with self._lock:
+                pid = self._ids.get(path)
+                if pid is None:
+                    pid = self._ids[path] = len(self._paths)
+                    self._paths.append(path)
+        return pid
+
+    def path(self, pid):
+        return self._paths[pid]
+
+    def message(self, after, upto, binary=False):
+        """Message defining ids after+1 .. upto."""
+        ids = range(after + 1, upto + 1)
+        if binary:
+            body = b""
+            for i in ids:
+                path = self._paths[i].encode('utf-8')
+                body += _B_FILE.pack(_BIN_TYPES["file"], i, len(path)) + path
+            return _bin_frame(_BIN_FILES, 0, body)
+        fs, rs = self._fs, self._rs
+        return _sse("".join(f"file{fs}{i}{fs}{self._paths[i]}{rs}" for i in ids))
+
+
+def _unpack(item, sent, paths):
+    """Resolve a queued item to bytes. Returns (bytes, sent).
+
+    Interned-view items are (payload, upto, binary). File records for table ids
+    this connection has not seen yet (sent+1 .. upto) are written first.
+    Doing this at write time keeps it correct when a slot skips messages.
+    """
+    if type(item) is not tuple:
+        return item, sent
+    payload, upto, binary = item
+    if upto <= sent:
+        return payload, sent
+    return paths.message(sent, upto, binary) + payload, upto
+
+
+class _Snapshot:
+    """One published state. Never mutated, so it is shared without locking.
+
+    records       ordered {key: fields} mapping (read-only by convention)
+    prev_records  records of the snapshot before, for deltas
+
+    Payloads are encoded on first use per _View and cached, so each
+    encoding is built once however many clients share it.
+    """
+    __slots__ = ('seq', 'records', 'prev_records', '_encode', '_cache')
+
+    def __init__(self, seq, records, prev_records, encode):
+        self.seq          = seq
+        self.records      = records
+        self.prev_records = prev_records
+        self._encode      = encode
+        self._cache       = {}
+
+    def payloads(self, view=_DEFAULT_VIEW):
+        """(payload, delta_payload, snapshot_payload, upto) for view.
+
+        payload is the message for "full" clients, delta_payload the changes
+        since the previous snapshot, snapshot_payload the full state that
+        starts a "delta" stream at seq. upto is the highest path id the
+        payloads may reference (None unless view.interned). delta_payload
+        is None when view.filter hides every change: nothing is sent.
+        """
+        p = self._cache.get(view)
+        if p is None:
+            p = self._cache[view] = self._encode(self, view)
+        return p
+
+    def rebased(self, prev_records):
+        """This state as a change from prev_records instead."""
+        return _Snapshot(self.seq, self.records, prev_records, self._encode)
+
+_EMPTY_SNAPSHOT = _Snapshot(0, {}, {}, None)
+
+
+class _LatestSlot:
+    """Per-client mailbox holding only the newest message.
+
+    A client that falls behind skips intermediate messages instead of being
+    dropped. A skipped delta cannot simply be overwritten, so the caller
+    passes resync (a full snapshot message) to send in its place.
+    """
+    conflate = True
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._msg  = None
+
+    def put_nowait(self, msg, resync=None):
+        with self._cond:
+            pending = self._msg
+            if pending is _SHUTDOWN:
+                return
+            if pending is not None and msg is not _SHUTDOWN:
+                if _is_heartbeat(msg):
+                    return  # the pending message keeps the connection alive
+                if resync is not None and not _is_heartbeat(pending):
+                    msg = resync
+            self._msg = msg
+            self._cond.notify()
+
+    def qsize(self):
+        return int(self._msg is not None)
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._msg is not None, timeout):
+                raise queue.Empty
+            msg, self._msg = self._msg, None
+            return msg
+
+
+class _LineCache:
+    """Bounded LRU of source-position lookups, with hit/miss counters.
+
+    Values are (path, line) or None for "no source". Shared by thread and
+    breakpoint resolution and cleared whenever symbols change.
+    """
+    def __init__(self, size=4096):
+        self.size   = size
+        self.hits   = 0
+        self.misses = 0
+        self._data  = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, fill, *args):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            value = self._data[key] = fill(*args)
+            if len(self._data) > self.size:
+                self._data.popitem(last=False)
+            return value
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+
+class _History:
+    """Ring of the last capacity stops: (seq, thread, file id, line, inferior).
+
+    Each field is its own preallocated array, so an entry costs 24 bytes
+    and no Python objects. Appended from the debugger thread, read by
+    /history requests.
+    """
+    _TYPECODES = 'QIIII'
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._cols    = tuple(array.array(code, bytes(capacity * array.array(code).itemsize))
+                              for code in self._TYPECODES)
+        self._count   = 0  # entries ever appended
+        self._lock    = threading.Lock()
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, *entry):
+        if not self.capacity:
+            return
+        with self._lock:
+            i = self._count % self.capacity
+            for col, value in zip(self._cols, entry):
+                col[i] = value
+            self._count += 1
+
+    def since(self, seq):
+        """Entries with a stop seq above seq, oldest first."""
+        with self._lock:
+            cap, cols = self.capacity, self._cols
+            lo, hi    = self._count - len(self), self._count
+            seqs      = cols[0]
+            while lo < hi:  # seqs only grow, so bisect over ring positions
+                mid = (lo + hi) // 2
+                if seqs[mid % cap] <= seq:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return [tuple(col[i % cap] for col in cols) for i in range(lo, self._count)]
+
+
+class _Histogram:
+    """Fixed-bucket duration histogram, in seconds. observe() is one bisect
+    and a few adds under an uncontended lock, so it stays on."""
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+               0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+    def __init__(self):
+        self._lock  = threading.Lock()
+        self.counts = [0] * (len(self.BUCKETS) + 1)  # last bucket is +Inf
+        self.sum    = 0.0
+        self.max    = 0.0
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(self.BUCKETS, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum       += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def prom(self, name, help):
+        """This histogram as a Prometheus metric family."""
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        out, cumulative = [], 0
+        for le, n in zip((*self.BUCKETS, "+Inf"), counts):
+            cumulative += n
+            out.append(({"le": le}, cumulative))
+        return (_prom(name + "_bucket", "histogram", help, out, family=name) +
+                f"{name}_sum {total}\n{name}_count {cumulative}\n")
+
+    def summary(self):
+        """'N calls, mean X us, max Y us' for dvap-stats."""
+        n = self.count
+        if not n:
+            return "0 calls"
+        return f"{n} calls, mean {self.sum / n * 1e6:.0f} us, max {self.max * 1e6:.0f} us"
+
+
+def _prom(name, kind, help, samples, family=None):
+    """One Prometheus text-format metric family. samples: [(labels, value)]."""
+    family = family or name
+    out = [f"# HELP {family} {help}", f"# TYPE {family} {kind}"]
+    for labels, value in samples:
+        tags = ",".join(f'{k}="{v}"' for k, v in labels.items())
+        out.append(f"{name}{{{tags}}} {value}" if tags else f"{name} {value}")
+    return "\n".join(out) + "\n"
 
-_SHUTDOWN = object()  # sentinel pushed to queues on shutdown
 
 class SSEDispatcher:
     """Thread-safe fan-out broadcaster to all connected SSE clients."""
-    def __init__(self):
-        self._clients = []
+    def __init__(self, conflate=True, paths=None, metrics=None, history=None, stack=None,
+                 replay=256):
+        self._clients = {}    # queue -> (mode, view, conflates, id); mode is "full" or "delta"
         self._lock    = threading.Lock()
+        self._snap    = None  # last broadcast _Snapshot, replayed to new subscribers
+        self._new_snap = threading.Condition(self._lock)  # notified per broadcast, for /state
+        # (seq, {key: fields before seq, None if added}) for the last replay
+        # broadcasts, to catch up a delta client that reconnects with Last-Event-ID.
+        self._log     = collections.deque(maxlen=replay)
+        self.instance = os.urandom(4).hex()  # event ids are {instance}-{seq}
+        self.conflate = conflate  # slow clients skip to the latest state instead of being dropped
+        self.paths    = paths     # _PathTable behind interned views
+        self.metrics  = metrics   # () -> /metrics body
+        self.history  = history   # (since) -> /history body
+        self.stack    = stack     # (thread, inferior, depth) -> /stack body, None if unknown
         self.stopped  = threading.Event()
+        # Counters for /metrics. broadcasts and dropped change under _lock;
+        # bytes_sent is bumped by every writer, so it has its own lock.
+        self.broadcasts = 0
+        self.dropped    = 0
+        self.bytes_sent = 0
+        self._next_id   = 0
+        self._sent_lock = threading.Lock()
 
-    def subscribe(self):
-        q = queue.Queue(maxsize=100)
+    def subscribe(self, mode="full", view=_DEFAULT_VIEW, q=None, last_id=None):
+        """Register a client. q is anything with put_nowait; by default a
+        _LatestSlot, or a bounded Queue when conflation is off. A delta
+        client passing the Last-Event-ID it saw is sent only what changed
+        since, if that is still in the replay log."""
+        if q is None:
+            q = _LatestSlot() if self.conflate else queue.Queue(maxsize=100)
         with self._lock:
-            self._clients.append(q)
+            if self._snap is not None:
+                payload, _, snapshot, upto = self._snap.payloads(view)
+                first = snapshot if mode == "delta" else payload
+                if mode == "delta" and last_id:
+                    first, upto = self._resume(last_id, view, first, upto)
+                if first is not None:
+                    q.put_nowait(first if upto is None else (first, upto, view.binary))
+            self._next_id   += 1
+            self._clients[q] = (mode, view, getattr(q, 'conflate', False), self._next_id)
         return q
 
+    def _resume(self, last_id, view, snapshot, upto):
+        """(message, upto) catching a client up from event last_id: a delta,
+        None if it missed nothing, or snapshot if last_id is unknown or too
+        old. Caller holds _lock."""
+        instance, _, seq = last_id.strip().rpartition('-')
+        if instance != self.instance or not seq.isdigit():
+            return snapshot, upto
+        seq, snap = int(seq), self._snap
+        if seq == snap.seq:
+            return None, upto
+        if not self._log or seq > snap.seq or seq < self._log[0][0] - 1:
+            return snapshot, upto
+        records = dict(snap.records)
+        for logged, undo in reversed(self._log):
+            if logged <= seq:
+                break
+            for key, fields in undo.items():
+                if fields is None:
+                    records.pop(key, None)
+                else:
+                    records[key] = fields
+        _, delta, _, upto = snap.rebased(records).payloads(view)
+        return delta, upto
+
     def unsubscribe(self, q):
         with self._lock:
-            if q in self._clients:
-                self._clients.remove(q)
+            self._clients.pop(q, None)
+
+    def subscribed(self, q):
+        """False once q has been dropped for falling behind, or unsubscribed."""
+        return q in self._clients
+
+    def broadcast(self, snap):
+        """Fan out a _Snapshot. Every client gets the same pre-encoded bytes."""
+        new, old = snap.records, snap.prev_records
+        undo = {k: old.get(k) for k, r in new.items() if old.get(k) != r}
+        undo.update((k, r) for k, r in old.items() if k not in new)
+        with self._lock:
+            self._log.append((snap.seq, undo))
+            self._snap       = snap
+            self.broadcasts += 1
+            self._fan_out(lambda mode, view: self._messages(snap, mode, view))
+            self._new_snap.notify_all()
+
+    def state(self, view, since=None, timeout=0):
+        """(version, payload) of the latest snapshot for /state, its full
+        payload for view with any file records it needs in front. Waits up
+        to timeout seconds for the version to differ from since; returns
+        (since, None) if it does not. A snapshot that changes nothing view
+        sends (it filters or groups) does not count as a change.
 
-    def broadcast(self, data):
-        msg = f"data: {data}\n\n".encode('utf-8')
+        A version is an event id, {instance}-{seq}.
+        """
+        deadline = time.monotonic() + timeout
         with self._lock:
-            for q in self._clients[:]:
-                try:
+            while True:
+                snap    = self._snap
+                version = f"{self.instance}-{snap.seq}" if snap is not None else None
+                if snap is not None and since != version:
+                    if (since != f"{self.instance}-{snap.seq - 1}"
+                            or snap.payloads(view)[1] is not None):
+                        break
+                    since = version  # unchanged for this view
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.stopped.is_set():
+                    return since, None
+                self._new_snap.wait(remaining)
+        payload, _, _, upto = snap.payloads(view)
+        if upto is not None:
+            payload, _ = _unpack((payload, upto, view.binary), 0, self.paths)
+        return version, payload
+
+    @staticmethod
+    def _messages(snap, mode, view):
+        payload, delta, snapshot, upto = snap.payloads(view)
+        if delta is None:
+            return None, None  # filtered out
+        msg, resync = (delta, snapshot) if mode == "delta" else (payload, None)
+        if upto is not None:
+            msg    = (msg, upto, view.binary)
+            resync = resync and (resync, upto, view.binary)
+        return msg, resync
+
+    def heartbeat(self):
+        """Keep idle connections alive without re-sending the state."""
+        with self._lock:
+            self._fan_out(lambda mode, view:
+                          (_HEARTBEAT_BIN if view.binary else _HEARTBEAT, None))
+
+    def _fan_out(self, msg_for):
+        """msg_for(mode, view) -> (message, resync); resync replaces a skipped delta."""
+        for q, (mode, view, conflates, _) in list(self._clients.items()):
+            msg, resync = msg_for(mode, view)
+            if msg is None:
+                continue
+            try:
+                if conflates:
+                    q.put_nowait(msg, resync)
+                else:
                     q.put_nowait(msg)
-                except queue.Full:
-                    self._clients.remove(q)
+            except queue.Full:
+                del self._clients[q]
+                self.dropped += 1
+
+    def count_sent(self, n):
+        """Record n bytes written to a client."""
+        with self._sent_lock:
+            self.bytes_sent += n
+
+    def queue_depths(self):
+        """[(client id, messages waiting)] for every subscriber."""
+        with self._lock:
+            return [(cid, q.qsize()) for q, (_, _, _, cid) in self._clients.items()]
 
     def shutdown(self):
         """Signal all do_GET threads to exit and close their connections."""
         self.stopped.set()
         with self._lock:
+            self._new_snap.notify_all()
             for q in self._clients:
                 try:
                     q.put_nowait(_SHUTDOWN)
@@ -62,43 +656,235 @@ class _HTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
         self.dispatcher = dispatcher
 
 
+class _UnixHTTPServer(_HTTPServer):
+    """_HTTPServer bound to a Unix socket path instead of a TCP port."""
+    address_family = socket.AF_UNIX if hasattr(socket, 'AF_UNIX') else None
+
+    def server_bind(self):
+        socketserver.TCPServer.server_bind(self)  # HTTPServer's expects (host, port)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def _socket_dir():
+    """Per-user directory holding one {pid}.sock per DVAP Unix socket."""
+    base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(base, f"dvap-{os.getuid()}")
+
+
+def _make_socket_dir(path):
+    """Create the socket directory path, or check the one already there.
+
+    Anyone who could swap or write into it could answer clients in our
+    place, so it must be a real directory, ours, and closed to others.
+    Raises OSError otherwise.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise OSError(f"{path} is not a directory (or is a symlink)")
+    if st.st_uid != os.getuid():
+        raise OSError(f"{path} is owned by uid {st.st_uid}")
+    if stat.S_IMODE(st.st_mode) != 0o700:
+        raise OSError(f"{path} has mode {stat.S_IMODE(st.st_mode):o}, not 700")
+
+
+def _socket_path(pid):
+    return os.path.join(_socket_dir(), f"{pid}.sock")
+
+
+_SSE_HEADERS = (
+    ("Content-Type",                "text/event-stream"),
+    ("Cache-Control",               "no-cache, no-transform"),
+    ("Connection",                  "keep-alive"),
+    ("X-Accel-Buffering",           "no"),
+    ("Access-Control-Allow-Origin", "*"),
+)
+
+
+_METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_TEXT_CONTENT_TYPE    = "text/plain; charset=utf-8"
+
+_STACK_DEPTH       = 16   # /threads/{id}/stack frames without depth=
+_STACK_MAX_DEPTH   = 256
+_STATE_TIMEOUT     = 30   # seconds /state waits for a change without timeout=
+_STATE_MAX_TIMEOUT = 300
+
+
+def _route(headers, path):
+    """Validate a request. Returns (status, message, endpoint, query).
+
+    headers is anything with a case-insensitive or lower-case-keyed get().
+    """
+    host = headers.get('host', '')
+    if not (host.startswith('127.0.0.1') or host.startswith('localhost')):
+        return 403, "Access Denied: Invalid Host header", None, None
+    url   = urllib.parse.urlsplit(path)
+    query = urllib.parse.parse_qs(url.query)
+    if url.path == '/metrics':
+        return 200, "OK", url.path, query
+    if url.path == '/history':
+        if not query.get('since', ['0'])[-1].isdigit():
+            return 400, "Bad Request: since must be a stop sequence number", None, None
+        return 200, "OK", url.path, query
+    parts = url.path.split('/')
+    if len(parts) == 4 and parts[1] == 'threads' and parts[3] == 'stack':
+        if not parts[2].isdigit():
+            return 400, "Bad Request: thread id must be a number", None, None
+        if not query.get('depth', ['1'])[-1].isdigit():
+            return 400, "Bad Request: depth must be a number of frames", None, None
+        if not query.get('inferior', ['0'])[-1].isdigit():
+            return 400, "Bad Request: inferior must be a number", None, None
+        query['thread'] = [parts[2]]
+        return 200, "OK", '/stack', query
+    if url.path == '/state':
+        if not query.get('timeout', ['0'])[-1].isdigit():
+            return 400, "Bad Request: timeout must be a number of seconds", None, None
+    elif url.path != '/events':
+        return 404, "Not Found", None, None
+    if query.get('mode', ['full'])[-1] not in ('full', 'delta'):
+        return 400, "Bad Request: mode must be 'full' or 'delta'", None, None
+    if query.get('paths', ['full'])[-1] not in ('full', 'interned'):
+        return 400, "Bad Request: paths must be 'full' or 'interned'", None, None
+    if 'format' not in query and _BIN_CONTENT_TYPE in headers.get('accept', ''):
+        query['format'] = ['binary']
+    if query.get('format', ['text'])[-1] not in ('text', 'binary'):
+        return 400, "Bad Request: format must be 'text' or 'binary'", None, None
+    if query.get('threads', ['all'])[-1] not in ('all', 'selected', 'grouped'):
+        return 400, "Bad Request: threads must be 'all', 'selected' or 'grouped'", None, None
+    if not set(_split_list(query.get('types', []))) <= _FILTER_TYPES:
+        return 400, "Bad Request: types must be a list of selected, thread, bp", None, None
+    return 200, "OK", url.path, query
+
+
+def _split_list(values):
+    """Items of repeated and comma-separated query values."""
+    return [item for value in values for item in value.split(',') if item]
+
+
+def _history_since(query):
+    return int(query.get('since', ['0'])[-1])
+
+
+def _state_reply(dispatcher, query, headers):
+    """(status, message, content type, body, headers) for a validated
+    /state request. Blocks while the state is at the version the client
+    already has (since= or If-None-Match), up to timeout= seconds."""
+    since = query.get('since', [None])[-1]
+    if since is None:
+        etag  = headers.get('if-none-match', '').split(',')[0].strip()
+        since = (etag[2:] if etag.startswith('W/') else etag).strip('"') or None
+    timeout = min(int(query.get('timeout', [_STATE_TIMEOUT])[-1]), _STATE_MAX_TIMEOUT)
+    view    = _subscription(query)[1]
+    version, body = dispatcher.state(view, since, timeout if since else 0)
+    extra = (("ETag", f'"{version}"'), ("Cache-Control", "no-cache"),
+             ("Access-Control-Allow-Origin", "*"), ("Access-Control-Expose-Headers", "ETag"))
+    if body is None:
+        return 304, "Not Modified", None, b"", extra
+    if view.binary:
+        return 200, "OK", _BIN_CONTENT_TYPE, body, extra
+    # The SSE framing of the shared payload, dropped: one line per message.
+    body = b"".join(line[6:] + b"\n" for line in body.split(b"\n") if line.startswith(b"data: "))
+    return 200, "OK", _TEXT_CONTENT_TYPE, body, extra
+
+
+def _stack_args(query):
+    """(thread, inferior or None, depth) for a validated /stack query."""
+    inf   = query.get('inferior')
+    depth = int(query.get('depth', [_STACK_DEPTH])[-1])
+    return (int(query['thread'][-1]), int(inf[-1]) if inf else None,
+            max(1, min(depth, _STACK_MAX_DEPTH)))
+
+
+def _filter(query):
+    """_Filter for a validated /events query, or None if it has no filters."""
+    types    = _split_list(query.get('types', []))
+    files    = _split_list(query.get('files', []))
+    selected = query.get('threads', ['all'])[-1] == 'selected'
+    if not (types or files or selected):
+        return None
+    return _Filter(frozenset(types) if types else None, selected,
+                   tuple(files) if files else None)
+
+
+def _subscription(query):
+    """(mode, view) for a validated /events query. Called once per
+    connection; the view, filter included, keys the shared payload cache."""
+    binary = query.get('format', ['text'])[-1] == 'binary'
+    view   = _View(interned=binary or query.get('paths', ['full'])[-1] == 'interned',
+                   binary=binary, filter=_filter(query),
+                   grouped=query.get('threads', ['all'])[-1] == 'grouped')
+    return query.get('mode', ['full'])[-1], view
+
+
+def _stream_headers(query):
+    """Response headers for an /events stream in the negotiated format."""
+    if query.get('format', ['text'])[-1] != 'binary':
+        return _SSE_HEADERS
+    return (("Content-Type", _BIN_CONTENT_TYPE),) + _SSE_HEADERS[1:]
+
+
 class _SSEHandler(http.server.BaseHTTPRequestHandler):
     def _check_request(self):
-        host = self.headers.get('Host', '')
-        if not (host.startswith('127.0.0.1') or host.startswith('localhost')):
-            self.send_error(403, "Access Denied: Invalid Host header")
-            return False
-        if self.path != '/events':
-            self.send_error(404, "Not Found")
+        code, message, self.endpoint, self.query = _route(self.headers, self.path)
+        if code != 200:
+            self.send_error(code, message)
             return False
         return True
 
     def _send_sse_headers(self):
         self.send_response(200)
-        self.send_header("Content-Type",               "text/event-stream")
-        self.send_header("Cache-Control",              "no-cache, no-transform")
-        self.send_header("Connection",                 "keep-alive")
-        self.send_header("X-Accel-Buffering",          "no")
-        self.send_header("Access-Control-Allow-Origin","*")
+        for name, value in _stream_headers(self.query):
+            self.send_header(name, value)
+        self.end_headers()
+
+    def _send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
 
     def do_GET(self):
         if not self._check_request():
             return
+        if self.endpoint == '/metrics':
+            self._send_body(self.server.dispatcher.metrics().encode('utf-8'),
+                            _METRICS_CONTENT_TYPE)
+            return
+        if self.endpoint == '/history':
+            self._send_body(self.server.dispatcher.history(_history_since(self.query)),
+                            _TEXT_CONTENT_TYPE)
+            return
+        if self.endpoint == '/state':
+            self._send_state()
+            return
+        if self.endpoint == '/stack':
+            self._send_stack()
+            return
         self._send_sse_headers()
         self.wfile.flush()
         disp = self.server.dispatcher
-        q    = disp.subscribe()
+        q    = disp.subscribe(*_subscription(self.query),
+                              last_id=self.headers.get('Last-Event-ID'))
+        # A slot always receives _SHUTDOWN, so it can block; a full Queue
+        # may lose it, or be dropped, and has to poll.
+        poll = None if isinstance(q, _LatestSlot) else 0.05
+        sent = 0  # highest path id this connection has been sent
         try:
-            while not disp.stopped.is_set():
+            # A dropped client is closed at once; its backlog is stale.
+            while not disp.stopped.is_set() and disp.subscribed(q):
                 try:
-                    msg = q.get(timeout=0.05)
+                    msg = q.get(timeout=poll)
                 except queue.Empty:
                     continue
                 if msg is _SHUTDOWN:
                     break
+                msg, sent = _unpack(msg, sent, disp.paths)
                 self.wfile.write(msg)
                 self.wfile.flush()
+                disp.count_sent(len(msg))
         except (ConnectionResetError, BrokenPipeError, OSError):
             pass
         finally:
@@ -112,82 +898,1191 @@ class _SSEHandler(http.server.BaseHTTPRequestHandler):
     def do_HEAD(self):
         if not self._check_request():
             return
+        if self.endpoint == '/metrics':
+            self._send_body(self.server.dispatcher.metrics().encode('utf-8'),
+                            _METRICS_CONTENT_TYPE)
+            return
+        if self.endpoint == '/history':
+            self._send_body(self.server.dispatcher.history(_history_since(self.query)),
+                            _TEXT_CONTENT_TYPE)
+            return
+        if self.endpoint == '/state':
+            self._send_state()
+            return
+        if self.endpoint == '/stack':
+            self._send_stack()
+            return
         self._send_sse_headers()
 
+    def _send_state(self):
+        code, message, content_type, body, headers = _state_reply(
+            self.server.dispatcher, self.query, self.headers)
+        self.send_response(code, message)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_stack(self):
+        body = self.server.dispatcher.stack(*_stack_args(self.query))
+        if body is None:
+            self.send_error(404, "Not Found: no such stopped thread")
+        else:
+            self._send_body(body, _TEXT_CONTENT_TYPE)
+
     def log_message(self, format, *args):
         pass  # suppress HTTP request logs in the lldb console
 
 
-class DVAPServer:
-    """All state for one DVAP server instance. Stored on lldb._dvap_instance."""
+class _SelectorClient:
+    """One connection served by _SelectorServer.
+
+    Passed to SSEDispatcher.subscribe in place of a queue.Queue: put_nowait
+    only appends to the outgoing buffer and wakes the selector thread,
+    which does all socket I/O.
+    """
+    MAX_PENDING = 100  # queued messages before a non-conflating client is dropped
+
+    def __init__(self, sock, server, conflate):
+        self.sock      = sock
+        self.server    = server
+        self.conflate  = conflate
+        self.lock      = threading.Lock()  # guards out against the selector thread
+        self.inbuf     = b""
+        self.out       = collections.deque()
+        self.streaming = False  # request handled, now an SSE subscriber
+        self.replying  = False  # request handled, response built off the selector thread
+        self.closing   = False  # close once out is flushed
+        self.paths_sent = 0     # highest path id this connection has been sent
+
+    def qsize(self):
+        return len(self.out)
+
+    def put_nowait(self, msg, resync=None):
+        with self.lock:
+            if msg is _SHUTDOWN:
+                self.closing = True
+            elif self.conflate and len(self.out) > 1:
+                # Keep the message in flight, replace whatever waits behind it.
+                if _is_heartbeat(msg):
+                    return
+                while len(self.out) > 1:
+                    self.out.pop()
+                self.out.append(resync or msg)
+            elif len(self.out) >= self.MAX_PENDING:
+                self.closing = True
+                self.server.wake(self)
+                raise queue.Full
+            else:
+                self.out.append(msg)
+        self.server.wake(self)
+
+
+class _SelectorServer:
+    """Single-threaded alternative to _HTTPServer.
+
+    One selector loop accepts connections, parses requests and writes to
+    every SSE client with non-blocking sends; no thread per client and no
+    polling while idle.
+    """
+    MAX_REQUEST = 8192  # bytes of request line + headers
+    # Endpoints answered on the selector thread; the others may block, so
+    # each gets a thread.
+    INLINE = frozenset(('/metrics', '/history'))
+
+    def __init__(self, addr, dispatcher):
+        """addr is (host, port), a Unix socket path or a listening socket."""
+        self.dispatcher = dispatcher
+        if isinstance(addr, socket.socket):  # bound by someone else (relay mode)
+            self.socket = addr
+        elif isinstance(addr, str):  # Unix socket path
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                self.socket.bind(addr)
+                self.socket.listen()
+            except OSError:
+                self.socket.close()
+                raise
+        else:
+            self.socket = socket.create_server(addr)
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._woken    = set()  # clients with new output, guarded by _lock
+        self._lock     = threading.Lock()
+        self._sel      = selectors.DefaultSelector()
+        self._sel.register(self.socket,  selectors.EVENT_READ)
+        self._sel.register(self._wake_r, selectors.EVENT_READ)
+        self._running  = False
+        self._done     = threading.Event()
+
+    def wake(self, client):
+        """Hand a client with new output to the selector thread (any thread)."""
+        with self._lock:
+            first = not self._woken
+            self._woken.add(client)
+        if first:
+            try:
+                self._wake_w.send(b"\0")
+            except (BlockingIOError, OSError):
+                pass  # a wakeup is already pending, or we are closing
+
+    def serve_forever(self):
+        self._running = True
+        try:
+            while self._running:
+                for key, mask in self._sel.select():
+                    if key.fileobj is self.socket:
+                        self._accept()
+                    elif key.fileobj is self._wake_r:
+                        self._on_wake()
+                    else:
+                        if mask & selectors.EVENT_READ:
+                            self._read(key.data)
+                        if mask & selectors.EVENT_WRITE:
+                            self._flush(key.data)
+        finally:
+            for key in list(self._sel.get_map().values()):
+                if key.data is not None:
+                    self._close(key.data)
+            self._done.set()
+
+    def shutdown(self):
+        self._running = False
+        self.wake(None)
+        self._done.wait()
+
+    def server_close(self):
+        self._sel.close()
+        for s in (self.socket, self._wake_r, self._wake_w):
+            s.close()
+
+    def _accept(self):
+        try:
+            sock, _ = self.socket.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        self._sel.register(sock, selectors.EVENT_READ,
+                           _SelectorClient(sock, self, self.dispatcher.conflate))
+
+    def _on_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            woken, self._woken = self._woken, set()
+        for client in woken:
+            if client is not None:
+                self._flush(client)
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(client)  # peer hung up
+            return
+        if client.streaming or client.replying:
+            return  # nothing more is expected from this client
+        client.inbuf += data
+        if b"\r\n\r\n" in client.inbuf:
+            self._handle_request(client)
+        elif len(client.inbuf) > self.MAX_REQUEST:
+            self._reply_error(client, 431, "Request Header Fields Too Large")
+
+    def _handle_request(self, client):
+        head, _, _ = client.inbuf.partition(b"\r\n\r\n")
+        lines   = head.decode('latin-1').split("\r\n")
+        request = lines[0].split()
+        if len(request) != 3:
+            self._reply_error(client, 400, "Bad Request")
+            return
+        method, path, _ = request
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if method not in ('GET', 'HEAD'):
+            self._reply_error(client, 501, "Unsupported method")
+            return
+        code, message, endpoint, query = _route(headers, path)
+        if code != 200:
+            self._reply_error(client, code, message)
+            return
+        if endpoint in self.INLINE:
+            code, message, content_type, body, extra = self._endpoint_reply(endpoint, query,
+                                                                            headers)
+            self._reply(client, code, message, content_type, body, method == 'HEAD', extra)
+            return
+        if endpoint != '/events':
+            # May wait on the debugger or for a change, which must not
+            # stall the other clients.
+            client.replying = True
+            threading.Thread(target=self._reply_threaded,
+                             args=(client, endpoint, query, headers, method == 'HEAD'),
+                             daemon=True).start()
+            return
+        client.out.append(b"HTTP/1.0 200 OK\r\n" +
+                          "".join(f"{n}: {v}\r\n"
+                                  for n, v in _stream_headers(query)).encode('latin-1') +
+                          b"\r\n")
+        if method == 'HEAD':
+            client.closing = True
+        else:
+            client.streaming = True
+            self.dispatcher.subscribe(*_subscription(query), client,
+                                      last_id=headers.get('last-event-id'))
+        self._flush(client)
+
+    def _reply_error(self, client, code, message):
+        self._reply(client, code, message, "text/plain",
+                    f"{code} {message}\n".encode('utf-8'))
+
+    def _reply(self, client, code, message, content_type, body, head_only=False, headers=()):
+        """Send one complete response and close the connection."""
+        client.out.append(self._response(code, message, content_type, body, head_only,
+                                         headers))
+        client.closing = True
+        self._flush(client)
+
+    def _reply_threaded(self, client, endpoint, query, headers, head_only):
+        """_reply, from a thread of its own (any thread)."""
+        try:
+            code, message, content_type, body, extra = self._endpoint_reply(endpoint, query,
+                                                                            headers)
+        except OSError as e:  # a relay's request to the debugger failed
+            code, message, content_type, extra = 502, "Bad Gateway", "text/plain", ()
+            body = f"{code} {message}: {e}\n".encode('utf-8')
+        response = self._response(code, message, content_type, body, head_only, extra)
+        with client.lock:
+            client.out.append(response)
+            client.closing = True
+        self.wake(client)
+
+    def _endpoint_reply(self, endpoint, query, headers):
+        """(status, message, content type, body, headers) for a validated
+        request to any endpoint but /events."""
+        disp = self.dispatcher
+        if endpoint == '/metrics':
+            return 200, "OK", _METRICS_CONTENT_TYPE, disp.metrics().encode('utf-8'), ()
+        if endpoint == '/history':
+            return 200, "OK", _TEXT_CONTENT_TYPE, disp.history(_history_since(query)), ()
+        if endpoint == '/state':
+            return _state_reply(disp, query, headers)
+        body = disp.stack(*_stack_args(query))
+        if body is None:
+            code, message = 404, "Not Found: no such stopped thread"
+            return code, message, "text/plain", f"{code} {message}\n".encode('utf-8'), ()
+        return 200, "OK", _TEXT_CONTENT_TYPE, body, ()
+
+    @staticmethod
+    def _response(code, message, content_type, body, head_only=False, headers=()):
+        head = f"HTTP/1.0 {code} {message}\r\n"
+        if content_type:
+            head += f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers)
+        return ((head + "Connection: close\r\n\r\n").encode('latin-1') +
+                (b"" if head_only else body))
+
+    def _flush(self, client):
+        if client.sock.fileno() < 0:
+            return  # already closed
+        out = client.out
+        try:
+            with client.lock:
+                while out:
+                    chunk = out[0]
+                    if type(chunk) is tuple:
+                        chunk, client.paths_sent = _unpack(chunk, client.paths_sent,
+                                                           self.dispatcher.paths)
+                    sent  = client.sock.send(chunk)
+                    if client.streaming:
+                        self.dispatcher.count_sent(sent)
+                    if sent < len(chunk):
+                        out[0] = chunk[sent:]
+                        break
+                    out.popleft()
+                pending = bool(out)
+        except BlockingIOError:
+            pending = True
+        except OSError:
+            self._close(client)
+            return
+        if not pending and client.closing:
+            self._close(client)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if pending else 0)
+        self._sel.modify(client.sock, events, client)
+
+    def _close(self, client):
+        if client.sock.fileno() < 0:
+            return
+        self.dispatcher.unsubscribe(client)
+        try:
+            self._sel.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+
+
+class _Encoder:
+    """Record formatting and per-view payload encoding, shared by DVAPServer
+    and the relay process. Needs _paths, _disp and _encode_hist."""
     FS = ";;"   # field separator (within a record)
     RS = "||"   # record separator (between records)
 
-    def __init__(self, port, debugger):
+    _PATH_FIELD = {"thread": 3, "bp": 2, "threads": 1}  # path index per record type
+
+    def _format(self, fields, view=_DEFAULT_VIEW):
+        """One record as protocol text. A del record carries its key, whose
+        path (threads groups only) is interned like the record's."""
+        if view.interned:
+            i = self._PATH_FIELD.get(fields[0])
+            if fields[0] == "del" and fields[1] == "threads":
+                i = 2
+            if i is not None:
+                fields = (*fields[:i], self._paths.intern(fields[i]), *fields[i + 1:])
+        return self.FS.join(map(str, fields))
+
+    def _join(self, records):
+        RS = self.RS
+        return "".join(r + RS for r in records)
+
+    def _encode(self, snap, view):
+        """Build snap.payloads(view), timed into _encode_hist."""
+        t0 = time.perf_counter()
+        new, old = snap.records, snap.prev_records
+        if view.filter is not None:
+            new = view.filter.apply(new, self._PATH_FIELD)
+            old = view.filter.apply(old, self._PATH_FIELD)
+        if view.grouped:
+            new, old = _group_threads(new), _group_threads(old)
+        if view.binary:
+            payloads = self._encode_binary(snap.seq, new, old)
+        else:
+            payloads = self._encode_text(snap.seq, new, old, view)
+        if (view.filter is not None or view.grouped) and new == old:
+            payloads = (payloads[0], None, *payloads[2:])
+        self._encode_hist.observe(time.perf_counter() - t0)
+        return payloads
+
+    def _encode_text(self, seq, new, old, view):
+        """A delta carries added/changed records and a del record per key
+        gone since the previous snapshot."""
+        FS    = self.FS
+        text  = {k: self._format(r, view) for k, r in new.items()}
+        body  = list(text.values())
+        delta = [f"delta{FS}{seq}"]
+        delta += [text[k] for k, r in new.items() if old.get(k) != r]
+        delta += [self._format(("del", *k), view) for k in old if k not in new]
+        event_id = f"{self._disp.instance}-{seq}"
+        return (_sse(self._join(body), event_id),
+                _sse(self._join(delta), event_id),
+                _sse(self._join([f"snapshot{FS}{seq}", *body]), event_id),
+                len(self._paths) if view.interned else None)
+
+    def _encode_binary(self, seq, new, old):
+        """snap.payloads() for a binary view, from the same records."""
+        intern = self._paths.intern
+        recs   = {k: _bin_record(r, intern) for k, r in new.items()}
+        body   = b"".join(recs.values())
+        delta  = (b"".join(recs[k] for k, r in new.items() if old.get(k) != r) +
+                  b"".join(_bin_del(k, intern) for k in old if k not in new))
+        return (_bin_frame(_BIN_FULL, seq, body),
+                _bin_frame(_BIN_DELTA, seq, delta),
+                _bin_frame(_BIN_SNAPSHOT, seq, body),
+                len(self._paths))
+
+
+_FEED_HEAD           = struct.Struct(">I")  # length of the pickled item that follows
+_RELAY_SEND_TIMEOUT  = 5   # seconds a push may block before the relay counts as gone
+_RELAY_FETCH_TIMEOUT = 30  # seconds the relay waits on the debugger's own server
+_SCRIPT              = os.path.abspath(__file__)
+
+# Runs this script as the relay process: python -c _RELAY_BOOT <script> <args>.
+_RELAY_BOOT = ("import sys; path = sys.argv[1]; "
+               "exec(compile(open(path).read(), path, 'exec'),"
+               " {'__name__': '__dvap_relay__', '__file__': path})")
+
+
+def _relay_python():
+    """Interpreter for the relay process. An embedded Python's
+    sys.executable may be the debugger itself; then python3.X from PATH."""
+    exe = sys.executable
+    if exe and os.path.basename(exe).startswith('python'):
+        return exe
+    version = f"python{sys.version_info[0]}.{sys.version_info[1]}"
+    return shutil.which(version) or shutil.which('python3') or 'python3'
+
+
+class _RelayProcess:
+    """Debugger side of relay mode.
+
+    A helper process owns the TCP listener and every client on it. Each
+    published snapshot is pushed to it once over a socketpair, as its
+    records plus the path table entries added since the last push; the
+    relay encodes, buffers and writes for all clients, so their I/O does
+    not compete for the debugger's GIL. /metrics, /history and
+    /threads/{id}/stack need the debugger: the relay forwards those to
+    the debugger's own server on backend_port.
+    """
+
+    def __init__(self, listener, backend_port, paths, slow_clients, instance):
+        self._paths      = paths
+        self._paths_sent = 0  # highest path id the relay has
+        self._sock, theirs = socket.socketpair()
+        try:
+            fds = (listener.fileno(), theirs.fileno())
+            self.proc = subprocess.Popen(
+                [_relay_python(), '-c', _RELAY_BOOT, _SCRIPT, *map(str, fds),
+                 str(backend_port), slow_clients, instance],
+                pass_fds=fds, stdin=subprocess.DEVNULL,
+                start_new_session=True)  # no SIGINT from the debugger's terminal
+        except OSError:
+            self._sock.close()
+            raise
+        finally:
+            theirs.close()
+        self._sock.settimeout(_RELAY_SEND_TIMEOUT)
+        self.pushed       = 0  # snapshots
+        self.pushed_bytes = 0
+        self.stopped      = False  # closed, or the relay went away
+
+    def push(self, snap):
+        """Send snap to the relay, or a heartbeat for None."""
+        if self.stopped:
+            return
+        upto = self._paths_sent
+        if snap is not None:
+            # Every path, so that the relay's ids match those of /history.
+            intern = self._paths.intern
+            for fields in snap.records.values():
+                i = _Encoder._PATH_FIELD.get(fields[0])
+                if i is not None:
+                    intern(fields[i])
+            upto = len(self._paths)
+            snap = (snap.seq, snap.records,
+                    [self._paths.path(i) for i in range(self._paths_sent + 1, upto + 1)])
+        data = pickle.dumps(snap, 4)
+        try:
+            self._sock.sendall(_FEED_HEAD.pack(len(data)) + data)
+        except OSError as e:
+            if not self.stopped:
+                self.stopped = True
+                print(f"[DVAP] Relay process gone ({e}); TCP clients no longer get"
+                      " updates. dvap-start restarts it.")
+            return
+        self._paths_sent   = upto
+        self.pushed       += snap is not None
+        self.pushed_bytes += _FEED_HEAD.size + len(data)
+
+    def close(self):
+        """Stop the relay. At the end of its feed it closes every client and
+        exits."""
+        self.stopped = True
+        self._sock.close()
+        try:
+            self.proc.wait(_RELAY_SEND_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class _Relay(_Encoder):
+    """The relay process (see _RelayProcess). Rebuilds each snapshot the
+    debugger pushes and serves the TCP clients from it on a
+    _SelectorServer, encoding per view as the debugger would."""
+
+    def __init__(self, listener, feed, backend_port, slow_clients, instance):
+        self._feed        = feed
+        self._backend     = backend_port
+        self._paths       = _PathTable(self.FS, self.RS)
+        self._encode_hist = _Histogram()
+        self._disp        = SSEDispatcher(conflate=(slow_clients == 'latest'),
+                                          paths=self._paths, metrics=self.metrics,
+                                          history=self.history, stack=self.stack)
+        self._disp.instance = instance  # event ids and versions stay the debugger's
+        self._http        = _SelectorServer(listener, self._disp)
+        self._http.INLINE = frozenset()  # every other reply waits on the debugger
+        self.snapshot     = _EMPTY_SNAPSHOT
+
+    def serve(self):
+        threading.Thread(target=self._feed_loop, daemon=True).start()
+        self._http.serve_forever()
+        self._http.server_close()
+
+    def _feed_loop(self):
+        """Fan out what the debugger pushes until it closes the feed."""
+        feed = self._feed.makefile('rb')
+        try:
+            while True:
+                head = feed.read(_FEED_HEAD.size)
+                if len(head) < _FEED_HEAD.size:
+                    break  # dvap-stop, dvap-start, or the debugger exited
+                item = pickle.loads(feed.read(_FEED_HEAD.unpack(head)[0]))
+                if item is None:
+                    self._disp.heartbeat()
+                    continue
+                seq, records, paths = item
+                for path in paths:
+                    self._paths.intern(path)
+                prev = self.snapshot
+                self.snapshot = _Snapshot(seq, records, prev.records, self._encode)
+                self._disp.broadcast(self.snapshot)
+        except OSError:
+            pass
+        finally:
+            self._disp.shutdown()
+            self._http.shutdown()
+
+    def metrics(self):
+        """The debugger's /metrics, plus the counters of this process's clients."""
+        disp = self._disp
+        return self._fetch("/metrics").decode('utf-8') + "".join([
+            _prom("dvap_relay_broadcasts_total", "counter",
+                  "State snapshots the relay fanned out to clients.", [({}, disp.broadcasts)]),
+            _prom("dvap_relay_sent_bytes_total", "counter",
+                  "Bytes the relay wrote to client connections.", [({}, disp.bytes_sent)]),
+            _prom("dvap_relay_clients_dropped_total", "counter",
+                  "Relay clients disconnected for falling behind.", [({}, disp.dropped)]),
+            _prom("dvap_relay_client_queue_depth", "gauge",
+                  "Messages waiting to be written, per relay client.",
+                  [({"client": cid}, depth) for cid, depth in disp.queue_depths()]),
+            self._encode_hist.prom("dvap_relay_encode_seconds",
+                                   "Time for the relay to encode one snapshot for one view."),
+        ])
+
+    def history(self, since):
+        return self._fetch(f"/history?since={since}")
+
+    def stack(self, num, inf, depth):
+        query = f"depth={depth}" + (f"&inferior={inf}" if inf is not None else "")
+        return self._fetch(f"/threads/{num}/stack?{query}")
+
+    def _fetch(self, path):
+        """GET path from the debugger's own server: the body, or None for a
+        404. Raises OSError if the debugger does not answer."""
+        conn = http.client.HTTPConnection('127.0.0.1', self._backend,
+                                          timeout=_RELAY_FETCH_TIMEOUT)
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            body     = response.read()
+        except http.client.HTTPException as e:
+            raise OSError(e)
+        finally:
+            conn.close()
+        if response.status == 404:
+            return None
+        if response.status != 200:
+            raise OSError(f"{response.status} {response.reason}")
+        return body
+
+
+def _relay_main(argv):
+    """Entry point of the relay process; argv as _RelayProcess passes it."""
+    listen_fd, feed_fd, backend_port, slow_clients, instance = argv
+    _Relay(socket.socket(fileno=int(listen_fd)), socket.socket(fileno=int(feed_fd)),
+           int(backend_port), slow_clients, instance).serve()
+    return 0
+
+
+class DVAPServer(_Encoder):
+    """All state for one DVAP server instance. Stored on lldb._dvap_instance."""
+
+    _WAIT_FOREVER = 0xFFFFFFFF  # SBListener.WaitForEvent: UINT32_MAX means no timeout
+    _STOP_BIT     = 1           # event type on _stop_bc that ends _event_loop
+
+    def __init__(self, port, debugger, heartbeat=15, transport='threaded',
+                 slow_clients='latest', unix_socket=False, history=4096, relay=False):
         self._debugger = debugger
-        self._disp     = SSEDispatcher()
+        # threads: {target id: {thread index id: pos}}; breakpoints: {(target id, bp id): entry};
+        # selected_thread: (target id, thread index id); syncing: the initial
+        # _sync_lldb_state has not finished. See _target_id.
+        self._state    = {"threads": {}, "breakpoints": {}, "selected_thread": None,
+                          "syncing": True}
+        self._lock     = threading.Lock()
+        # Bumped under _lock by every state mutation; the broadcast loop
+        # sleeps on _changed until it moves.
+        self._changed  = threading.Condition(self._lock)
+        self._version  = 0
+        self.snapshot  = _EMPTY_SNAPSHOT  # last published state, read without _lock
+        self.heartbeat = heartbeat
+        self._paths    = _PathTable(self.FS, self.RS)
+        self._lines    = _LineCache()  # (pid, pc, inlined) -> (file, line) | None
+        self._encode_hist = _Histogram()
+        self._stop_hist   = _Histogram()  # _on_process_changed
+        self._stops       = 0  # process and thread events, and the refreshes
+        self._refreshes   = 0  # they were coalesced into
+        self._history     = _History(history)  # selected thread at each refresh
+        # (stop, {(target id, thread): (stop, frames, complete)}): call stacks
+        # walked since that stop, on request only. See stack().
+        self._stacks         = (0, {})
+        self._stack_lock     = threading.Lock()  # one walk at a time; the rest wait for it
+        # ((SBTarget, target id), ...): see _target_id. Replaced, never mutated,
+        # so stack() can read it while the event loop adds targets.
+        self._target_ids     = ()
+        self._last_target_id = 0
+        self._stack_requests = 0
+        self._stack_walks    = 0
+        self._disp     = SSEDispatcher(conflate=(slow_clients == 'latest'), paths=self._paths,
+                                        metrics=self.metrics, history=self.history,
+                                        stack=self.stack)
         self._http     = None
+        self._unix     = None  # optional second listener on unix_path
+        self.unix_path = None
+        self._relay    = None  # _RelayProcess serving the TCP clients, in relay mode
+        self.port      = port  # where TCP clients connect
+        self._listener = lldb.SBListener("dvap")
+        self._stop_bc  = lldb.SBBroadcaster("dvap-stop")
 
+        listener = None
         try:
-            self._http = _HTTPServer(('127.0.0.1', port), _SSEHandler, self._disp)
+            if relay:
+                # The relay serves port. The debugger's own server, on any
+                # free port, only answers what the relay forwards.
+                listener = socket.create_server(('127.0.0.1', port))
+            addr = ('127.0.0.1', 0 if relay else port)
+            if transport == 'selector':
+                self._http = _SelectorServer(addr, self._disp)
+            else:
+                self._http = _HTTPServer(addr, _SSEHandler, self._disp)
+            self.port = self._http.server_address[1]
+            if relay:
+                self._relay = _RelayProcess(listener, self.port, self._paths, slow_clients,
+                                            self._disp.instance)
+                self.port   = listener.getsockname()[1]
         except OSError as e:
             print(f"[DVAP] Failed to start server on port {port}: {e}")
+            if self._http:
+                self._http.server_close()
+                self._http = None
             return
+        finally:
+            if listener is not None:
+                listener.close()  # the relay has its own
 
+        self._connect_events()
+        self._publish(self._records())  # so early subscribers start from a snapshot
+        threading.Thread(target=self._event_loop, daemon=True).start()
         threading.Thread(target=self._broadcast_loop, daemon=True).start()
         threading.Thread(target=self._http.serve_forever, daemon=True).start()
-        print(f"[DVAP] Listening on 127.0.0.1:{port}")
+        where = f" (relay process {self._relay.proc.pid})" if self._relay else ""
+        print(f"[DVAP] Listening on 127.0.0.1:{self.port}{where}")
+        if unix_socket:
+            self._listen_unix(transport)
 
     def shutdown(self):
         # Dispatcher first: unblocks do_GET threads before server.shutdown()
         # waits on them.
         self._disp.shutdown()
-        if self._http:
-            self._http.shutdown()
-            self._http.server_close()
+        self._stop_bc.BroadcastEventByType(self._STOP_BIT)  # wake _event_loop
+        with self._changed:
+            self._changed.notify_all()  # wake _broadcast_loop so it can exit
+        for server in (self._http, self._unix):
+            if server:
+                server.shutdown()
+                server.server_close()
+        if self._relay:
+            self._relay.close()
+        if self._unix:
+            try:
+                os.unlink(self.unix_path)
+            except OSError:
+                pass
+        self._listener.Clear()
+
+    def _listen_unix(self, transport):
+        """Also serve on _socket_path(pid). A failure here leaves TCP running."""
+        if not hasattr(socket, 'AF_UNIX'):
+            print("[DVAP] Unix sockets are not supported on this platform")
+            return
+        path = _socket_path(self._inferior_pid())
+        try:
+            _make_socket_dir(os.path.dirname(path))
+            try:
+                os.unlink(path)  # left behind by a session that did not shut down
+            except FileNotFoundError:
+                pass
+            if transport == 'selector':
+                self._unix = _SelectorServer(path, self._disp)
+            else:
+                self._unix = _UnixHTTPServer(path, _SSEHandler, self._disp)
+        except OSError as e:
+            print(f"[DVAP] Failed to listen on {path}: {e}")
+            return
+        self.unix_path = path
+        threading.Thread(target=self._unix.serve_forever, daemon=True).start()
+        print(f"[DVAP] Listening on {path}")
+
+    def _inferior_pid(self):
+        """The inferior's pid, or the debugger's while nothing is running."""
+        process = self._debugger.GetSelectedTarget().GetProcess()
+        return (process.IsValid() and process.GetProcessID()) or os.getpid()
+
+    def _follow_pid(self):
+        """Rename the Unix socket after the inferior it now serves.
+
+        A bound Unix socket stays reachable through the renamed path.
+        """
+        path = _socket_path(self._inferior_pid())
+        if path != self.unix_path:
+            try:
+                os.replace(self.unix_path, path)
+                self.unix_path = path
+            except OSError:
+                pass
+
+    def metrics(self):
+        """Counters, histograms and gauges in Prometheus text format (/metrics)."""
+        disp, lines = self._disp, self._lines
+        relay = self._relay
+        return "".join([
+            _prom("dvap_broadcasts_total", "counter",
+                  "State snapshots fanned out to clients.", [({}, disp.broadcasts)]),
+            _prom("dvap_sent_bytes_total", "counter",
+                  "Bytes written to client connections.", [({}, disp.bytes_sent)]),
+            _prom("dvap_clients_dropped_total", "counter",
+                  "Clients disconnected for falling behind.", [({}, disp.dropped)]),
+            _prom("dvap_client_queue_depth", "gauge",
+                  "Messages waiting to be written, per connected client.",
+                  [({"client": cid}, depth) for cid, depth in disp.queue_depths()]),
+            self._encode_hist.prom("dvap_encode_seconds",
+                                   "Time to encode one snapshot for one client view."),
+            self._stop_hist.prom("dvap_stop_seconds",
+                                 "Time to refresh thread positions after a stop."),
+            _prom("dvap_stops_total", "counter",
+                  "Process and thread events received.", [({}, self._stops)]),
+            _prom("dvap_stop_refreshes_total", "counter",
+                  "Thread refreshes run; events that arrive together share one.",
+                  [({}, self._refreshes)]),
+            _prom("dvap_stack_requests_total", "counter",
+                  "Call stacks requested from /threads/{id}/stack.",
+                  [({}, self._stack_requests)]),
+            _prom("dvap_stack_walks_total", "counter",
+                  "Call stacks read from the debugger; other requests hit the cache.",
+                  [({}, self._stack_walks)]),
+            _prom("dvap_line_cache_hits_total", "counter",
+                  "Source-position lookups answered from the line cache.", [({}, lines.hits)]),
+            _prom("dvap_line_cache_misses_total", "counter",
+                  "Source-position lookups that asked the debugger.", [({}, lines.misses)]),
+            _prom("dvap_line_cache_entries", "gauge",
+                  "Entries in the line cache.", [({}, len(lines))]),
+            _prom("dvap_relay_pushed_bytes_total", "counter",
+                  "Bytes of state pushed to the relay process.",
+                  [({}, relay.pushed_bytes)]) if relay else "",
+        ])
+
+    def stats(self):
+        """Human-readable summary of metrics() for dvap-stats."""
+        disp, lines = self._disp, self._lines
+        depths  = disp.queue_depths()
+        lookups = lines.hits + lines.misses
+        out = [
+            f"Broadcasts: {disp.broadcasts}, {disp.bytes_sent} bytes sent",
+            f"Clients: {len(depths)} connected, {disp.dropped} dropped",
+        ]
+        out += [f"  client {cid}: {depth} queued" for cid, depth in depths]
+        out += [
+            f"Encode: {self._encode_hist.summary()}",
+            f"Stops: {self._stops}, {self._refreshes} refreshed",
+            f"Stop refresh: {self._stop_hist.summary()}",
+            f"Line cache: {lines.hits}/{lookups} hits"
+            + (f" ({100 * lines.hits / lookups:.0f}%)" if lookups else ""),
+            f"History: {len(self._history)}/{self._history.capacity} stops",
+            f"Stacks: {self._stack_requests} requested, {self._stack_walks} walked",
+        ]
+        if self._relay:
+            relay = self._relay
+            out.append(f"Relay: process {relay.proc.pid}"
+                       + (" (gone)" if relay.stopped else "")
+                       + f", {relay.pushed} snapshots / {relay.pushed_bytes} bytes pushed")
+        return out
+
+    def history(self, since):
+        """/history body: the recorded stops after seq since, preceded by a
+        header with the latest stop seq and the paths the stops use."""
+        fs, rs  = self.FS, self.RS
+        entries = self._history.since(since)
+        ids     = sorted({e[2] for e in entries} - {0})
+        out  = [f"history{fs}{self._stops}"]
+        out += [f"file{fs}{i}{fs}{self._paths.path(i)}" for i in ids]
+        out += [fs.join(("stop", *map(str, e))) for e in entries]
+        return (rs.join(out) + rs + "\n").encode('utf-8')
+
+    def stack(self, num, inf, depth):
+        """/threads/{num}/stack body: the top depth frames of thread num in
+        target inf (None: the selected thread's), or None if the state has
+        no such thread.
+
+        Stacks are walked only when asked for and cached until the next
+        stop, so threads nobody looks at cost nothing and clients asking
+        about the same thread between two stops share one walk.
+        """
+        with self._lock:
+            self._stack_requests += 1
+            selected = self._state["selected_thread"]
+            threads  = self._state["threads"]
+        if inf is None:
+            inf = selected[0] if selected is not None else 1
+        if num not in threads.get(inf, {}):
+            return None
+        with self._stack_lock:
+            gen, stacks = self._stacks
+            entry = stacks.get((inf, num)) if gen == self._stops else None
+            if entry is None or (len(entry[1]) < depth and not entry[2]):
+                entry = self._walk_stack(inf, num, depth)
+                if entry is None:
+                    return None
+        fs, rs = self.FS, self.RS
+        stop, frames, _ = entry
+        out  = [f"stack{fs}{num}{fs}{inf}{fs}{stop}"]
+        out += [fs.join(("frame", str(level), path, str(line or ""), name))
+                for level, (path, line, name) in enumerate(frames[:depth])]
+        return (rs.join(out) + rs + "\n").encode('utf-8')
+
+    def _walk_stack(self, inf, num, depth):
+        """Walk thread num's frames into the cache and return its entry,
+        None if it is gone or not stopped. Caller holds _stack_lock."""
+        target = next((t for t, target_id in self._target_ids if target_id == inf), None)
+        if target is None:
+            return None
+        process = target.GetProcess()
+        if not (process and process.IsValid() and process.GetState() == lldb.eStateStopped):
+            return None
+        thread = process.GetThreadByIndexID(num)
+        if not thread.IsValid():
+            return None
+        depth  = max(depth, _STACK_DEPTH)  # so the usual requests hit the cache
+        stop   = self._stops
+        frames = []
+        for i in range(depth):
+            frame = thread.GetFrameAtIndex(i)
+            if not frame.IsValid():
+                break
+            found = self._line_of(frame.GetLineEntry)
+            frames.append((*(found or ("", 0)), frame.GetFunctionName() or ""))
+        complete = len(frames) < depth or not thread.GetFrameAtIndex(depth).IsValid()
+        self._stack_walks += 1
+        if self._stacks[0] != stop:
+            self._stacks = (stop, {})
+        entry = (stop, tuple(frames), complete)
+        self._stacks[1][(inf, num)] = entry
+        return entry
+
+    def _trace_stop(self):
+        """Append the selected thread's position to the history."""
+        with self._lock:
+            selected = self._state["selected_thread"]
+            threads  = self._state["threads"]
+        if selected is None:
+            return
+        inf, num = selected
+        pos = threads.get(inf, {}).get(num)
+        if pos is not None:
+            self._history.append(self._stops, num, self._paths.intern(pos['file']),
+                                 pos['line'], inf)
+
+    def _connect_events(self):
+        """Listen on every current and future process, thread and target."""
+        dbg = self._debugger
+        self._listener.StartListeningForEventClass(
+            dbg, lldb.SBProcess.GetBroadcasterClassName(),
+            lldb.SBProcess.eBroadcastBitStateChanged)
+        self._listener.StartListeningForEventClass(
+            dbg, lldb.SBThread.GetBroadcasterClassName(),
+            lldb.SBThread.eBroadcastBitSelectedFrameChanged |
+            lldb.SBThread.eBroadcastBitThreadSelected)
+        self._listener.StartListeningForEventClass(
+            dbg, lldb.SBTarget.GetBroadcasterClassName(),
+            lldb.SBTarget.eBroadcastBitBreakpointChanged |
+            lldb.SBTarget.eBroadcastBitModulesLoaded |
+            lldb.SBTarget.eBroadcastBitModulesUnloaded |
+            lldb.SBTarget.eBroadcastBitSymbolsLoaded)
+        self._listener.StartListeningForEvents(self._stop_bc, self._STOP_BIT)
+
+    def _event_loop(self):
+        """Handle events in batches: everything queued behind the first
+        one, then a single walk of each process that stopped or switched
+        threads. A breakpoint whose commands continue, or a conditional
+        one hit in a loop, can stop far faster than threads can be walked.
+
+        Starts with _sync_lldb_state, so importing the script does not
+        wait on it; events arriving meanwhile queue on the listener.
+        """
+        try:
+            self._sync_lldb_state()
+        except Exception as e:
+            print(f"[DVAP] Sync failed: {e}")
+        with self._lock:
+            self._state["syncing"] = False
+            self._touch()
+        event = lldb.SBEvent()
+        while not self._disp.stopped.is_set():
+            if not self._listener.WaitForEvent(self._WAIT_FOREVER, event):
+                continue
+            changed = {}
+            while True:
+                if event.BroadcasterMatchesRef(self._stop_bc):
+                    return
+                try:
+                    self._on_event(event, changed)
+                except Exception as e:
+                    print(f"[DVAP] Error handling event: {e}")
+                if not self._listener.GetNextEvent(event):
+                    break
+            try:
+                self._forget_deleted_targets()
+            except Exception as e:
+                print(f"[DVAP] Error handling event: {e}")
+            if changed:
+                try:
+                    self._on_process_changed(list(changed.values()))
+                except Exception as e:
+                    print(f"[DVAP] Error handling event: {e}")
+
+    def _on_event(self, event, changed):
+        """Apply breakpoint and target events; add processes whose threads
+        need a walk to changed, keyed by pid."""
+        if lldb.SBBreakpoint.EventIsBreakpointEvent(event):
+            bp = lldb.SBBreakpoint.GetBreakpointFromEvent(event)
+            if (lldb.SBBreakpoint.GetBreakpointEventTypeFromEvent(event)
+                    == lldb.eBreakpointEventTypeRemoved):
+                self._on_bp_deleted(bp)
+            else:
+                self._on_bp_changed(bp)
+        elif lldb.SBProcess.EventIsProcessEvent(event):
+            if not lldb.SBProcess.GetRestartedFromEvent(event):
+                self._stops += 1
+                process = lldb.SBProcess.GetProcessFromEvent(event)
+                changed[process.GetProcessID()] = process
+        elif lldb.SBThread.EventIsThreadEvent(event):
+            # Selected thread or frame moved
+            self._stops += 1
+            process = lldb.SBThread.GetThreadFromEvent(event).GetProcess()
+            changed[process.GetProcessID()] = process
+        elif lldb.SBTarget.EventIsTargetEvent(event):
+            self._lines.clear()  # modules or symbols changed: cached lines may be stale
+
+    def _sync_lldb_state(self):
+        """Populate state from the current LLDB session on (re-)import.
+        Records carry a syncing marker until this returns."""
+        for target in self._targets():
+            for i in range(target.GetNumBreakpoints()):
+                if self._disp.stopped.is_set():
+                    return
+                self._on_bp_changed(target.GetBreakpointAtIndex(i))
+        self._on_process_changed()
+
+    def _targets(self):
+        dbg = self._debugger
+        return [t for t in map(dbg.GetTargetAtIndex, range(dbg.GetNumTargets())) if t.IsValid()]
+
+    def _target_id(self, target):
+        """The inferior id on records: numbered from 1 in the order targets
+        are first seen and kept for the target's lifetime, so deleting one
+        does not renumber the others. 0 for an invalid target."""
+        if not (target and target.IsValid()):
+            return 0
+        for known, target_id in self._target_ids:
+            if known == target:
+                return target_id
+        self._last_target_id += 1
+        self._target_ids     += ((target, self._last_target_id),)
+        return self._last_target_id
+
+    def _forget_deleted_targets(self):
+        """Drop the ids, threads and breakpoints of targets no longer in the
+        debugger. LLDB broadcasts nothing when a target is deleted, so this
+        runs after every batch of events."""
+        live = self._targets()
+        gone = {target_id for target, target_id in self._target_ids
+                if not any(target == t for t in live)}
+        if not gone:
+            return
+        self._target_ids = tuple(pair for pair in self._target_ids if pair[1] not in gone)
+        with self._lock:
+            selected = self._state["selected_thread"]
+            self._state["threads"] = {target_id: threads for target_id, threads
+                                      in self._state["threads"].items() if target_id not in gone}
+            self._state["breakpoints"] = {key: bp for key, bp
+                                          in self._state["breakpoints"].items()
+                                          if key[0] not in gone}
+            if selected is not None and selected[0] in gone:
+                self._state["selected_thread"] = None
+            self._touch()
+
+    def _touch(self):
+        """Record a state change. Caller must hold self._lock."""
+        self._version += 1
+        self._changed.notify_all()
 
     def _broadcast_loop(self):
+        """Broadcast on state changes only; send heartbeats while idle."""
+        seen = -1
         while not self._disp.stopped.is_set():
-            self._disp.broadcast(self._state_str())
-            self._disp.stopped.wait(0.030)
+            with self._changed:
+                if self._version == seen:
+                    self._changed.wait(self.heartbeat or None)
+                changed = self._version != seen
+                seen    = self._version
+            if self._disp.stopped.is_set():
+                break
+            if not changed:
+                self._disp.heartbeat()
+                if self._relay:
+                    self._relay.push(None)
+                continue
+            records = self._records()
+            if records != self.snapshot.records:  # events may rewrite identical state
+                self._publish(records)
+
+    def _publish(self, records):
+        """Wrap records in a new _Snapshot and fan it out. Payloads are
+        encoded once per client view, on first use."""
+        prev = self.snapshot
+        self.snapshot = _Snapshot(prev.seq + 1, records, prev.records, self._encode)
+        self._disp.broadcast(self.snapshot)
+        if self._relay:
+            self._relay.push(self.snapshot)
+
+    def _records(self):
+        """Cached state as an ordered {key: fields} mapping. No SB API calls.
+
+        The state dicts are replaced, never mutated, so only taking the
+        references needs the lock.
+        """
+        with self._lock:
+            selected    = self._state["selected_thread"]
+            threads     = self._state["threads"]
+            breakpoints = self._state["breakpoints"]
+            syncing     = self._state["syncing"]
+        records = {}
+        if syncing:
+            records[("syncing",)] = ("syncing",)
+        for (target, b_num), b in breakpoints.items():
+            records[("bp", b_num, target)] = ("bp", b_num, b['file'], b['line'],
+                                              b['nonconditional'], b['enabled'], target)
+        if selected is not None:
+            target, t_num = selected
+            records[("selected",)] = ("selected", t_num, 't', target)
+        for target, target_threads in threads.items():
+            for t_num, t in target_threads.items():
+                records[("thread", t_num, target)] = ("thread", t_num, 't', t['file'], t['line'],
+                                                      t['tid'], target)
+        return records
 
     def _state_str(self):
-        """Read current debugger state and format it as a protocol string."""
-        FS, RS = self.FS, self.RS
-        result = ""
-
-        target = self._debugger.GetSelectedTarget()
-        if not target or not target.IsValid():
-            return result
-
-        # Breakpoints
-        for i in range(target.GetNumBreakpoints()):
-            bp  = target.GetBreakpointAtIndex(i)
-            loc = bp.GetLocationAtIndex(0)
-            if not loc.IsValid():  # pending/unresolved
-                continue
-            le        = loc.GetAddress().GetLineEntry()
-            file_path = self._file_path(le.GetFileSpec()) if le.IsValid() else ""
-            line      = le.GetLine() if le.IsValid() else 0
-            result += (f"bp{FS}{bp.GetID()}{FS}{file_path}{FS}{line}"
-                       f"{FS}{'True' if bp.GetCondition() is None else 'False'}"
-                       f"{FS}{'True' if bp.IsEnabled() else 'False'}{RS}")
-
-        # Threads — only meaningful when the process is stopped
-        process = target.GetProcess()
-        if process and process.IsValid() and process.GetState() == lldb.eStateStopped:
-            sel = process.GetSelectedThread()
+        return self._join(map(self._format, self._records().values()))
+
+    def _on_process_changed(self, processes=None):
+        """Re-read the threads of each of processes, or of every target when
+        None. Other targets have not changed and keep their threads; a
+        process that has resumed since its event has none to walk."""
+        t0 = time.perf_counter()
+        self._refreshes += 1
+        if self._unix:
+            self._follow_pid()
+        targets = self._targets() if processes is None else [p.GetTarget() for p in processes]
+        walked  = {self._target_id(t): self._walk_process(t.GetProcess()) for t in targets}
+
+        selected = None
+        target   = self._debugger.GetSelectedTarget()
+        current  = target.GetProcess() if target and target.IsValid() else None
+        if current and current.IsValid() and current.GetState() == lldb.eStateStopped:
+            sel = current.GetSelectedThread()
             if sel.IsValid():
-                result += f"selected{FS}{sel.GetIndexID()}{FS}{'t'}{RS}"
-            for thread in process:
-                frame     = thread.GetSelectedFrame()
-                le        = frame.GetLineEntry() if frame.IsValid() else None
-                file_path = self._file_path(le.GetFileSpec()) if le and le.IsValid() else ""
-                line      = le.GetLine() if le and le.IsValid() else 0
-                result += (f"thread{FS}{thread.GetIndexID()}{FS}{'t'}{FS}{file_path}"
-                           f"{FS}{line}{FS}{thread.GetThreadID()}{RS}")
+                selected = (self._target_id(target), sel.GetIndexID())
 
-        return result
+        with self._lock:
+            threads = dict(self._state["threads"])
+            for target_id, target_threads in walked.items():
+                if target_threads:
+                    threads[target_id] = target_threads
+                else:
+                    threads.pop(target_id, None)
+            self._state["selected_thread"] = selected
+            self._state["threads"]         = threads
+            self._touch()
+        if processes is not None:
+            self._trace_stop()
+        self._stop_hist.observe(time.perf_counter() - t0)
+
+    def _walk_process(self, process):
+        """{thread index id: position}. Threads are only meaningful when the
+        process is stopped."""
+        threads = {}
+        if not (process and process.IsValid() and process.GetState() == lldb.eStateStopped):
+            return threads
+        pid = process.GetProcessID()
+        for thread in process:
+            frame = thread.GetSelectedFrame()
+            found = None
+            if frame.IsValid():
+                # Inlined frames share a pc with their caller but not a line.
+                found = self._lines.get((pid, frame.GetPC(), frame.IsInlined()),
+                                        self._line_of, frame.GetLineEntry)
+            threads[thread.GetIndexID()] = {
+                "file": found[0] if found else "",
+                "line": found[1] if found else 0,
+                "tid":  thread.GetThreadID(),
+            }
+        return threads
+
+    def _on_bp_changed(self, bp):
+        loc = bp.GetLocationAtIndex(0)
+        if not loc.IsValid():  # pending/unresolved
+            self._on_bp_deleted(bp)
+            return
+        addr = loc.GetLoadAddress()
+        if addr == lldb.LLDB_INVALID_ADDRESS:  # not loaded yet: nothing stable to key on
+            found = self._line_of(loc.GetAddress().GetLineEntry)
+        else:
+            process = bp.GetTarget().GetProcess()
+            found   = self._lines.get((process.GetProcessID(), addr, None),
+                                      self._line_of, loc.GetAddress().GetLineEntry)
+        entry = {
+            "file":           found[0] if found else "",
+            "line":           found[1] if found else 0,
+            "nonconditional": bp.GetCondition() is None,
+            "enabled":        bp.IsEnabled(),
+        }
+        key = (self._target_id(bp.GetTarget()), bp.GetID())
+        with self._lock:
+            # Copy-on-write: _records() may be reading the old dict.
+            breakpoints = dict(self._state["breakpoints"])
+            breakpoints[key] = entry
+            self._state["breakpoints"] = breakpoints
+            self._touch()
+
+    def _on_bp_deleted(self, bp):
+        key = (self._target_id(bp.GetTarget()), bp.GetID())
+        with self._lock:
+            if key in self._state["breakpoints"]:
+                breakpoints = dict(self._state["breakpoints"])
+                del breakpoints[key]
+                self._state["breakpoints"] = breakpoints
+                self._touch()
+
+    @classmethod
+    def _line_of(cls, get_line_entry):
+        """(path, line) from get_line_entry(), or None without line info."""
+        le = get_line_entry()
+        if not le.IsValid():
+            return None
+        return cls._file_path(le.GetFileSpec()), le.GetLine()
 
     @staticmethod
     def _file_path(file_spec):
@@ -201,12 +2096,23 @@ class DVAPServer:
         return os.path.join(directory, filename) if directory else filename
 
 
+if __name__ == '__dvap_relay__':
+    sys.exit(_relay_main(sys.argv[2:]))
+
+
+def _start(debugger):
+    """(Re)start the server with the current lldb._dvap_* settings."""
+    if getattr(lldb, '_dvap_instance', None) is not None:
+        print("[DVAP] Restarting: shutting down previous instance...")
+        lldb._dvap_instance.shutdown()
+    lldb._dvap_instance = DVAPServer(lldb._dvap_port, debugger, lldb._dvap_heartbeat,
+                                     lldb._dvap_transport, lldb._dvap_slow_clients,
+                                     lldb._dvap_unix_socket, lldb._dvap_history,
+                                     lldb._dvap_relay)
+
+
 def _dvap_start_cmd(debugger, command, exe_ctx, result, internal_dict):
-    path = getattr(lldb, '_dvap_script_path', None)
-    if path is None:
-        result.AppendMessage("[DVAP] Script path unknown.")
-        return
-    debugger.HandleCommand(f'command script import --allow-reload "{path}"')
+    _start(debugger)
 
 
 def _dvap_stop_cmd(debugger, command, exe_ctx, result, internal_dict):
@@ -216,14 +2122,40 @@ def _dvap_stop_cmd(debugger, command, exe_ctx, result, internal_dict):
         return
     inst.shutdown()
     lldb._dvap_instance = None
-    result.AppendMessage("[DVAP] Server stopped. Re-source the script to restart.")
+    result.AppendMessage("[DVAP] Server stopped. dvap-start restarts it.")
 
 
 def _dvap_show_cmd(debugger, command, exe_ctx, result, internal_dict):
     inst   = getattr(lldb, '_dvap_instance', None)
     status = "running" if inst is not None else "stopped"
+    if inst is not None and inst._state["syncing"]:
+        status += " (syncing)"
     result.AppendMessage(f"[DVAP] Status: {status}")
     result.AppendMessage(f"[DVAP] Port:   {lldb._dvap_port}")
+    result.AppendMessage(f"[DVAP] Heartbeat: {lldb._dvap_heartbeat}s")
+    result.AppendMessage(f"[DVAP] Transport: {lldb._dvap_transport}")
+    result.AppendMessage(f"[DVAP] Slow clients: {lldb._dvap_slow_clients}")
+    result.AppendMessage(f"[DVAP] Unix socket: {'on' if lldb._dvap_unix_socket else 'off'}")
+    if inst is not None and inst.unix_path:
+        result.AppendMessage(f"[DVAP] Socket path: {inst.unix_path}")
+    result.AppendMessage(f"[DVAP] History: {lldb._dvap_history} stops")
+    relay = 'on' if lldb._dvap_relay else 'off'
+    if inst is not None and inst._relay:
+        relay += f" (process {inst._relay.proc.pid})"
+    result.AppendMessage(f"[DVAP] Relay: {relay}")
+    if inst is not None:
+        lines = inst._lines
+        result.AppendMessage(f"[DVAP] Line cache: {len(lines)}/{lines.size} entries,"
+                             f" {lines.hits} hits, {lines.misses} misses")
+
+
+def _dvap_stats_cmd(debugger, command, exe_ctx, result, internal_dict):
+    inst = getattr(lldb, '_dvap_instance', None)
+    if inst is None:
+        result.AppendMessage("[DVAP] No server running.")
+        return
+    for line in inst.stats():
+        result.AppendMessage(f"[DVAP] {line}")
 
 
 def _dvap_set_cmd(debugger, command, exe_ctx, result, internal_dict):
@@ -232,12 +2164,51 @@ def _dvap_set_cmd(debugger, command, exe_ctx, result, internal_dict):
         try:
             lldb._dvap_port = int(parts[1])
             result.AppendMessage(
-                f"[DVAP] Port set to {lldb._dvap_port}. Re-source the script to apply."
+                f"[DVAP] Port set to {lldb._dvap_port}. dvap-start to apply."
             )
             return
         except ValueError:
             pass
-    result.AppendMessage("Usage: dvap-set port <N>")
+    if len(parts) == 2 and parts[0] == 'heartbeat':
+        try:
+            lldb._dvap_heartbeat = max(0, int(parts[1]))
+            inst = getattr(lldb, '_dvap_instance', None)
+            if inst is not None:
+                inst.heartbeat = lldb._dvap_heartbeat
+            result.AppendMessage(f"[DVAP] Heartbeat set to {lldb._dvap_heartbeat}s.")
+            return
+        except ValueError:
+            pass
+    if len(parts) == 2 and parts[0] == 'history':
+        try:
+            lldb._dvap_history = max(0, int(parts[1]))
+            result.AppendMessage(f"[DVAP] History set to {lldb._dvap_history} stops."
+                                 " dvap-start to apply.")
+            return
+        except ValueError:
+            pass
+    if len(parts) == 2 and parts[0] == 'transport' and parts[1] in ('threaded', 'selector'):
+        lldb._dvap_transport = parts[1]
+        result.AppendMessage(f"[DVAP] Transport set to {parts[1]}. dvap-start to apply.")
+        return
+    if len(parts) == 2 and parts[0] == 'slow-clients' and parts[1] in ('latest', 'drop'):
+        lldb._dvap_slow_clients = parts[1]
+        result.AppendMessage(
+            f"[DVAP] Slow-client policy set to {parts[1]}. dvap-start to apply.")
+        return
+    if len(parts) == 2 and parts[0] == 'unix-socket' and parts[1] in ('on', 'off'):
+        lldb._dvap_unix_socket = parts[1] == 'on'
+        result.AppendMessage(f"[DVAP] Unix socket {parts[1]}. dvap-start to apply.")
+        return
+    if len(parts) == 2 and parts[0] == 'relay' and parts[1] in ('on', 'off'):
+        lldb._dvap_relay = parts[1] == 'on'
+        result.AppendMessage(f"[DVAP] Relay {parts[1]}. dvap-start to apply.")
+        return
+    result.AppendMessage("Usage: dvap-set port|heartbeat|history <N>\n"
+                         "       dvap-set transport threaded|selector\n"
+                         "       dvap-set slow-clients latest|drop\n"
+                         "       dvap-set unix-socket on|off\n"
+                         "       dvap-set relay on|off")
 
 
 def _dvap_help_cmd(debugger, command, exe_ctx, result, internal_dict):
@@ -247,26 +2218,43 @@ def _dvap_help_cmd(debugger, command, exe_ctx, result, internal_dict):
         "Commands:\n"
         "  dvap-help            Show this message\n"
         "  dvap-show            Show server status and port\n"
+        "  dvap-stats           Show broadcast, client and timing counters\n"
         "  dvap-start           Start or restart the server\n"
         "  dvap-stop            Stop the server\n"
         "  dvap-set port <N>    Change the port (dvap-start to apply)\n"
+        "  dvap-set heartbeat <N>\n"
+        "                       Seconds between idle keepalives (0 = off)\n"
+        "  dvap-set transport threaded|selector\n"
+        "                       Thread per client, or one thread for all\n"
+        "                       (dvap-start to apply)\n"
+        "  dvap-set slow-clients latest|drop\n"
+        "                       Skip a lagging client to the latest state,\n"
+        "                       or disconnect it (dvap-start to apply)\n"
+        "  dvap-set unix-socket on|off\n"
+        "                       Also listen on <dir>/<inferior pid>.sock\n"
+        "                       (dvap-start to apply; dvap-show prints it)\n"
+        "  dvap-set history <N> Stops kept for /history (0 = off; dvap-start\n"
+        "                       to apply)\n"
+        "  dvap-set relay on|off\n"
+        "                       Serve TCP clients from a helper process\n"
+        "                       (dvap-start to apply)\n"
         "\n"
         "First source:\n"
         "  command script import <path/to/DVAP_lldb_server.py>\n"
         "\n"
-        "SSE endpoint:  curl http://localhost:<port>/events"
+        "SSE endpoint:  curl http://localhost:<port>/events\n"
+        "               curl --unix-socket <path> http://localhost/events\n"
+        "Polling:       curl http://localhost:<port>/state?since=<version>\n"
+        "Metrics:       curl http://localhost:<port>/metrics\n"
+        "Stop history:  curl http://localhost:<port>/history?since=<seq>\n"
+        "Call stack:    curl http://localhost:<port>/threads/<id>/stack?depth=<N>"
     )
 
 
 def __lldb_init_module(debugger, internal_dict):
-    lldb._dvap_script_path = os.path.abspath(__file__)
-
-    if getattr(lldb, '_dvap_instance', None) is not None:
-        print("[DVAP] Re-sourcing: shutting down previous instance...")
-        lldb._dvap_instance.shutdown()
-    lldb._dvap_instance = DVAPServer(lldb._dvap_port, debugger)
+    _start(debugger)
 
-    for name in ('dvap-start', 'dvap-stop', 'dvap-show', 'dvap-set', 'dvap-help'):
+    for name in ('dvap-start', 'dvap-stop', 'dvap-show', 'dvap-stats', 'dvap-set', 'dvap-help'):
         fn = name.replace('-', '_')
         debugger.HandleCommand(
             f'command script add --overwrite -f {__name__}._{fn}_cmd {name}'